@@ -0,0 +1,189 @@
+"""确定性自动修复 — 把 tsx / 静态检查报错归一化为指纹，已知问题本地打补丁后直接重跑
+
+指纹出现频次追加记录在 ~/.flowing/fingerprints.jsonl，
+用于从实际日志中发现下一条值得写成规则的高频错误：python autofix.py
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from config import CONFIG_DIR
+from executor import FLOWING_ROOT
+from validator import _call_args, _line_of, load_api_spec
+
+STATS_FILE = CONFIG_DIR / "fingerprints.jsonl"
+
+
+# ========== 指纹 ==========
+
+_ERROR_LINE = re.compile(r"\b\w*(?:Error|Exception)\b|\bERR_\w+|^- \[\w+\]")
+
+
+def _normalize(line: str) -> str:
+    line = re.sub(r"(?:/[\w.@+-]+)+\.(?:ts|js|mjs|cjs)\b", "<file>", line)
+    line = re.sub(r"(?:[A-Za-z]:)?(?:/[\w.@+-]+){2,}/?", "<path>", line)
+    line = re.sub(r"[\w.-]+\.(?:ts|js|png|svg|jpg|jpeg|webp|pdf)\b", "<file>", line)
+    line = re.sub(r":\d+(?::\d+)?", ":N", line)
+    line = re.sub(r"第 \d+ 行", "第 N 行", line)
+    return re.sub(r"\s+", " ", line)
+
+
+def fingerprint(error: str) -> str:
+    """去掉临时路径、行列号、文件名和堆栈，只保留错误类型与消息"""
+    lines = []
+    for line in error.splitlines():
+        line = line.strip()
+        # 堆栈帧、脱字符标记、静态检查的标题行
+        if (not line or line.startswith("at ") or re.fullmatch(r"[\s^~]+", line)
+                or line.startswith("静态检查未通过")):
+            continue
+        lines.append(line)
+    # 优先取真正的错误行，跳过 node 打印的 文件:行号 和源码回显
+    picked = [l for l in lines if _ERROR_LINE.search(l)] or lines
+    return " | ".join(_normalize(l) for l in picked[:2]) or "<empty>"
+
+
+class FingerprintStats:
+    """指纹出现次数与本地修补次数；每次追加一行到 JSONL 文件，读取时汇总
+
+    只追加不改写：多个进程同时记录不会互相覆盖，写到一半的行在汇总时跳过。
+    """
+
+    def __init__(self, path=STATS_FILE):
+        self.path = path
+
+    def _load(self) -> dict:
+        data: dict = {}
+        if not self.path:
+            return data
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                        entry = data.setdefault(
+                            row["fp"], {"count": 0, "patched": 0, "example": row["example"]})
+                        entry["count"] += 1
+                        if row.get("rule"):
+                            entry["patched"] += 1
+                            entry["rule"] = row["rule"]
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue
+        except OSError:
+            pass
+        return data
+
+    def record(self, fp: str, error: str, fixed_by: Optional[str] = None) -> None:
+        if not self.path:
+            return
+        line = json.dumps({"fp": fp, "example": error[:500], "rule": fixed_by},
+                          ensure_ascii=False) + "\n"
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            pass
+
+    def top(self, n: int = 20) -> List[Tuple[str, dict]]:
+        data = self._load()
+        return sorted(data.items(), key=lambda kv: kv[1]["count"], reverse=True)[:n]
+
+
+# ========== 规则 ==========
+
+@dataclass
+class Rule:
+    name: str
+    # 在原始报错上匹配（不是指纹，需要其中的具体取值）
+    pattern: str
+    apply: Callable[[str, re.Match, Optional[str]], Optional[str]]
+
+
+def _fix_import(code: str, m: re.Match, output_dir: Optional[str]) -> Optional[str]:
+    return re.sub(
+        r"""(import\s*\{[^}]*\bFigure\b[^}]*\}\s*from\s*)(['"])[^'"]+\2""",
+        lambda im: f"{im.group(1)}'{FLOWING_ROOT}/src'", code, count=1,
+    )
+
+
+def _add_main_call(code: str, m: re.Match, output_dir: Optional[str]) -> Optional[str]:
+    return code.rstrip() + "\n\nmain()\n"
+
+
+def _fix_export_dir(code: str, m: re.Match, output_dir: Optional[str]) -> Optional[str]:
+    if not output_dir:
+        return None
+    root = os.path.abspath(output_dir)
+
+    def move(em: re.Match) -> str:
+        prefix, quote, target = em.groups()
+        # 与静态检查一致：相对路径以 tsx 的工作目录 FLOWING_ROOT 为基准
+        resolved = target if os.path.isabs(target) else os.path.join(FLOWING_ROOT, target)
+        if os.path.normpath(resolved).startswith(root + os.sep):
+            return em.group(0)
+        return f"{prefix}{quote}{os.path.join(root, os.path.basename(target))}{quote}"
+
+    return re.sub(r"""(\.export\(\s*)(['"])([^'"]+)\2""", move, code)
+
+
+# 常见的非法枚举写法 → 合法取值
+ENUM_ALIASES = {
+    "head": {"arrow": "triangle", "filled": "triangle", "open": "vee", "normal": "triangle",
+             "latex": "stealth", "circle-filled": "circle", "square": "bar"},
+    "path": {"bezier": "curve", "curved": "curve", "orthogonal": "polyline",
+             "elbow": "polyline", "step": "polyline", "line": "straight", "direct": "straight"},
+    "style": {"dash": "dashed", "dot": "dotted", "line": "solid", "normal": "solid"},
+    "from": {"up": "top", "down": "bottom", "north": "top", "south": "bottom",
+             "west": "left", "east": "right"},
+}
+ENUM_ALIASES["to"] = ENUM_ALIASES["side"] = ENUM_ALIASES["from"]
+
+
+def _fix_enum(code: str, m: re.Match, output_dir: Optional[str]) -> Optional[str]:
+    line, key, bad = m.group(1), m.group(2), m.group(3)
+    good = ENUM_ALIASES.get(key, {}).get(bad.lower())
+    if not good or not line:
+        return None
+    # 只改报错行上箭头调用实参里的取值，同名键出现在别的调用（如 label 的 style）不动
+    pattern = re.compile(rf"""(\b{key}\s*:\s*)(['"]){re.escape(bad)}\2""")
+    spans = set()
+    for start, args in _call_args(code, load_api_spec().arrow_methods):
+        for km in pattern.finditer(args):
+            if _line_of(code, start + km.start()) == int(line):
+                spans.add((start + km.start(), start + km.end(), km.group(1)))
+    for begin, end, prefix in sorted(spans, reverse=True):
+        code = f"{code[:begin]}{prefix}'{good}'{code[end:]}"
+    return code if spans else None
+
+
+RULES: List[Rule] = [
+    Rule("import_path",
+         r"\[import\]|Cannot find module '[^']*(?:figcraft|flowing|/src)[^']*'", _fix_import),
+    Rule("missing_main", r"\[main\]", _add_main_call),
+    Rule("export_dir",
+         r"\[export_dir\]|ENOENT[^\n]*open '[^']+\.(?:png|svg|jpg|jpeg|webp|pdf)'", _fix_export_dir),
+    Rule("enum_alias", r"\[enum\] (?:第 (\d+) 行: )?(\w+): '([^']*)' 无效", _fix_enum),
+]
+
+
+def try_autofix(code: str, error: str,
+                output_dir: Optional[str] = None) -> Tuple[Optional[str], List[str]]:
+    """依次套用命中的规则，返回 (修补后的代码或 None, 生效的规则名)"""
+    patched, applied = code, []
+    for rule in RULES:
+        for m in re.finditer(rule.pattern, error):
+            new = rule.apply(patched, m, output_dir)
+            if new and new != patched:
+                patched = new
+                if rule.name not in applied:
+                    applied.append(rule.name)
+    return (patched if applied else None), applied
+
+
+if __name__ == "__main__":
+    for fp, entry in FingerprintStats().top():
+        print(f"{entry['count']:>5}  本地修补 {entry['patched']:>4}  {fp}")
@@ -0,0 +1,154 @@
+"""批量模式 — JSONL 输入描述，JSONL 输出结果，有限并发"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Iterator, Optional
+
+from langchain_core.messages import HumanMessage
+
+from executor import CODE_MODE, save_artifacts
+from metrics import percentile, tracer, turn_stats
+from prompt import build_system_message, prompt_cache_usage
+
+
+def read_prompts(path: str) -> Iterator[dict]:
+    """读取输入文件：每行 {"id": ..., "prompt": ...} 或纯字符串；id 缺省为行号"""
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"prompt": item}
+            item["id"] = str(item.get("id", lineno))
+            yield item
+
+
+def finished_ids(path: str) -> set:
+    """已写入结果文件的 id，用于断点续跑；末尾写了一半的行会被忽略"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def _terminate_partial_line(path: str) -> None:
+    """上次中断时可能留下没有换行的半行，补上换行再追加"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _safe_name(s: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", s)[:64] or "item"
+
+
+async def run_one(app, item: dict, output_dir: str, provider: Optional[str] = None,
+                  compact: bool = False, output_mode: str = CODE_MODE) -> dict:
+    """对单条描述跑完整个异步工作流，返回结果行"""
+    # 每条请求单独一个输出目录，避免并发请求写同名文件
+    item_dir = os.path.join(output_dir, _safe_name(item["id"]))
+    os.makedirs(item_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    row = {"id": item["id"], "prompt": item["prompt"]}
+    try:
+        with tracer.span("request", mode="batch", id=item["id"]) as span:
+            result = await app.ainvoke({
+                "messages": [
+                    build_system_message(item_dir, provider, compact, output_mode),
+                    HumanMessage(content=item["prompt"]),
+                ],
+                "last_code": None,
+                "output_file": None,
+                "retry_count": 0,
+                "error": None,
+                "output_dir": item_dir,
+            })
+            span["ok"] = not result.get("error")
+        save_artifacts(result.get("artifacts") or [])
+        messages = result.get("messages", [])
+        retries, tokens = turn_stats(messages)
+        tracer.record_request(retries, tokens)
+        row.update({
+            "success": not result.get("error"),
+            "code": result.get("last_code"),
+            "output_file": result.get("output_file"),
+            "error": result.get("error"),
+            "retries": retries,
+            "usage": {**prompt_cache_usage(messages), "total": tokens},
+            "context": result.get("context_sources") or [],
+            "tier": result.get("tier"),
+            "complexity": result.get("complexity"),
+        })
+    except Exception as e:
+        row.update({"success": False, "code": None, "output_file": None,
+                    "error": str(e), "retries": 0})
+    row["timings"] = {"total": round(time.perf_counter() - start, 3)}
+    return row
+
+
+async def arun_batch(app, prompts_path: str, out_path: str, concurrency: int = 4,
+                     output_dir: str = ".", provider: Optional[str] = None,
+                     compact: bool = False, output_mode: str = CODE_MODE) -> dict:
+    """在同一个事件循环里并发执行所有未完成的描述，每完成一条立即追加写入 out_path
+
+    app 须为 build_async_graph() 的结果；带 retriever 构建时 compact 应为 True，
+    output_mode 与构建 app 时一致。
+    """
+    done = finished_ids(out_path)
+    todo = [item for item in read_prompts(prompts_path) if item["id"] not in done]
+    print(f"批量任务: 共 {len(todo) + len(done)} 条，已完成 {len(done)} 条，"
+          f"待处理 {len(todo)} 条，并发 {concurrency}")
+
+    ok = failed = 0
+    totals = []
+    start = time.perf_counter()
+    _terminate_partial_line(out_path)
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(item):
+        async with sem:
+            return await run_one(app, item, output_dir, provider, compact, output_mode)
+
+    with open(out_path, "a", encoding="utf-8") as out:
+        for fut in asyncio.as_completed([bounded(item) for item in todo]):
+            row = await fut
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            totals.append(row["timings"]["total"])
+            if row["success"]:
+                ok += 1
+            else:
+                failed += 1
+            print(f"[{ok + failed}/{len(todo)}] {row['id']}: "
+                  f"{'成功' if row['success'] else '失败'} ({row['timings']['total']:.1f}s)")
+
+    elapsed = time.perf_counter() - start
+    summary = {"succeeded": ok, "failed": failed, "skipped": len(done),
+               "elapsed": round(elapsed, 3),
+               "p50": percentile(totals, 50), "p95": percentile(totals, 95)}
+    print(f"完成: 成功 {ok}，失败 {failed}，耗时 {elapsed:.1f}s，"
+          f"单条 p50 {summary['p50']:.1f}s / p95 {summary['p95']:.1f}s")
+    return summary
+
+
+def run_batch(app, prompts_path: str, out_path: str, concurrency: int = 4,
+              output_dir: str = ".", provider: Optional[str] = None,
+              compact: bool = False, output_mode: str = CODE_MODE) -> dict:
+    """arun_batch 的同步入口"""
+    return asyncio.run(arun_batch(app, prompts_path, out_path, concurrency,
+                                  output_dir, provider, compact, output_mode))
@@ -0,0 +1,595 @@
+"""离线基准测试 — 用回放固定回复的假 LLM 跑完整工作流，不需要真实服务商
+
+回复由 examples/*.ts 生成，另有故意写坏的变体触发本地修补与 LLM 修复循环。
+结果输出为 JSON，便于在版本之间比较:
+
+    python bench.py --quick --out bench.json
+    python bench.py --examples flowchart,basic --reps 5 --concurrency 1,4,8
+    python bench.py --startup            # 只测启动耗时，超出预算时退出码为 1
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Annotated, Dict, List, Optional, Sequence
+from typing_extensions import TypedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.graph import END, StateGraph
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import graph
+import metrics
+from batch import arun_batch
+from cache import figcraft_version
+from executor import FLOWING_ROOT, configure_pool, execute_code, shutdown_pool
+from history import MessageLog, append_messages, estimate_tokens, is_fix_message
+from metrics import percentile, turn_stats
+from prompt import build_system_message
+from ratelimit import RateLimitedLLM, RateLimiter
+from retrieval import Retriever, strip_context
+
+EXAMPLES_DIR = Path(FLOWING_ROOT) / "examples"
+# 回复模板中的输出目录占位符，回放时替换为 system prompt 里的 OUTPUT_DIR
+OUTPUT_PLACEHOLDER = "<OUTPUT_DIR>"
+QUICK_EXAMPLES = ("basic", "flowchart", "arrows-demo")
+# import main 的耗时预算（秒），以及启动时不应加载的模块
+STARTUP_BUDGET = 1.0
+LAZY_MODULES = ("langgraph", "langchain_openai", "langchain_anthropic", "graph")
+
+
+# ========== 假 LLM ==========
+
+class ReplayChatModel(BaseChatModel):
+    """按场景回放固定回复
+
+    最近一条用户请求（非修复请求，去掉检索附加的参考资料）即场景名；
+    之后第 n 次修复请求返回 scenarios[name][n]。
+    回复只由对话内容决定，与并发顺序无关。
+    """
+
+    scenarios: Dict[str, List[str]]
+    # 模拟的 LLM 延迟（秒），默认 0 以便只测本地开销
+    delay: float = 0.0
+    chunk_size: int = 256
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _reply(self, messages) -> str:
+        requests = [m for m in messages if isinstance(m, HumanMessage) and not is_fix_message(m)]
+        name = strip_context(requests[-1].content) if requests else ""
+        replies = self.scenarios.get(name)
+        if not replies:
+            return f"未知场景: {name}"
+        nth = sum(is_fix_message(m) for m in messages)
+        text = replies[min(nth, len(replies) - 1)]
+
+        system = next((m for m in messages if isinstance(m, SystemMessage)), None)
+        content = system.content if system else ""
+        if not isinstance(content, str):
+            content = "".join(b.get("text", "") for b in content if isinstance(b, dict))
+        m = re.search(r"^OUTPUT_DIR = (.+)$", content, re.M)
+        return text.replace(OUTPUT_PLACEHOLDER, m.group(1).strip() if m else tempfile.gettempdir())
+
+    def _usage(self, messages, text: str) -> dict:
+        prompt = sum(estimate_tokens(str(m.content)) for m in messages)
+        output = estimate_tokens(text)
+        return {"input_tokens": prompt, "output_tokens": output, "total_tokens": prompt + output}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.delay:
+            time.sleep(self.delay)
+        text = self._reply(messages)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+        text = self._reply(messages)
+        for i in range(0, len(text), self.chunk_size):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_size]))
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata=self._usage(messages, text)))
+
+
+# ========== 场景 ==========
+
+def example_template(source: str) -> str:
+    """把示例脚本改写为 agent 风格的代码：绝对 import 路径，导出到输出目录"""
+    code = re.sub(r"""from\s+(['"])\.\./src(/[^'"]*)?\1""",
+                  lambda m: f"from '{FLOWING_ROOT}/src{m.group(2) or ''}'", source)
+    return re.sub(r"""(\.export\(\s*)(['"])(?:[^'"]*/)?([^'"/]+)\2""",
+                  lambda m: f"{m.group(1)}'{OUTPUT_PLACEHOLDER}/{m.group(3)}'", code)
+
+
+def _fence(code: str) -> str:
+    return f"```typescript\n{code}\n```"
+
+
+def load_templates(names: List[str]) -> Dict[str, str]:
+    return {
+        name: example_template((EXAMPLES_DIR / f"{name}.ts").read_text(encoding="utf-8"))
+        for name in names
+    }
+
+
+def build_scenarios(templates: Dict[str, str]) -> Dict[str, List[str]]:
+    """每个示例三个场景: 直接成功 / import 错误（本地修补）/ 运行时错误（LLM 修复一次）"""
+    scenarios = {}
+    for name, good in templates.items():
+        bad_import = good.replace(f"'{FLOWING_ROOT}/src'", "'figcraft'", 1)
+        # 放在首个 import 之后，保证其余代码不变
+        bad_runtime = re.sub(r"^(import .*)$", r"\1\nthrow new Error('bench: injected failure')",
+                             good, count=1, flags=re.M)
+        scenarios[name] = [_fence(good)]
+        scenarios[f"{name}#import"] = [_fence(bad_import), _fence(good)]
+        scenarios[f"{name}#runtime"] = [_fence(bad_runtime), _fence(good)]
+    return scenarios
+
+
+def all_examples() -> List[str]:
+    return sorted(p.stem for p in EXAMPLES_DIR.glob("*.ts"))
+
+
+# ========== 测量 ==========
+
+def _dist(values: List[float]) -> dict:
+    return {
+        "n": len(values),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+    }
+
+
+def _timed_runs(codes: List[str], reps: int) -> dict:
+    times, ok = [], 0
+    for _ in range(reps):
+        for code in codes:
+            start = time.perf_counter()
+            result = execute_code(code)
+            times.append(time.perf_counter() - start)
+            ok += result.success
+    return {**_dist(times), "succeeded": ok}
+
+
+def bench_execute(templates: Dict[str, str], out_dir: str, reps: int) -> dict:
+    """冷启动（每次 npx tsx）与常驻 worker 的 execute_code 延迟"""
+    codes = [t.replace(OUTPUT_PLACEHOLDER, out_dir) for t in templates.values()]
+    shutdown_pool()
+    cold = _timed_runs(codes, reps)
+
+    configure_pool({"pool_size": 1, "job_timeout": 30, "max_jobs": 10_000})
+    execute_code(codes[0])  # 等 worker 就绪，不计时
+    warm = _timed_runs(codes, reps)
+    shutdown_pool()
+    return {"cold": cold, "warm": warm}
+
+
+def _read_traces(path: Path) -> Dict[str, List[dict]]:
+    traces = defaultdict(list)
+    if path.exists():
+        for line in path.read_text(encoding="utf-8").splitlines():
+            span = json.loads(line)
+            traces[span["trace"]].append(span)
+    return traces
+
+
+def bench_graph(model: ReplayChatModel, out_dir: str, trace_path: Path, stream: bool,
+                retriever: Optional[Retriever] = None) -> dict:
+    """每轮的图开销 = 整个请求耗时 − tsx 执行耗时
+
+    同时统计每轮首次生成的输入 token（prompt 大小）与 LLM 修复次数；
+    retriever 不为空时使用精简 system prompt + 检索到的参考资料。
+    """
+    app = graph.build_graph(model, cache=None, stream=stream, retriever=retriever)
+    metrics.tracer.path = trace_path
+    outcomes, retries = {}, []
+    for name in model.scenarios:
+        with metrics.tracer.span("request", scenario=name) as span:
+            result = app.invoke({
+                "messages": [build_system_message(out_dir, compact=retriever is not None),
+                             HumanMessage(content=name)],
+                "last_code": None,
+                "output_file": None,
+                "retry_count": 0,
+                "error": None,
+                "output_dir": out_dir,
+            })
+            span["ok"] = not result.get("error")
+        outcomes[name] = span["ok"]
+        retries.append(turn_stats(result.get("messages", []))[0])
+    metrics.tracer.path = None
+    metrics.tracer.flush()
+
+    overhead, prompt_tokens, by_stage = [], [], defaultdict(list)
+    for spans in _read_traces(trace_path).values():
+        request = next((s for s in spans if s["stage"] == "request"), None)
+        if not request:
+            continue
+        executed = sum(s["duration"] for s in spans if s["stage"] == "execute_code")
+        overhead.append(max(0.0, request["duration"] - executed))
+        generated = sorted((s for s in spans if s["stage"] == "generate"), key=lambda s: s["ts"])
+        if generated:
+            prompt_tokens.append(generated[0].get("input_tokens", 0))
+        for s in spans:
+            by_stage[s["stage"]].append(s["duration"])
+    return {
+        "turns": len(outcomes),
+        "succeeded": sum(outcomes.values()),
+        "overhead": _dist(overhead),
+        "prompt_tokens": _dist(prompt_tokens),
+        "retries": _dist(retries),
+        "stages": {stage: _dist(v) for stage, v in sorted(by_stage.items())},
+    }
+
+
+def bench_batch(model: ReplayChatModel, work_dir: Path, levels: List[int]) -> List[dict]:
+    """异步批量模式在不同并发下的吞吐"""
+    prompts = work_dir / "prompts.jsonl"
+    prompts.write_text("".join(
+        json.dumps({"id": f"{i}", "prompt": name}, ensure_ascii=False) + "\n"
+        for i, name in enumerate(model.scenarios)), encoding="utf-8")
+
+    rows = []
+    for level in levels:
+        out = work_dir / f"batch-c{level}.jsonl"
+        app = graph.build_async_graph(model, cache=None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = asyncio.run(arun_batch(app, str(prompts), str(out), level,
+                                             str(work_dir / f"out-c{level}")))
+        done = summary["succeeded"] + summary["failed"]
+        rows.append({
+            "concurrency": level,
+            "items": done,
+            "succeeded": summary["succeeded"],
+            "elapsed": summary["elapsed"],
+            "throughput": round(done / summary["elapsed"], 3) if summary["elapsed"] else 0.0,
+            "p50": summary["p50"],
+            "p95": summary["p95"],
+        })
+    return rows
+
+
+_IMPORT_LINE = re.compile(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)")
+
+
+def _import_times() -> Dict[str, tuple]:
+    """在新进程中 python -X importtime -c "import main"
+
+    返回 main 及其依赖的 {模块: (累计微秒, 相对 main 的层级)}，不含解释器启动时的导入。
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    entries = [(m.group(4), int(m.group(2)), len(m.group(3)))
+               for m in map(_IMPORT_LINE.match, proc.stderr.splitlines()) if m]
+    end = next(i for i, (name, _, _) in enumerate(entries) if name == "main")
+    base = entries[end][2]
+    start = end
+    # importtime 先输出子模块，向前找到 main 这一棵子树的起点
+    while start > 0 and entries[start - 1][2] > base:
+        start -= 1
+    return {name: (us, (indent - base) // 2) for name, us, indent in entries[start:end + 1]}
+
+
+def bench_startup(reps: int, budget: float = STARTUP_BUDGET) -> dict:
+    """import main 的耗时（取中位数）与最慢的直接依赖；检查重依赖是否仍在延迟加载"""
+    runs = [_import_times() for _ in range(max(1, reps))]
+    totals = [r["main"][0] / 1e6 for r in runs]
+    median = sorted(totals)[len(totals) // 2]
+    last = runs[totals.index(median)]
+    top = sorted(((name, us) for name, (us, depth) in last.items() if depth == 1),
+                 key=lambda kv: kv[1], reverse=True)[:10]
+    eager = sorted({name.split(".")[0] for name in last} & set(LAZY_MODULES))
+    return {
+        "import_main": _dist(totals),
+        "top_modules": {name: round(us / 1e6, 4) for name, us in top},
+        "eager_modules": eager,
+        "budget": budget,
+        "within_budget": median <= budget and not eager,
+    }
+
+
+# 会话基准中 messages reducer 的累计耗时
+_reducer_seconds = [0.0]
+
+
+def _timed(reducer):
+    def wrapper(a, b):
+        start = time.perf_counter()
+        try:
+            return reducer(a, b)
+        finally:
+            _reducer_seconds[0] += time.perf_counter() - start
+    return wrapper
+
+
+class _ListState(TypedDict):
+    """旧的 reducer：每次节点更新都复制整段对话"""
+    messages: Annotated[Sequence[BaseMessage], _timed(lambda a, b: list(a) + list(b))]
+    step: int
+
+
+class _LogState(TypedDict):
+    messages: Annotated[Sequence[BaseMessage], _timed(append_messages)]
+    step: int
+
+
+def _session_graph(state_type, steps: int):
+    """每轮 steps 个节点，每个节点追加一条消息（模拟 生成 / 执行 / 修复 的往返）"""
+    def node(state):
+        return {"messages": [AIMessage(content="ok")], "step": state["step"] + 1}
+
+    graph = StateGraph(state_type)
+    graph.add_node("node", node)
+    graph.set_entry_point("node")
+    graph.add_conditional_edges("node", lambda s: "node" if s["step"] < steps else "done",
+                                {"node": "node", "done": END})
+    return graph.compile()
+
+
+def _session_costs(state_type, turns: int, steps: int, trace_memory: bool) -> List[tuple]:
+    """一个不压缩历史的长会话，返回每轮 (分配峰值字节, reducer 耗时, 总耗时)
+
+    tracemalloc 会显著拖慢分配，计时与测内存分两次跑。
+    """
+    app = _session_graph(state_type, steps)
+    log = state_type is _LogState
+    history = MessageLog([SystemMessage(content="system")]) if log else [SystemMessage(content="system")]
+    costs = []
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for turn in range(turns):
+            request = [HumanMessage(content=f"turn {turn}")]
+            history = history.extend(request) if log else list(history) + request
+            if trace_memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            # 循环垃圾回收放到计时之外，减少抖动
+            gc.disable()
+            _reducer_seconds[0] = 0.0
+            start = time.perf_counter()
+            try:
+                result = app.invoke({"messages": history, "step": 0})
+            finally:
+                gc.enable()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base if trace_memory else 0
+            costs.append((peak, _reducer_seconds[0], elapsed))
+            history = result["messages"] if log else list(result["messages"])
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return costs
+
+
+def bench_memory(turns: int = 300, steps: int = 8) -> dict:
+    """不压缩历史的长会话里逐轮的开销：首尾各 10% 轮次的平均值
+
+    旧 reducer 每步复制整段对话，单轮开销随会话长度线性增长（整场会话为平方级）；
+    MessageLog 只追加新消息，应保持平坦。分配峰值含 langgraph 自身开销。
+    """
+    window = max(1, turns // 10)
+    report = {"turns": turns, "steps_per_turn": steps,
+              "final_messages": 1 + turns * (steps + 1)}
+
+    def avg(rows, i, scale):
+        return round(sum(r[i] for r in rows) / len(rows) * scale, 3)
+
+    for name, state_type in (("list", _ListState), ("message_log", _LogState)):
+        timed = _session_costs(state_type, turns, steps, trace_memory=False)
+        traced = _session_costs(state_type, turns, steps, trace_memory=True)
+        report[name] = {
+            "peak_kb": {"first": avg(traced[:window], 0, 1 / 1024),
+                        "last": avg(traced[-window:], 0, 1 / 1024)},
+            "reducer_us": {"first": avg(timed[:window], 1, 1e6),
+                           "last": avg(timed[-window:], 1, 1e6)},
+            "turn_ms": {"first": avg(timed[:window], 2, 1e3),
+                        "last": avg(timed[-window:], 2, 1e3)},
+        }
+    return report
+
+
+# ========== 限流 ==========
+
+class _Throttled(Exception):
+    status_code = 429
+
+
+class _ThrottlingProvider:
+    """以容量 1 秒配额的令牌桶执行 rpm 的假服务商，桶空即抛 429"""
+
+    def __init__(self, rpm: float, latency: float):
+        self.rate = rpm / 60
+        self.level = self.rate
+        self.updated = time.monotonic()
+        self.latency = latency
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages, **kwargs):
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.rate, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.level < 1:
+                self.throttled += 1
+                raise _Throttled("rate limited")
+            self.level -= 1
+        time.sleep(self.latency)
+        return AIMessage(content="ok")
+
+
+def _hammer(limiters: List[RateLimiter], provider: _ThrottlingProvider, requests: int,
+            backoff: float) -> dict:
+    """每个会话一个线程，各自连续发 requests 次调用"""
+    failed = []
+
+    def session(limiter):
+        llm = RateLimitedLLM(provider, limiter, max_retries=4,
+                             backoff_base=backoff, backoff_max=backoff * 16)
+        for _ in range(requests):
+            try:
+                llm.invoke([HumanMessage(content="x")])
+            except _Throttled:
+                failed.append(1)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(l,)) for l in limiters]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done = len(limiters) * requests - len(failed)
+    return {
+        "elapsed": round(elapsed, 3),
+        "throughput_rpm": round(done / elapsed * 60, 1),
+        "throttled": provider.throttled,
+        "failed": len(failed),
+    }
+
+
+def bench_ratelimit(rpm: float = 3000, sessions: int = 16, requests: int = 10,
+                    latency: float = 0.02, backoff: float = 0.1) -> dict:
+    """多个会话同时打同一服务商：各自退避（相当于只靠 SDK 重试）与共享令牌桶的对比"""
+    report = {"rpm": rpm, "sessions": sessions, "requests": requests}
+    provider = _ThrottlingProvider(rpm, latency)
+    report["per_session"] = _hammer([RateLimiter(0) for _ in range(sessions)],
+                                    provider, requests, backoff)
+    provider = _ThrottlingProvider(rpm, latency)
+    report["shared"] = _hammer([RateLimiter(rpm)] * sessions, provider, requests, backoff)
+    return report
+
+
+def peak_rss() -> Optional[dict]:
+    """本进程与已回收子进程（tsx / worker）的峰值 RSS，单位 MB"""
+    if resource is None:
+        return None
+    # Linux 上单位为 KB，macOS 为字节
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def run(names: List[str], reps: int, levels: List[int], delay: float, stream: bool,
+        budget: float = STARTUP_BUDGET) -> dict:
+    templates = load_templates(names)
+    scenarios = build_scenarios(templates)
+    model = ReplayChatModel(scenarios=scenarios, delay=delay)
+    # 基准产生的追踪和错误指纹不计入用户的统计文件
+    saved_trace, saved_fingerprints = metrics.tracer.path, graph._fingerprints.path
+    with tempfile.TemporaryDirectory(prefix="flowing_bench_") as tmp:
+        work = Path(tmp)
+        out_dir = str(work / "out")
+        os.makedirs(out_dir)
+        metrics.tracer.path = None
+        graph._fingerprints.path = work / "fingerprints.jsonl"
+        try:
+            results = {
+                "startup": bench_startup(reps, budget),
+                "execute": bench_execute(templates, out_dir, reps),
+                "graph": bench_graph(model, out_dir, work / "trace.jsonl", stream),
+                "graph_retrieval": bench_graph(model, out_dir, work / "trace_retrieval.jsonl",
+                                               stream, Retriever(work / "retrieval.json")),
+                "batch": bench_batch(model, work, levels),
+                "memory": bench_memory(),
+                "ratelimit": bench_ratelimit(),
+            }
+        finally:
+            metrics.tracer.path = saved_trace
+            graph._fingerprints.path = saved_fingerprints
+            shutdown_pool()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "figcraft": figcraft_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "examples": names,
+            "scenarios": len(scenarios),
+            "reps": reps,
+            "llm_delay": delay,
+            "stream": stream,
+        },
+        **results,
+        "peak_rss": peak_rss(),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Flowing Agent 离线基准测试")
+    parser.add_argument("--examples", help="逗号分隔的示例名（examples/ 下不含 .ts），默认全部")
+    parser.add_argument("--quick", action="store_true", help=f"只跑 {', '.join(QUICK_EXAMPLES)}")
+    parser.add_argument("--reps", type=int, default=3, help="execute_code 每个示例重复次数")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="批量模式的并发级别")
+    parser.add_argument("--delay", type=float, default=0.0, help="模拟的 LLM 延迟（秒）")
+    parser.add_argument("--stream", action="store_true", help="图基准使用流式生成")
+    parser.add_argument("--startup", action="store_true",
+                        help="只测启动耗时（python -X importtime），超出预算时退出码为 1")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help=f"import main 的耗时预算（秒），默认 {STARTUP_BUDGET}")
+    parser.add_argument("--out", help="结果 JSON 路径，默认打印到标准输出")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        result = bench_startup(args.reps, args.startup_budget)
+        report = json.dumps({"startup": result}, indent=2, ensure_ascii=False)
+        if args.out:
+            Path(args.out).write_text(report + "\n", encoding="utf-8")
+        else:
+            print(report)
+        sys.exit(0 if result["within_budget"] else 1)
+
+    if args.examples:
+        names = args.examples.split(",")
+    elif args.quick:
+        names = list(QUICK_EXAMPLES)
+    else:
+        names = all_examples()
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    report = json.dumps(run(names, args.reps, levels, args.delay, args.stream,
+                            args.startup_budget),
+                        indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(report + "\n", encoding="utf-8")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""缓存 — 渲染缓存按代码内容寻址复用 ExecResult 与导出文件；回复缓存按对话复用 LLM 回复"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, replace
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence
+
+from config import CONFIG_DIR
+from executor import FLOWING_ROOT, Artifact, ExecResult, export_files, resolve_path
+
+CACHE_DIR = CONFIG_DIR / "cache" / "render"
+RESPONSE_DB = CONFIG_DIR / "cache" / "responses.sqlite3"
+
+
+@lru_cache(maxsize=1)
+def figcraft_version() -> str:
+    """figcraft 源码指纹：package.json 版本 + src/*.ts 内容哈希"""
+    h = hashlib.sha256()
+    try:
+        with open(os.path.join(FLOWING_ROOT, "package.json"), encoding="utf-8") as f:
+            h.update(json.load(f).get("version", "").encode())
+    except (OSError, ValueError):
+        pass
+    for path in sorted(glob.glob(os.path.join(FLOWING_ROOT, "src", "*.ts"))):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def export_options(code: str) -> list:
+    """提取代码中所有 fig.export(path, options) 调用的参数文本"""
+    return [
+        (m.group(1), re.sub(r"\s+", "", m.group(2) or ""))
+        for m in re.finditer(r"""export\(\s*['"]([^'"]+)['"]\s*(?:,\s*(\{[^}]*\}))?""", code)
+    ]
+
+
+class RenderCache:
+    """磁盘 LRU 缓存
+
+    每个条目两个文件: <key>.json（ExecResult 与各导出文件在 .bin 中的位置）和
+    <key>.bin（全部导出产物依次拼接，脚本导出多次或带额外格式时都能恢复）。
+    命中时刷新 mtime，写入后按 mtime 从旧到新淘汰，直到总大小不超过 max_bytes。
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = 200 * 1024 * 1024):
+        self.dir = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, code: str, options: Optional[dict] = None) -> str:
+        payload = json.dumps({
+            "code": code,
+            "figcraft": figcraft_version(),
+            "export": export_options(code),
+            "options": options or {},
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, code: str, options: Optional[dict] = None,
+            persist: bool = True) -> Optional[ExecResult]:
+        """命中则恢复导出文件并返回成功结果，否则返回 None
+
+        persist=False 时不写导出文件，内容放在 result.artifacts 中。
+        """
+        key = self.key(code, options)
+        meta = self.dir / f"{key}.json"
+        blob = self.dir / f"{key}.bin"
+        try:
+            with open(meta, encoding="utf-8") as f:
+                entry = json.load(f)
+            files = entry.pop("files")
+            result = ExecResult(**entry)
+            data = blob.read_bytes()
+            artifacts, offset = [], 0
+            for path, fmt, size in files:
+                artifacts.append(Artifact(path, fmt, data[offset:offset + size]))
+                offset += size
+            if not persist:
+                result.artifacts = artifacts
+            else:
+                for a in artifacts:
+                    target = resolve_path(a.path)
+                    if not _same_content(target, a.data):
+                        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                        with open(target, "wb") as f:
+                            f.write(a.data)
+            for p in (meta, blob):
+                if p.exists():
+                    os.utime(p)
+        except (OSError, ValueError, TypeError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, result: ExecResult, options: Optional[dict] = None,
+            formats: Optional[Sequence[str]] = None) -> None:
+        """只缓存成功结果及其全部导出内容
+
+        导出内容取 result.artifacts，没有时按 export_files(result, formats) 读磁盘；
+        主导出文件读不到时不缓存，其余不存在的文件（未导出的格式）跳过。
+        """
+        if not result.success:
+            return
+        key = self.key(result.code, options)
+        try:
+            artifacts = list(result.artifacts)
+            if not artifacts:
+                for path in export_files(result, formats):
+                    try:
+                        with open(resolve_path(path), "rb") as f:
+                            data = f.read()
+                    except OSError:
+                        if path == result.output_file:
+                            raise
+                        continue
+                    fmt = os.path.splitext(path)[1].lstrip(".").lower()
+                    artifacts.append(Artifact(path, fmt, data))
+            self.dir.mkdir(parents=True, exist_ok=True)
+            (self.dir / f"{key}.bin").write_bytes(b"".join(a.data for a in artifacts))
+            with open(self.dir / f"{key}.json", "w", encoding="utf-8") as f:
+                # 预览与后台导出只属于那一次执行
+                entry = asdict(replace(result, artifacts=[], preview=None, exports=None))
+                entry["files"] = [[a.path, a.format, len(a.data)] for a in artifacts]
+                json.dump(entry, f, ensure_ascii=False)
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        for p in self.dir.glob("*.json"):
+            files = [p, p.with_suffix(".bin")]
+            try:
+                size = sum(f.stat().st_size for f in files if f.exists())
+                entries.append((p.stat().st_mtime, size, files))
+            except OSError:
+                continue
+            total += size
+        entries.sort(key=lambda e: e[0])
+        for _, size, files in entries:
+            if total <= self.max_bytes:
+                break
+            for f in files:
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _same_content(path: str, data: bytes) -> bool:
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+# ========== LLM 回复缓存 ==========
+
+def _message_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in content)
+
+
+def llm_identity(llm) -> dict:
+    """区分服务商 / 模型 / 采样参数的字段；tongyi 与 custom 同为 OpenAI 兼容接口，靠 base_url 区分"""
+    return {
+        "type": getattr(llm, "_llm_type", type(llm).__name__),
+        "base_url": str(getattr(llm, "openai_api_base", None) or getattr(llm, "anthropic_api_url", "") or ""),
+        "model": getattr(llm, "model_name", None) or getattr(llm, "model", None),
+        "temperature": getattr(llm, "temperature", None),
+    }
+
+
+class ResponseCache:
+    """SQLite 持久化的回复缓存
+
+    键 = 服务商、模型、温度、system prompt 哈希与规整后的消息列表。
+    条目超过 ttl 秒视为过期；总大小超过 max_bytes 时按最近访问时间淘汰。
+    只由调用方在代码执行成功后写入，失败的回复不会被缓存。
+    """
+
+    def __init__(self, path: Path = RESPONSE_DB, ttl: float = 7 * 24 * 3600,
+                 max_bytes: int = 50 * 1024 * 1024):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, reply TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.commit()
+
+    def key(self, llm, messages: Sequence) -> str:
+        system = [_message_text(m.content) for m in messages if m.type == "system"]
+        # 空白差异不影响语义，规整后再比较
+        conversation = [
+            (m.type, " ".join(_message_text(m.content).split()))
+            for m in messages if m.type != "system"
+        ]
+        payload = json.dumps({
+            "llm": llm_identity(llm),
+            "system": hashlib.sha256("\n".join(system).encode("utf-8")).hexdigest(),
+            "messages": conversation,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT reply, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key: str, reply) -> None:
+        reply = _message_text(reply)
+        now = time.time()
+        size = len(reply.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, reply, created, accessed, size)"
+                " VALUES (?, ?, ?, ?, ?)", (key, reply, now, now, size))
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._evict()
+            self._db.commit()
+
+    def discard(self, key: str) -> None:
+        """缓存的回复执行失败（例如 figcraft 升级后）时删除"""
+        with self._lock:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
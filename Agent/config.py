@@ -24,6 +24,108 @@ DEFAULT_CONFIG = {
         "model": "",
         "endpoint": "",
     },
+    # 工作流：stream 为 True 时流式生成，代码块闭合即开始执行；
+    # history_budget 为对话历史的 token 预算，超出后早期轮次折叠为摘要；
+    # speculative_k > 1 时首轮并发生成 K 个候选（strategy: temperature | n）；
+    # edit_mode 为 True 时，对上一版成功代码的追问只请求 SEARCH/REPLACE 编辑块；
+    # output_mode 为 code 时生成 TypeScript 脚本，为 spec 时生成 JSON 图表描述，由 worker 直接解释；
+    # fix_budget 为一次请求最多请 LLM 修复的轮数（本地 autofix 不计入）；
+    # plan_complexity > 0 时，复杂度不低于它的新请求先拆成子图并发生成、执行，再组合为一张图（0 关闭）
+    "agent": {
+        "stream": True,
+        "history_budget": 8000,
+        "speculative_k": 0,
+        "speculative_strategy": "temperature",
+        "edit_mode": True,
+        "output_mode": "code",
+        "fix_budget": 2,
+        "plan_complexity": 0,
+    },
+    # 代码执行：常驻 worker 池大小（0 关闭）、单任务超时秒数、每个 worker 回收前的任务数；
+    # persist 为 False 时导出内容经管道返回内存，由 agent 统一写盘（渲染缓存不再回读文件）；
+    # formats 为每次导出额外输出的格式（如 ["webp", "pdf"]），一次执行得到多种格式；
+    # preview 为 True 时交互模式先写出 SVG 预览（目标为光栅 / PDF 时会多出一个同名 .svg）并返回，
+    # 光栅 / PDF 在后台导出（需 worker 池）；默认关闭，也可用 --preview 临时开启
+    "executor": {
+        "pool_size": 2,
+        "job_timeout": 30,
+        "max_jobs": 50,
+        "persist": True,
+        "formats": [],
+        "preview": False,
+    },
+    # 渲染缓存：相同代码 + figcraft 版本 + 导出参数直接复用上次结果
+    "render_cache": {
+        "enabled": True,
+        "max_mb": 200,
+    },
+    # LLM 回复缓存（默认关闭）：相同服务商 / 模型 / 对话直接复用执行成功过的回复，
+    # 条目 ttl_hours 小时后过期，总大小超过 max_mb 时淘汰最久未用的；--no-cache 临时关闭所有缓存
+    "response_cache": {
+        "enabled": False,
+        "ttl_hours": 168,
+        "max_mb": 50,
+    },
+    # 多服务商路由：providers 列出可互为备份的服务商（当前 provider 总是首选，需已填写密钥）。
+    # 首选超过自身 p95 延迟（至少 hedge_min_seconds，样本不足时 hedge_default_seconds）
+    # 仍未返回时向下一个发送对冲请求；429 / 5xx / 连接错误直接切换，
+    # 全部服务商都失败时按 rate_limit 的 backoff_base / backoff_max 退避后整轮重试，最多 retries 轮
+    "routing": {
+        "providers": [],
+        "retries": 2,
+        "hedge": True,
+        "hedge_min_seconds": 1.0,
+        "hedge_default_seconds": 8.0,
+        "min_samples": 5,
+        "error_threshold": 0.5,
+    },
+    # 限流：同一服务商 / 模型在进程内共享每分钟请求数（rpm）与 token 数（tpm）的令牌桶，0 为不限，
+    # 按账号配额填写；burst_seconds 为允许的突发量（秒级配额），服务商多按秒级窗口执行限额；
+    # providers 按 "<provider>" 或 "<provider>/<model>" 覆盖，如 {"tongyi": {"rpm": 600}}。
+    # 429 / 5xx 按带抖动的指数退避（backoff_base 起，最长 backoff_max 秒）重试 max_retries 次，
+    # 429 时整组暂停；与 agent.fix_budget 分开计算
+    "rate_limit": {
+        "enabled": True,
+        "rpm": 0,
+        "tpm": 0,
+        "burst_seconds": 1.0,
+        "max_retries": 4,
+        "backoff_base": 1.0,
+        "backoff_max": 30.0,
+        "providers": {},
+    },
+    # 模型分档（默认关闭）：按请求复杂度（框数 + 难点，见 tiers.py）选择起始模型，
+    # 复杂度不超过 max_complexity 的请求从 levels 中第一个符合的档开始（provider 留空为当前服务商），
+    # 执行失败或静态检查出错后升一档，最后一档为当前配置的模型；python tiers.py 查看各档按复杂度的成功率
+    "tiers": {
+        "enabled": False,
+        "levels": [
+            {"name": "fast", "provider": "", "model": "qwen-turbo", "max_complexity": 6},
+        ],
+    },
+    # HTTP 服务模式（--serve）：concurrency 个执行线程，另有 queue_size 个排队位置，
+    # 单个客户端最多 per_client 个在途请求，超出返回 429；最多保留 max_sessions 个会话
+    "server": {
+        "host": "127.0.0.1",
+        "port": 8765,
+        "concurrency": 4,
+        "queue_size": 16,
+        "per_client": 2,
+        "max_sessions": 100,
+    },
+    # 参考资料检索：按请求从 prompts/ 指南与 examples/ 示例中选出 top_k 个片段（合计不超过
+    # max_chars 字符）附在用户消息之后，system prompt 改用去掉参数表的精简版
+    "retrieval": {
+        "enabled": True,
+        "top_k": 3,
+        "max_chars": 2500,
+    },
+    # 指标：trace 为 True 时各阶段 span 追加写入 ~/.flowing/trace.jsonl；
+    # port > 0 时在 127.0.0.1:port/metrics 提供 Prometheus 文本格式
+    "metrics": {
+        "trace": True,
+        "port": 0,
+    },
 }
 
 
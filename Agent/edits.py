@@ -0,0 +1,104 @@
+"""增量编辑 — 追问时让 LLM 只输出 SEARCH/REPLACE 块，在本地打到上一版代码上
+
+输出 token 随改动大小而不是图的大小增长；任何一个块打不上时由调用方回退到完整生成。
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from executor import CODE_MODE, SPEC_MODE, fence
+
+# 明确要画新图的请求不走增量编辑
+_NEW_DIAGRAM = re.compile(
+    r"^\s*(?:请|帮我)?\s*(?:重新|另外|再)?(?:画|绘制|生成|创建|做)\s*(?:一|个|张|幅|份)"
+    r"|^\s*(?:please\s+)?(?:draw|create|generate|make)\s+(?:a|an|another|new)\b"
+    r"|新的?图|重新画|从头",
+    re.I,
+)
+
+EDIT_INSTRUCTIONS = """## 输出格式：增量修改
+
+在当前代码上做最小改动，只输出 SEARCH/REPLACE 块，不要输出完整代码：
+
+<<<<<<< SEARCH
+（当前代码中要修改的连续几行，逐字复制，足以唯一定位）
+=======
+（替换后的内容）
+>>>>>>> REPLACE
+
+可以输出多个块，按在代码中出现的顺序排列；删除内容时 REPLACE 部分留空。
+如果用户要的其实是一张全新的图，改为输出完整的 {full}。"""
+
+# 各模式下「完整输出」的说法
+FULL_OUTPUT = {CODE_MODE: "TypeScript 代码块", SPEC_MODE: "JSON 图表描述"}
+
+_BLOCK = re.compile(
+    r"^<{5,}[ \t]*SEARCH[ \t]*\n(.*?)^={5,}[ \t]*\n(.*?)^>{5,}[ \t]*REPLACE[ \t]*$",
+    re.M | re.S,
+)
+
+
+@dataclass
+class Edit:
+    search: str
+    replace: str
+
+
+class EditError(Exception):
+    """SEARCH 内容在代码中找不到或不唯一"""
+
+
+def is_followup(request: str) -> bool:
+    """已有上一版代码时，除非明确要求画新图，否则按修改处理"""
+    return not _NEW_DIAGRAM.search(request)
+
+
+def edit_request(code: str, code_in_history: bool, mode: str = CODE_MODE) -> str:
+    """附在本轮请求之后的格式说明；历史中已有这版代码时不再重复"""
+    instructions = EDIT_INSTRUCTIONS.format(full=FULL_OUTPUT[mode])
+    if code_in_history:
+        return f"{instructions}\n\n当前代码即上一条回复中的代码。"
+    return f"{instructions}\n\n### 当前代码\n{fence(code, mode)}"
+
+
+def parse_edits(reply: str) -> List[Edit]:
+    return [Edit(m.group(1).rstrip("\n"), m.group(2).rstrip("\n"))
+            for m in _BLOCK.finditer(reply)]
+
+
+def _locate_loose(lines: List[str], search: List[str]) -> Optional[int]:
+    """忽略缩进和行尾空白逐行比较，唯一命中时返回起始行号"""
+    want = [l.strip() for l in search]
+    hits = [i for i in range(len(lines) - len(want) + 1)
+            if [l.strip() for l in lines[i:i + len(want)]] == want]
+    if len(hits) > 1:
+        raise EditError(f"SEARCH 内容出现了 {len(hits)} 次，无法唯一定位:\n{search[0]}")
+    return hits[0] if hits else None
+
+
+def apply_edit(code: str, edit: Edit) -> str:
+    if not edit.search.strip():
+        raise EditError("SEARCH 内容为空")
+    count = code.count(edit.search)
+    if count == 1:
+        return code.replace(edit.search, edit.replace, 1)
+    if count > 1:
+        raise EditError(f"SEARCH 内容出现了 {count} 次，无法唯一定位:\n"
+                        f"{edit.search.splitlines()[0]}")
+    lines = code.split("\n")
+    search = edit.search.split("\n")
+    start = _locate_loose(lines, search)
+    if start is None:
+        raise EditError(f"找不到 SEARCH 内容:\n{search[0]}")
+    replace = edit.replace.split("\n") if edit.replace else []
+    return "\n".join(lines[:start] + replace + lines[start + len(search):])
+
+
+def apply_edits(code: str, edits: List[Edit]) -> str:
+    """依次应用所有块；任何一个失败都抛 EditError，不返回部分结果"""
+    if not edits:
+        raise EditError("回复中没有 SEARCH/REPLACE 块")
+    for edit in edits:
+        code = apply_edit(code, edit)
+    return code
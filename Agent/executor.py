@@ -1,14 +1,48 @@
-"""代码提取 + tsx 执行"""
+"""代码提取 + tsx 执行
 
+两种输出模式:
+  code  模型输出完整的 TypeScript 脚本，由 worker 经 tsx 加载执行
+  spec  模型输出 JSON 图表描述（src/spec.ts 的 DiagramSpec），由 worker 直接解释，
+        不经过转译；描述本身就是可缓存、可 diff 的纯数据
+"""
+
+import asyncio
+import base64
+import json
 import os
 import re
 import subprocess
 import tempfile
-from dataclasses import dataclass
-from typing import Optional
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from metrics import traced
+from worker_pool import MARK, WORKER_SCRIPT, CancelToken, WorkerPool, WorkerError
 
 FLOWING_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+CODE_MODE = "code"
+SPEC_MODE = "spec"
+OUTPUT_MODES = (CODE_MODE, SPEC_MODE)
+# 各模式回复中代码块的语言标记
+FENCE_LANG = {CODE_MODE: "typescript", SPEC_MODE: "json"}
+
+# 常驻 worker 池，由 configure_pool() 设置；为 None 时每次单独启动 npx tsx
+_pool: Optional[WorkerPool] = None
+
+# 每次导出额外输出的格式（config["executor"]["formats"]），由 configure_pool() 设置
+EXPORT_FORMATS = ("svg", "png", "jpg", "jpeg", "webp", "pdf")
+_formats: tuple = ()
+
+
+@dataclass
+class Artifact:
+    """留在内存中的导出内容；path 为脚本里 fig.export() 的目标路径"""
+    path: str
+    format: str
+    data: bytes
+
 
 @dataclass
 class ExecResult:
@@ -17,10 +51,89 @@ class ExecResult:
     output_file: Optional[str] = None
     error: Optional[str] = None
     stdout: Optional[str] = None
+    # persist=False 执行时的导出内容，此时 output_file 尚未写入磁盘
+    artifacts: List[Artifact] = field(default_factory=list)
+    # preview=True 执行时已写出的 SVG 预览；其余格式仍在后台导出时，
+    # exports 为完成时给出写入文件列表的 Future（失败时抛 WorkerError）
+    preview: Optional[str] = None
+    exports: Optional[Future] = None
+
+
+def resolve_path(path: str) -> str:
+    # tsx 在 FLOWING_ROOT 下执行，相对路径以它为基准
+    return path if os.path.isabs(path) else os.path.join(FLOWING_ROOT, path)
+
+
+def save_artifacts(artifacts: List[Artifact]) -> List[str]:
+    """把内存中的导出内容写到脚本原本的导出路径，返回写入的文件"""
+    written = []
+    for a in artifacts:
+        target = resolve_path(a.path)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(a.data)
+        written.append(target)
+    return written
+
+
+def with_format(path: str, fmt: str) -> str:
+    return os.path.splitext(path)[0] + "." + fmt.lower()
+
+
+def missing_exports(result: ExecResult, formats: Optional[Sequence[str]] = None) -> List[str]:
+    """按 formats（None 时取配置）应与 output_file 一同导出、却不在结果中的文件
+
+    persist=False 的结果看 artifacts，否则看磁盘。
+    """
+    if not result.output_file:
+        return []
+    formats = _formats if formats is None else formats
+    paths = dict.fromkeys(with_format(result.output_file, f) for f in formats)
+    if result.artifacts:
+        captured = {a.path for a in result.artifacts}
+        return [p for p in paths if p not in captured]
+    return [p for p in paths if not os.path.exists(resolve_path(p))]
+
 
+def export_files(result: ExecResult, formats: Optional[Sequence[str]] = None) -> List[str]:
+    """结果的全部导出文件：脚本中每个 export() 的目标，以及按 formats（None 时取配置）额外导出的格式"""
+    if not result.output_file:
+        return []
+    formats = _formats if formats is None else formats
+    targets = [result.output_file] + re.findall(r"""export\(\s*['"]([^'"]+)['"]""", result.code)
+    return list(dict.fromkeys(
+        p for t in targets for p in [t] + [with_format(t, f) for f in formats]))
 
-def extract_code(response: str) -> Optional[str]:
-    """从 LLM 响应中提取 TypeScript 代码块"""
+
+def fence(code: str, mode: str = CODE_MODE) -> str:
+    """把代码包成对应模式的代码块，作为一条 AI 回复的内容"""
+    return f"```{FENCE_LANG[mode]}\n{code}\n```"
+
+
+def parse_spec(text: str) -> Optional[dict]:
+    try:
+        spec = json.loads(text)
+    except ValueError:
+        return None
+    return spec if isinstance(spec, dict) else None
+
+
+def _extract_spec(response: str) -> Optional[str]:
+    """```json 代码块、任意代码块或整段回复，能解析为 JSON 对象才算提取成功"""
+    candidates = [m.group(1) for m in re.finditer(r"```(?:json)?\s*\n(.*?)```", response, re.DOTALL)]
+    candidates.append(response)
+    for text in candidates:
+        text = text.strip()
+        if parse_spec(text) is not None:
+            return text
+    return None
+
+
+@traced("extract_code", lambda code: {"ok": code is not None})
+def extract_code(response: str, mode: str = CODE_MODE) -> Optional[str]:
+    """从 LLM 响应中提取 TypeScript 代码块；spec 模式下提取 JSON 图表描述"""
+    if mode == SPEC_MODE:
+        return _extract_spec(response)
     # ```typescript ... ``` 或 ```ts ... ```
     m = re.search(r"```(?:typescript|ts)\s*\n(.*?)```", response, re.DOTALL)
     if m:
@@ -32,45 +145,261 @@ def extract_code(response: str) -> Optional[str]:
     return None
 
 
-def find_output_path(code: str) -> Optional[str]:
+class CodeFenceParser:
+    """增量解析流式回复，代码块的闭合 ``` 一出现就交出代码
+
+    parser = CodeFenceParser()
+    for chunk in stream:
+        if parser.feed(chunk) is not None:
+            break   # parser.code 已完整，后续输出可以丢弃
+    """
+
+    _OPEN = re.compile(r"```[^\n`]*\n")
+
+    def __init__(self):
+        self.text = ""
+        self.code: Optional[str] = None
+        self._body = None      # 代码正文起始位置
+        self._scanned = 0      # 已扫描过闭合 fence 的位置
+        self._end = None       # 闭合 fence 之后的位置
+
+    def feed(self, chunk: str) -> Optional[str]:
+        if self.code is not None:
+            return self.code
+        self.text += chunk
+        if self._body is None:
+            m = self._OPEN.search(self.text)
+            if not m:
+                return None
+            self._body = self._scanned = m.end()
+        # 只扫描新增部分（回退 3 个字符以覆盖跨 chunk 的 fence）
+        idx = self.text.find("\n```", max(self._body - 1, self._scanned - 3))
+        self._scanned = len(self.text)
+        if idx < 0:
+            return None
+        self.code = self.text[self._body:idx].strip()
+        self._end = idx + 4
+        return self.code
+
+    @property
+    def reply(self) -> str:
+        """截止到闭合 fence 的回复文本（未闭合时为全部已收到的文本）"""
+        return self.text[:self._end] if self._end is not None else self.text
+
+
+def find_output_path(code: str, mode: str = CODE_MODE) -> Optional[str]:
     """从代码中提取 export 输出路径"""
+    if mode == SPEC_MODE:
+        export = (parse_spec(code) or {}).get("export")
+        return export.get("path") if isinstance(export, dict) else None
     m = re.search(r"""export\(['"]([^'"]+)['"]""", code)
     return m.group(1) if m else None
 
 
-def execute_code(code: str) -> ExecResult:
-    """将代码写入临时文件，用 npx tsx 执行"""
+def configure_pool(settings: dict) -> Optional[WorkerPool]:
+    """按 config["executor"] 创建 worker 池；pool_size 为 0 时关闭"""
+    global _pool, _formats
+    _formats = tuple(f.lower().lstrip(".") for f in settings.get("formats") or ()
+                     if f.lower().lstrip(".") in EXPORT_FORMATS)
+    if _pool:
+        _pool.close()
+        _pool = None
+    size = settings.get("pool_size", 2)
+    if size > 0:
+        _pool = WorkerPool(
+            size=size,
+            timeout=settings.get("job_timeout", 30),
+            max_jobs=settings.get("max_jobs", 50),
+        )
+        _pool.warm()
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool:
+        _pool.close()
+        _pool = None
+
+
+def _job_result(code: str, result: dict, mode: str = CODE_MODE) -> ExecResult:
+    """worker 协议的任务结果 → ExecResult"""
+    if result.get("ok"):
+        return ExecResult(
+            success=True,
+            code=code,
+            output_file=find_output_path(code, mode),
+            stdout=result.get("stdout"),
+            artifacts=[
+                Artifact(a["path"], a["format"], base64.b64decode(a["data"]))
+                for a in result.get("artifacts") or []
+            ],
+            preview=result.get("preview"),
+            exports=result.get("exports"),
+        )
+    return ExecResult(
+        success=False,
+        code=code,
+        error=result.get("error") or result.get("stdout") or "未知错误",
+    )
+
+
+def _execute_in_pool(pool: WorkerPool, code: str, path: str,
+                     persist: bool = True, mode: str = CODE_MODE, formats: Sequence[str] = (),
+                     preview: bool = False,
+                     cancel: Optional[CancelToken] = None) -> Optional[ExecResult]:
+    """在常驻 worker 中执行；worker 不可用（或已取消）时返回 None，由调用方回退到单次执行"""
+    try:
+        result = pool.run(path, capture=not persist, formats=formats,
+                          preview=preview and persist, cancel=cancel)
+    except TimeoutError:
+        return ExecResult(success=False, code=code, error=f"执行超时 ({pool.timeout:g}s)")
+    except (WorkerError, OSError):
+        return None
+    return _job_result(code, result, mode)
+
+
+def _write_script(code: str, mode: str = CODE_MODE) -> str:
     tmp = tempfile.NamedTemporaryFile(
-        mode="w", suffix=".ts", prefix="flowing_agent_",
-        dir="/tmp", delete=False, encoding="utf-8",
+        mode="w", suffix=".json" if mode == SPEC_MODE else ".ts", prefix="flowing_agent_",
+        delete=False, encoding="utf-8",
     )
     tmp.write(code)
     tmp.close()
+    return tmp.name
+
 
+def _remove_script(path: str) -> None:
     try:
-        result = subprocess.run(
-            ["npx", "tsx", tmp.name],
-            cwd=FLOWING_ROOT,
-            capture_output=True,
-            text=True,
-            timeout=30,
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _via_worker(persist: bool, mode: str, formats: Sequence[str] = ()) -> bool:
+    """单次执行是否借用 worker 脚本：不落盘时取回导出内容，spec 模式由它解释 JSON，
+    额外格式由它在同一次执行中导出"""
+    return not persist or mode == SPEC_MODE or bool(formats)
+
+
+def _command(path: str, persist: bool, mode: str = CODE_MODE,
+             formats: Sequence[str] = ()) -> List[str]:
+    if not _via_worker(persist, mode, formats):
+        return ["npx", "tsx", path]
+    return (["npx", "tsx", WORKER_SCRIPT, "--once", path]
+            + ([] if persist else ["--capture"])
+            + (["--formats", ",".join(formats)] if formats else []))
+
+
+def _process_result(code: str, returncode: int, stdout: str, stderr: str,
+                    persist: bool = True, mode: str = CODE_MODE,
+                    formats: Sequence[str] = ()) -> ExecResult:
+    if _via_worker(persist, mode, formats):
+        for line in reversed(stdout.splitlines()):
+            if line.startswith(MARK):
+                return _job_result(code, json.loads(line[len(MARK):]), mode)
+        return ExecResult(success=False, code=code, error=stderr or stdout or "未知错误")
+    if returncode == 0:
+        return ExecResult(
+            success=True,
+            code=code,
+            output_file=find_output_path(code, mode),
+            stdout=stdout,
         )
+    return ExecResult(success=False, code=code, error=stderr or stdout)
 
-        if result.returncode == 0:
-            output_file = find_output_path(code)
-            return ExecResult(
-                success=True,
-                code=code,
-                output_file=output_file,
-                stdout=result.stdout,
-            )
-        else:
-            return ExecResult(
-                success=False,
-                code=code,
-                error=result.stderr or result.stdout,
+
+@traced("execute_code", lambda r: {"ok": r.success})
+def execute_code(code: str, persist: bool = True, mode: str = CODE_MODE,
+                 formats: Optional[Sequence[str]] = None, preview: bool = False) -> ExecResult:
+    """将代码写入临时文件，优先交给常驻 worker 执行，否则用 npx tsx 执行
+
+    persist=False 时导出内容不写磁盘，放在 result.artifacts 中返回，
+    由调用方决定是否 save_artifacts()。临时脚本执行后即删除。
+    mode=SPEC_MODE 时 code 为 JSON 图表描述，写成 .json 交给 worker 解释。
+    formats 为每次导出额外输出的格式，None 时取 config["executor"]["formats"]。
+    preview=True 时（需 worker 池且 persist）SVG 预览写出即返回，
+    光栅 / PDF 在后台继续导出，见 result.preview / result.exports。
+    """
+    formats = _formats if formats is None else tuple(formats)
+    path = _write_script(code, mode)
+    try:
+        if _pool:
+            pooled = _execute_in_pool(_pool, code, path, persist, mode, formats, preview)
+            if pooled:
+                return pooled
+
+        try:
+            result = subprocess.run(
+                _command(path, persist, mode, formats),
+                cwd=FLOWING_ROOT,
+                capture_output=True,
+                text=True,
+                timeout=30,
             )
-    except subprocess.TimeoutExpired:
-        return ExecResult(success=False, code=code, error="执行超时 (30s)")
+            return _process_result(code, result.returncode, result.stdout, result.stderr,
+                                   persist, mode, formats)
+        except subprocess.TimeoutExpired:
+            return ExecResult(success=False, code=code, error="执行超时 (30s)")
+        except Exception as e:
+            return ExecResult(success=False, code=code, error=str(e))
+    finally:
+        _remove_script(path)
+
+
+@traced("execute_code", lambda r: {"ok": r.success})
+async def aexecute_code(code: str, timeout: float = 30, persist: bool = True,
+                        mode: str = CODE_MODE, formats: Optional[Sequence[str]] = None,
+                        preview: bool = False) -> ExecResult:
+    """execute_code 的异步版本：不占用事件循环，被取消时杀掉执行它的子进程或池中的 worker"""
+    formats = _formats if formats is None else tuple(formats)
+    path = _write_script(code, mode)
+    try:
+        return await _aexecute_script(code, path, timeout, persist, mode, formats, preview)
+    finally:
+        _remove_script(path)
+
+
+async def _aexecute_script(code: str, path: str, timeout: float, persist: bool,
+                           mode: str, formats: tuple, preview: bool) -> ExecResult:
+    if _pool:
+        # worker 池是线程安全的阻塞接口，放到线程里等待；取消时线程仍在运行，
+        # 杀掉 worker 让它立即返回并让出名额
+        cancel = CancelToken()
+        try:
+            pooled = await asyncio.to_thread(_execute_in_pool, _pool, code, path, persist, mode,
+                                             formats, preview, cancel)
+        except asyncio.CancelledError:
+            cancel.cancel()
+            raise
+        if pooled:
+            return pooled
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *_command(path, persist, mode, formats),
+            cwd=FLOWING_ROOT,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
     except Exception as e:
         return ExecResult(success=False, code=code, error=str(e))
+
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return ExecResult(success=False, code=code, error=f"执行超时 ({timeout:g}s)")
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+
+    return _process_result(
+        code, proc.returncode,
+        stdout.decode("utf-8", errors="replace"),
+        stderr.decode("utf-8", errors="replace"),
+        persist, mode, formats,
+    )
@@ -1,117 +1,1118 @@
-"""LangGraph 工作流 — 生成 → 执行 → 自动修复"""
+"""LangGraph 工作流 — (检索) → 生成 / 增量编辑 → 执行 → 自动修复
 
-from typing import Annotated, Literal, Optional, Sequence
+output_mode="spec" 时各节点处理 JSON 图表描述而不是 TypeScript 脚本。
+传入 tiers 时按请求复杂度选择模型档位，修复轮次升档；
+plan_complexity > 0 时复杂的新请求先拆成子图并发生成，再组合为一张图。
+"""
+
+import asyncio
+import contextvars
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+from typing import Annotated, Callable, Literal, Optional, Sequence, Tuple
 from typing_extensions import TypedDict
 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 
-from executor import extract_code, execute_code, ExecResult
+from autofix import FingerprintStats, fingerprint, try_autofix
+from edits import EditError, apply_edits, edit_request, is_followup, parse_edits
+from history import FIX_PREFIX, append_messages, is_fix_message
+from metrics import traced, turn_stats
+from planner import (Plan, PlanError, compose_spec, dump_spec, parse_plan, part_request,
+                     plan_request, summary_reply, svg_size)
+from retrieval import attach_context
+from tiers import STRONG_TIER, estimate_complexity
+from validator import validate_code, validate_spec, format_errors
+from executor import (CODE_MODE, SPEC_MODE, extract_code, execute_code, aexecute_code, fence,
+                      missing_exports, ExecResult, CodeFenceParser)
 
 
 # ========== State ==========
 
 class AgentState(TypedDict):
     """图的状态"""
-    messages: Annotated[Sequence[BaseMessage], lambda a, b: list(a) + list(b)]
+    # 只追加的 MessageLog，节点之间共享同一份底层 list，不再每步复制整段对话
+    messages: Annotated[Sequence[BaseMessage], append_messages]
     last_code: Optional[str]
     output_file: Optional[str]
     retry_count: int
     error: Optional[str]
+    # 生成代码应导出到的目录，供静态检查使用
+    output_dir: Optional[str]
+    # 静态检查发现的问题（ValidationError 的字典形式），未检查或通过时为 None
+    validation_errors: Optional[list]
+    # 本次请求已尝试本地修补过的错误指纹；上一次 autofix 是否产出了补丁
+    autofix_tried: Optional[list]
+    autofix_patched: Optional[bool]
+    # 本轮回复在回复缓存中的键，执行成功后写入、失败时删除
+    response_key: Optional[str]
+    # persist=False 时成功执行的导出内容（executor.Artifact 列表），尚未写盘
+    artifacts: Optional[list]
+    # preview=True 执行时已写出的 SVG 预览，以及仍在后台导出光栅 / PDF 的 Future
+    preview: Optional[str]
+    exports: Optional[object]
+    # 为本轮请求检索到的参考资料及其片段 id；只在调用 LLM 时附加，不进入 messages
+    context: Optional[str]
+    context_sources: Optional[list]
+    # 上一轮成功的代码；不为空且本轮是追问时先尝试增量编辑，edit_applied 为编辑是否打上
+    base_code: Optional[str]
+    edit_applied: Optional[bool]
+    # 传入 tiers 时本轮使用的模型档位与请求的复杂度打分，fix 时升档
+    tier: Optional[str]
+    complexity: Optional[int]
+    # 拆分方案（planner.Plan 的字典形式，另有子图目录 dir）与各子图的结果，未拆分时为 None
+    plan: Optional[dict]
+    parts: Optional[dict]
+
+
+# 流式生成的进度回调: (已收到字符数, 代码块是否已闭合)
+ProgressCallback = Callable[[int, bool], None]
+
+# 流式回复超过这个长度仍没有闭合的代码块，视为失控输出并提前终止
+MAX_STREAM_CHARS = 60000
+
+# 每次请求最多尝试几种不同错误的本地修补
+MAX_AUTOFIX = 3
+
+# 默认的修复预算：一次请求最多请 LLM 修复几轮（与改为可配置之前的 retry_count <= 2 一致）
+FIX_BUDGET = 2
+
+# 推测模式下各候选依次使用的采样温度
+SPECULATIVE_TEMPERATURES = (0.2, 0.5, 0.8, 1.0)
 
 
 # ========== Nodes ==========
 
-def generate_node(state: AgentState, llm) -> dict:
-    """调用 LLM 生成 flowing 代码"""
-    response = llm.invoke(state["messages"])
+def _generated(update: dict) -> dict:
+    """generate span 的属性：本次回复的 token 用量"""
+    meta = getattr(update["messages"][-1], "usage_metadata", None) or {}
+    return {"input_tokens": meta.get("input_tokens", 0),
+            "output_tokens": meta.get("output_tokens", 0)}
+
+
+def _executed(update: dict) -> dict:
+    return {"ok": not update.get("error"), "retry_count": update.get("retry_count", 0)}
+
+
+def _retrieved(update: dict) -> dict:
+    return {"snippets": len(update.get("context_sources") or []),
+            "context_chars": len(update.get("context") or "")}
+
+
+def _request_index(messages: Sequence[BaseMessage]) -> Optional[int]:
+    """本轮用户请求（最后一条非修复的 HumanMessage）的位置"""
+    for i in range(len(messages) - 1, -1, -1):
+        msg = messages[i]
+        if isinstance(msg, HumanMessage) and not is_fix_message(msg):
+            return i
+    return None
+
+
+def _request_text(messages: Sequence[BaseMessage]) -> str:
+    i = _request_index(messages)
+    request = messages[i].content if i is not None else ""
+    return request if isinstance(request, str) else ""
+
+
+def _llm_messages(state: AgentState) -> list:
+    """发给 LLM 的消息：检索到的参考资料附在本轮请求之后，修复轮次保持不变以命中前缀缓存"""
+    messages = list(state["messages"])
+    context = state.get("context")
+    i = _request_index(messages)
+    if context and i is not None and isinstance(messages[i].content, str):
+        messages[i] = HumanMessage(content=attach_context(messages[i].content, context))
+    return messages
+
+
+def _edited(update: dict) -> dict:
+    attrs = {"applied": bool(update.get("edit_applied"))}
+    return {**attrs, **_generated(update)} if update.get("messages") else attrs
+
+
+@traced("retrieve", _retrieved)
+def retrieve_node(state: AgentState, retriever) -> dict:
+    """按本轮请求检索指南与示例片段"""
+    messages = state["messages"]
+    i = _request_index(messages)
+    request = messages[i].content if i is not None else ""
+    context, sources = retriever.context(request if isinstance(request, str) else "")
+    return {"context": context or None, "context_sources": sources}
+
+
+def _chunk_text(chunk) -> str:
+    """流式 chunk 的文本（Anthropic 的 content 可能是 block 列表）"""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        b.get("text", "") if isinstance(b, dict) else str(b) for b in content
+    )
+
+
+def _streamed_message(parser: CodeFenceParser, merged) -> AIMessage:
+    """由截断后的文本构造完整的 AIMessage，保留已收到的元数据"""
+    if merged is None:
+        return AIMessage(content=parser.reply)
+    return AIMessage(
+        content=parser.reply,
+        id=merged.id,
+        response_metadata=merged.response_metadata,
+        usage_metadata=merged.usage_metadata,
+    )
+
+
+def _feed(parser: CodeFenceParser, chunk, on_progress: Optional[ProgressCallback]) -> bool:
+    """喂入一个 chunk，返回是否可以停止接收"""
+    parser.feed(_chunk_text(chunk))
+    done = parser.code is not None
+    if on_progress:
+        on_progress(len(parser.text), done)
+    return done or len(parser.text) > MAX_STREAM_CHARS
+
+
+def _cached_reply(state: AgentState, llm, response_cache,
+                  on_progress: Optional[ProgressCallback]) -> Tuple[Optional[str], Optional[dict]]:
+    """查回复缓存，返回 (键, 命中时的状态更新)"""
+    if not response_cache:
+        return None, None
+    key = response_cache.key(llm, _llm_messages(state))
+    reply = response_cache.get(key)
+    if reply is None:
+        return key, None
+    if on_progress:
+        on_progress(len(reply), True)
+    return key, {
+        "messages": [AIMessage(content=reply)],
+        "error": None,
+        "response_key": key,
+    }
+
+
+@traced("generate", _generated)
+def generate_node(state: AgentState, llm, stream: bool = False,
+                  on_progress: Optional[ProgressCallback] = None,
+                  response_cache=None) -> dict:
+    """调用 LLM 生成 flowing 代码
+
+    stream=True 时流式接收，代码块一闭合就停止接收并关闭连接，不等尾部输出。
+    response_cache 命中时直接返回缓存的回复，不调用 LLM。
+    """
+    key, hit = _cached_reply(state, llm, response_cache, on_progress)
+    if hit:
+        return hit
+
+    if not stream:
+        response = llm.invoke(_llm_messages(state))
+        return {
+            "messages": [response],
+            "error": None,
+            "response_key": key,
+        }
+
+    parser = CodeFenceParser()
+    merged = None
+    chunks = llm.stream(_llm_messages(state))
+    try:
+        for chunk in chunks:
+            merged = chunk if merged is None else merged + chunk
+            if _feed(parser, chunk, on_progress):
+                break
+    finally:
+        # 关闭生成器会中止底层 HTTP 流
+        chunks.close()
     return {
-        "messages": [response],
+        "messages": [_streamed_message(parser, merged)],
         "error": None,
+        "response_key": key,
     }
 
 
-def execute_node(state: AgentState) -> dict:
-    """从最新的 AI 回复中提取代码并执行"""
-    # 找最后一条 AI 消息
-    last_ai = None
+def _edit_messages(state: AgentState, mode: str = CODE_MODE) -> list:
+    """在发给 LLM 的消息上，给本轮请求附加增量修改的格式说明"""
+    messages = _llm_messages(state)
+    base = state["base_code"]
+    in_history = any(isinstance(m, AIMessage) and base in str(m.content) for m in messages)
+    i = _request_index(messages)
+    request = edit_request(base, in_history, mode)
+    messages[i] = HumanMessage(content=f"{messages[i].content}\n\n{request}")
+    return messages
+
+
+def _edit_update(state: AgentState, reply: AIMessage, mode: str = CODE_MODE) -> dict:
+    """把编辑块打到 base_code 上，结果作为一条完整代码的 AI 回复交给 execute
+
+    打不上时回复直接丢弃，返回 edit_applied=False，由完整生成接手。
+    """
+    text = reply.content if isinstance(reply.content, str) else str(reply.content)
+    edits = parse_edits(text)
+    if not edits:
+        # LLM 认为这是一张新图，直接给了完整代码
+        if extract_code(text, mode):
+            return {"messages": [reply], "edit_applied": True, "error": None}
+        return {"edit_applied": False}
+    try:
+        patched = apply_edits(state["base_code"], edits)
+    except EditError:
+        return {"edit_applied": False}
+    return {
+        "messages": [AIMessage(content=fence(patched, mode),
+                               usage_metadata=reply.usage_metadata)],
+        "edit_applied": True,
+        "error": None,
+    }
+
+
+@traced("edit", _edited)
+def edit_node(state: AgentState, llm, mode: str = CODE_MODE) -> dict:
+    """追问时只请求 SEARCH/REPLACE 块，输出长度与改动大小成正比"""
+    return _edit_update(state, llm.invoke(_edit_messages(state, mode)), mode)
+
+
+def _last_ai(state: AgentState) -> Optional[AIMessage]:
     for msg in reversed(state["messages"]):
         if isinstance(msg, AIMessage):
-            last_ai = msg
-            break
+            return msg
+    return None
+
 
+def _extract_last_code(state: AgentState,
+                       mode: str = CODE_MODE) -> Tuple[Optional[str], Optional[dict]]:
+    """从最新的 AI 回复中提取代码（spec 模式为 JSON 图表描述），失败时返回 (None, 状态更新)"""
+    last_ai = _last_ai(state)
     if not last_ai:
-        return {"error": "LLM 未返回任何回复", "last_code": None}
+        return None, {"error": "LLM 未返回任何回复", "last_code": None}
 
-    code = extract_code(last_ai.content)
+    code = extract_code(last_ai.content, mode)
     if not code:
-        return {
-            "error": f"LLM 未返回有效代码:\n{last_ai.content[:300]}",
+        what = "有效的 JSON 图表描述" if mode == SPEC_MODE else "有效代码"
+        return None, {
+            "error": f"LLM 未返回{what}:\n{last_ai.content[:300]}",
             "last_code": None,
         }
+    return code, None
+
 
-    result = execute_code(code)
+def _validation_failure(state: AgentState, code: str,
+                        mode: str = CODE_MODE) -> Optional[dict]:
+    """执行前静态检查；有问题时直接返回失败的状态更新，交给 fix_node"""
+    validate = validate_spec if mode == SPEC_MODE else validate_code
+    errors = validate(code, state.get("output_dir"))
+    if not errors:
+        return None
+    return {
+        "last_code": code,
+        "error": format_errors(errors),
+        "validation_errors": [asdict(e) for e in errors],
+        "retry_count": state.get("retry_count", 0) + 1,
+    }
 
+
+def _result_update(state: AgentState, code: str, result: ExecResult) -> dict:
     if result.success:
         return {
             "last_code": code,
             "output_file": result.output_file,
+            "artifacts": result.artifacts or None,
+            "preview": result.preview,
+            "exports": result.exports,
             "error": None,
+            "validation_errors": None,
             "retry_count": 0,
         }
     else:
         return {
             "last_code": code,
             "error": result.error[:1000] if result.error else "未知错误",
+            "validation_errors": None,
             "retry_count": state.get("retry_count", 0) + 1,
         }
 
 
-def fix_node(state: AgentState) -> dict:
+def _settle_reply(state: AgentState, update: dict, response_cache) -> dict:
+    """代码执行成功才把回复写入回复缓存；失败的回复（包括缓存命中的）删除"""
+    key = state.get("response_key")
+    if response_cache and key:
+        if update.get("error"):
+            response_cache.discard(key)
+        else:
+            response_cache.put(key, _last_ai(state).content)
+    return update
+
+
+def _cache_get(cache, code: str, persist: bool, formats) -> Optional[ExecResult]:
+    """缓存条目缺少当前要求的额外格式（formats 配置变了）时按未命中处理，重新执行一次补齐"""
+    result = cache.get(code, persist=persist) if cache else None
+    if result and missing_exports(result, formats):
+        return None
+    return result
+
+
+def _cache_put(cache, result: ExecResult, formats) -> None:
+    """后台仍在导出时，等全部导出文件写出后再缓存"""
+    if not (cache and result.success):
+        return
+    if result.exports is None:
+        cache.put(result, formats=formats)
+    else:
+        result.exports.add_done_callback(
+            lambda f: None if f.exception() else cache.put(result, formats=formats))
+
+
+@traced("execute", _executed)
+def execute_node(state: AgentState, cache=None, response_cache=None,
+                 persist: bool = True, mode: str = CODE_MODE,
+                 preview: bool = False, formats=None) -> dict:
+    """从最新的 AI 回复中提取代码并执行；cache 命中时直接返回成功结果
+
+    persist=False 时导出内容不写盘，放在状态的 artifacts 中。
+    mode=SPEC_MODE 时提取 JSON 图表描述，交给 worker 直接解释。
+    preview=True 时 SVG 预览写出即返回，光栅 / PDF 在后台导出（状态的 preview / exports）；
+    formats 为额外导出的格式，None 时取 executor 配置。
+    """
+    code, failure = _extract_last_code(state, mode)
+    failure = failure or _validation_failure(state, code, mode)
+    if failure:
+        return _settle_reply(state, failure, response_cache)
+
+    result = _cache_get(cache, code, persist, formats)
+    if result is None:
+        result = execute_code(code, persist=persist, mode=mode, formats=formats,
+                              preview=preview)
+        _cache_put(cache, result, formats)
+
+    return _settle_reply(state, _result_update(state, code, result), response_cache)
+
+
+# ========== Async Nodes ==========
+
+@traced("edit", _edited)
+async def aedit_node(state: AgentState, llm, timeout: Optional[float] = None,
+                     mode: str = CODE_MODE) -> dict:
+    try:
+        reply = await asyncio.wait_for(llm.ainvoke(_edit_messages(state, mode)), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"LLM 响应超时 ({timeout:g}s)")
+    return _edit_update(state, reply, mode)
+
+
+async def _astream_reply(llm, messages, on_progress: Optional[ProgressCallback]) -> AIMessage:
+    parser = CodeFenceParser()
+    merged = None
+    chunks = llm.astream(messages)
+    try:
+        async for chunk in chunks:
+            merged = chunk if merged is None else merged + chunk
+            if _feed(parser, chunk, on_progress):
+                break
+    finally:
+        await chunks.aclose()
+    return _streamed_message(parser, merged)
+
+
+@traced("generate", _generated)
+async def agenerate_node(state: AgentState, llm, timeout: Optional[float] = None,
+                         stream: bool = False,
+                         on_progress: Optional[ProgressCallback] = None,
+                         response_cache=None) -> dict:
+    """generate_node 的异步版本；超时抛 TimeoutError，取消会传递给底层请求"""
+    key, hit = _cached_reply(state, llm, response_cache, on_progress)
+    if hit:
+        return hit
+
+    if stream:
+        request = _astream_reply(llm, _llm_messages(state), on_progress)
+    else:
+        request = llm.ainvoke(_llm_messages(state))
+    try:
+        response = await asyncio.wait_for(request, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"LLM 响应超时 ({timeout:g}s)")
+    return {
+        "messages": [response],
+        "error": None,
+        "response_key": key,
+    }
+
+
+@traced("execute", _executed)
+async def aexecute_node(state: AgentState, cache=None, response_cache=None,
+                        persist: bool = True, mode: str = CODE_MODE,
+                        preview: bool = False, formats=None) -> dict:
+    """execute_node 的异步版本，用 asyncio 子进程 / worker 池执行"""
+    code, failure = _extract_last_code(state, mode)
+    failure = failure or _validation_failure(state, code, mode)
+    if failure:
+        return _settle_reply(state, failure, response_cache)
+
+    result = _cache_get(cache, code, persist, formats)
+    if result is None:
+        result = await aexecute_code(code, persist=persist, mode=mode, formats=formats,
+                                     preview=preview)
+        _cache_put(cache, result, formats)
+
+    return _settle_reply(state, _result_update(state, code, result), response_cache)
+
+
+# ========== Speculative ==========
+#
+# 一次请求 K 个候选并发生成、并发执行，第一个成功的胜出，其余取消。
+# 全部失败时返回最先完成的失败候选，之后走正常的 fix 循环。
+#   strategy="temperature": K 个并发请求，温度依次取 SPECULATIVE_TEMPERATURES
+#   strategy="n":           单个请求 n=K（仅 OpenAI 兼容接口支持）
+
+def _candidate_llms(llm, k: int) -> list:
+    temps = SPECULATIVE_TEMPERATURES
+    return [llm.bind(temperature=temps[i % len(temps)]) for i in range(k)]
+
+
+def _pick(outcomes: list) -> dict:
+    """全部失败时取第一个完成的候选"""
+    reply, update = outcomes[0]
+    return {"messages": [reply], **update}
+
+
+@traced("speculate", _executed)
+def speculate_node(state: AgentState, llm, k: int, cache=None,
+                   strategy: str = "temperature", persist: bool = True,
+                   mode: str = CODE_MODE, formats=None) -> dict:
+    """生成并执行 K 个候选，返回第一个成功的；线程无法中断，落选者的结果直接丢弃"""
+    def run(reply):
+        return reply, execute_node({**state, "messages": [reply]}, cache, persist=persist,
+                                   mode=mode, formats=formats)
+
+    messages = _llm_messages(state)
+    pool = ThreadPoolExecutor(max_workers=k)
+    try:
+        if strategy == "n":
+            result = llm.generate([messages], n=k)
+            replies = [g.message for g in result.generations[0]]
+            # 每个候选复制一份上下文，子 span 归入同一条 trace
+            futures = [pool.submit(contextvars.copy_context().run, run, r) for r in replies]
+        else:
+            futures = [
+                pool.submit(contextvars.copy_context().run,
+                            lambda m: run(m.invoke(messages)), m)
+                for m in _candidate_llms(llm, k)
+            ]
+
+        outcomes, last_exc = [], None
+        for fut in as_completed(futures):
+            try:
+                reply, update = fut.result()
+            except Exception as e:
+                last_exc = e
+                continue
+            if not update.get("error"):
+                return {"messages": [reply], **update}
+            outcomes.append((reply, update))
+        if not outcomes:
+            raise last_exc
+        return _pick(outcomes)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@traced("speculate", _executed)
+async def aspeculate_node(state: AgentState, llm, k: int, cache=None,
+                          strategy: str = "temperature",
+                          timeout: Optional[float] = None, persist: bool = True,
+                          mode: str = CODE_MODE, formats=None) -> dict:
+    """speculate_node 的异步版本；胜出后取消其余候选（请求与子进程都会被中止）"""
+    async def run(reply_coro):
+        reply = await asyncio.wait_for(reply_coro, timeout)
+        return reply, await aexecute_node({**state, "messages": [reply]}, cache,
+                                          persist=persist, mode=mode, formats=formats)
+
+    async def ready(reply):
+        return reply
+
+    messages = _llm_messages(state)
+    if strategy == "n":
+        result = await asyncio.wait_for(llm.agenerate([messages], n=k), timeout)
+        tasks = [asyncio.ensure_future(run(ready(g.message))) for g in result.generations[0]]
+    else:
+        tasks = [asyncio.ensure_future(run(m.ainvoke(messages)))
+                 for m in _candidate_llms(llm, k)]
+
+    outcomes, last_exc = [], None
+    try:
+        for fut in asyncio.as_completed(tasks):
+            try:
+                reply, update = await fut
+            except Exception as e:
+                last_exc = e
+                continue
+            if not update.get("error"):
+                return {"messages": [reply], **update}
+            outcomes.append((reply, update))
+    finally:
+        for t in tasks:
+            t.cancel()
+    if not outcomes:
+        raise last_exc
+    return _pick(outcomes)
+
+
+_fingerprints = FingerprintStats()
+
+
+@traced("autofix", lambda u: {"patched": bool(u.get("autofix_patched"))})
+def autofix_node(state: AgentState, mode: str = CODE_MODE) -> dict:
+    """本地规则修复：命中已知错误时生成一条修补后的 AI 回复，直接交给 execute 重跑
+
+    规则针对 TypeScript 脚本，spec 模式下只记录错误指纹。
+    """
+    error = state.get("error") or ""
+    fp = fingerprint(error)
+    tried = list(state.get("autofix_tried") or [])
+    code = state.get("last_code")
+
+    patched, rules = None, []
+    if code and mode == CODE_MODE and fp not in tried and len(tried) < MAX_AUTOFIX:
+        patched, rules = try_autofix(code, error, state.get("output_dir"))
+    _fingerprints.record(fp, error, ",".join(rules) or None)
+
+    if not patched:
+        return {"autofix_patched": False}
+    return {
+        "messages": [AIMessage(content=fence(patched, mode))],
+        "autofix_tried": tried + [fp],
+        "autofix_patched": True,
+        # 本地修补不占用 LLM 修复次数
+        "retry_count": max(0, state.get("retry_count", 0) - 1),
+    }
+
+
+@traced("fix")
+def fix_node(state: AgentState, mode: str = CODE_MODE) -> dict:
     """将执行错误反馈给 LLM，请求修复"""
     error_msg = state.get("error", "未知错误")
+    what = "JSON 图表描述" if mode == SPEC_MODE else "TypeScript 代码块"
     fix_message = HumanMessage(
-        content=f"代码执行报错:\n{error_msg}\n\n请修复代码并重新输出完整的 TypeScript 代码块。"
+        content=f"{FIX_PREFIX}\n{error_msg}\n\n请修复代码并重新输出完整的 {what}。"
     )
     return {"messages": [fix_message]}
 
 
+# ========== Model Tiers ==========
+
+def _tier_llm(state: AgentState, tiers) -> Tuple[object, dict]:
+    """本次调用的模型与要写回状态的档位：本轮首次调用 LLM 时按复杂度选档，之后沿用"""
+    if state.get("tier"):
+        return tiers.llm(state["tier"]), {}
+    complexity = estimate_complexity(_request_text(state["messages"]), state.get("base_code"))
+    tier = tiers.select(complexity)
+    return tiers.llm(tier), {"tier": tier, "complexity": complexity}
+
+
+def _tiered(tiers, call):
+    """把 call(state, model) 包装为使用本轮档位模型的节点"""
+    def node(state):
+        model, update = _tier_llm(state, tiers)
+        with tiers.timed(update.get("tier") or state["tier"],
+                         update.get("complexity", state.get("complexity"))):
+            return {**call(state, model), **update}
+    return node
+
+
+def _atiered(tiers, call):
+    async def node(state):
+        model, update = _tier_llm(state, tiers)
+        with tiers.timed(update.get("tier") or state["tier"],
+                         update.get("complexity", state.get("complexity"))):
+            return {**await call(state, model), **update}
+    return node
+
+
+# ========== Planner ==========
+#
+# 复杂的新请求先请 LLM 给出拆分方案，各子图用同一套 生成 → 执行 → 修复 的子流程
+# 并发处理（各自的修复预算，互不影响），全部成功后组合为一张图导出。
+
+def _plan_messages(state: AgentState) -> Optional[list]:
+    """需要拆分时返回请求拆分方案的消息；追问和不够复杂的请求返回 None"""
+    messages = list(state["messages"])
+    request = _request_text(messages)
+    if state.get("base_code") and is_followup(request):
+        return None
+    i = _request_index(messages)
+    messages[i] = HumanMessage(content=f"{request}\n\n{plan_request()}")
+    return messages
+
+
+def _plan_update(state: AgentState, reply: AIMessage) -> dict:
+    """拆分方案不合法或 LLM 认为不必拆分时返回 plan=None，走普通流程"""
+    text = reply.content if isinstance(reply.content, str) else str(reply.content)
+    try:
+        plan = parse_plan(text)
+    except PlanError:
+        plan = None
+    if plan is None:
+        return {"plan": None}
+    parts_dir = os.path.join(state.get("output_dir") or os.getcwd(), ".parts",
+                             uuid.uuid4().hex[:12])
+    return {"plan": {**plan.to_dict(), "dir": parts_dir}, "parts": None}
+
+
+def _planned(update: dict) -> dict:
+    return {"parts": len((update.get("plan") or {}).get("parts") or [])}
+
+
+@traced("plan", _planned)
+def plan_node(state: AgentState, llm, min_complexity: int) -> dict:
+    """复杂度不低于 min_complexity 的新请求先请 LLM 拆分"""
+    if estimate_complexity(_request_text(state["messages"])) < min_complexity:
+        return {"plan": None}
+    messages = _plan_messages(state)
+    if messages is None:
+        return {"plan": None}
+    return _plan_update(state, llm.invoke(messages))
+
+
+@traced("plan", _planned)
+async def aplan_node(state: AgentState, llm, min_complexity: int,
+                     timeout: Optional[float] = None) -> dict:
+    if estimate_complexity(_request_text(state["messages"])) < min_complexity:
+        return {"plan": None}
+    messages = _plan_messages(state)
+    if messages is None:
+        return {"plan": None}
+    try:
+        reply = await asyncio.wait_for(llm.ainvoke(messages), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"LLM 响应超时 ({timeout:g}s)")
+    return _plan_update(state, reply)
+
+
+def _part_inputs(state: AgentState) -> dict:
+    """各子图子流程的输入状态；system 消息沿用，导出到子图目录"""
+    plan = Plan.from_dict(state["plan"])
+    parts_dir = state["plan"]["dir"]
+    os.makedirs(parts_dir, exist_ok=True)
+    system = [m for m in state["messages"][:1] if isinstance(m, SystemMessage)]
+    request = _request_text(state["messages"])
+    return {
+        part.name: {
+            "messages": system + [HumanMessage(
+                content=part_request(plan, part, request, parts_dir))],
+            "last_code": None,
+            "output_file": None,
+            "retry_count": 0,
+            "error": None,
+            "output_dir": parts_dir,
+        }
+        for part in plan.parts
+    }
+
+
+def _part_outcome(result) -> dict:
+    """子流程的结果（或抛出的异常）→ 记入 parts 的字典"""
+    if isinstance(result, BaseException):
+        return {"ok": False, "code": None, "file": None,
+                "error": f"{type(result).__name__}: {result}", "retries": 0, "usage": {}}
+    error = result.get("error")
+    file = result.get("output_file")
+    if not error and not (file and file.endswith(".svg") and os.path.exists(file)):
+        error = f"子图没有导出为 SVG: {file}"
+    usage = {"input_tokens": 0, "output_tokens": 0}
+    for m in result.get("messages", []):
+        meta = getattr(m, "usage_metadata", None) if isinstance(m, AIMessage) else None
+        for k in usage:
+            usage[k] += (meta or {}).get(k, 0)
+    return {"ok": not error, "code": result.get("last_code"), "file": file, "error": error,
+            "retries": turn_stats(result.get("messages", []))[0], "usage": usage}
+
+
+def _parts_done(update: dict) -> dict:
+    outcomes = update.get("parts") or {}
+    return {"ok": all(o["ok"] for o in outcomes.values()),
+            "failed": [n for n, o in outcomes.items() if not o["ok"]]}
+
+
+@traced("parts", _parts_done)
+def parts_node(state: AgentState, app) -> dict:
+    """并发运行各子图的子流程；子流程在各自的线程里，span 归入同一条 trace"""
+    inputs = _part_inputs(state)
+    with ThreadPoolExecutor(max_workers=len(inputs)) as pool:
+        futures = {name: pool.submit(contextvars.copy_context().run, app.invoke, s)
+                   for name, s in inputs.items()}
+        outcomes = {}
+        for name, fut in futures.items():
+            try:
+                outcomes[name] = _part_outcome(fut.result())
+            except Exception as e:
+                outcomes[name] = _part_outcome(e)
+    return {"parts": outcomes}
+
+
+@traced("parts", _parts_done)
+async def aparts_node(state: AgentState, app) -> dict:
+    inputs = _part_inputs(state)
+    results = await asyncio.gather(*(app.ainvoke(s) for s in inputs.values()),
+                                   return_exceptions=True)
+    return {"parts": {name: _part_outcome(r) for name, r in zip(inputs, results)}}
+
+
+def _compose_input(state: AgentState, mode: str) -> Tuple[Optional[str], dict]:
+    """返回 (组合用的 JSON 图表描述, 状态更新)；有子图失败时描述为 None，更新即为失败结果"""
+    plan = Plan.from_dict(state["plan"])
+    outcomes = dict(state["parts"])
+    usage = {k: sum(o["usage"].get(k, 0) for o in outcomes.values())
+             for k in ("input_tokens", "output_tokens")}
+    usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+    codes = {n: o["code"] or "" for n, o in outcomes.items()}
+    reply = AIMessage(content=summary_reply(plan, codes, mode), usage_metadata=usage)
+
+    failed = [n for n, o in outcomes.items() if not o["ok"]]
+    files = {}
+    for name, o in outcomes.items():
+        if name in failed:
+            continue
+        with open(o["file"], encoding="utf-8") as f:
+            size = svg_size(f.read())
+        if size is None:
+            outcomes[name] = {**o, "ok": False, "error": "无法读取子图 SVG 的尺寸"}
+            failed.append(name)
+        else:
+            files[name] = (o["file"], size)
+    if failed:
+        error = "以下子图在修复预算内仍未成功:\n" + "\n".join(
+            f"[{n}] {(outcomes[n]['error'] or '')[:300]}" for n in failed)
+        return None, {"messages": [reply], "error": error, "last_code": None}
+
+    export = os.path.join(state.get("output_dir") or os.getcwd(), plan.export)
+    return dump_spec(compose_spec(plan, files, export)), {"messages": [reply]}
+
+
+def _compose_update(update: dict, code: str, result: ExecResult) -> dict:
+    if not result.success:
+        return {**update, "last_code": code,
+                "error": f"子图组合失败: {(result.error or '未知错误')[:1000]}"}
+    return {**update, "last_code": code, "output_file": result.output_file,
+            "artifacts": result.artifacts or None, "preview": result.preview,
+            "exports": result.exports, "error": None, "retry_count": 0}
+
+
+@traced("compose", _executed)
+def compose_node(state: AgentState, persist: bool = True, mode: str = CODE_MODE,
+                 preview: bool = False) -> dict:
+    """把各子图的 SVG 按拆分方案组合导出；子图目录用完即删（图片已内嵌）"""
+    try:
+        code, update = _compose_input(state, mode)
+        if code is None:
+            return update
+        result = execute_code(code, persist=persist, mode=SPEC_MODE, preview=preview)
+        return _compose_update(update, code, result)
+    finally:
+        shutil.rmtree(state["plan"]["dir"], ignore_errors=True)
+
+
+@traced("compose", _executed)
+async def acompose_node(state: AgentState, persist: bool = True,
+                        mode: str = CODE_MODE, preview: bool = False) -> dict:
+    try:
+        code, update = _compose_input(state, mode)
+        if code is None:
+            return update
+        result = await aexecute_code(code, persist=persist, mode=SPEC_MODE, preview=preview)
+        return _compose_update(update, code, result)
+    finally:
+        shutil.rmtree(state["plan"]["dir"], ignore_errors=True)
+
+
 # ========== Router ==========
 
-def should_fix(state: AgentState) -> Literal["fix", "done"]:
-    """执行后路由：有错误且重试次数 < 2 → 修复，否则结束"""
-    if state.get("error") and state.get("retry_count", 0) <= 2:
+def route_request(state: AgentState) -> Literal["edit", "full"]:
+    """入口路由：在上一轮成功代码上的追问走增量编辑，其余完整生成"""
+    if not state.get("base_code"):
+        return "full"
+    i = _request_index(state["messages"])
+    request = state["messages"][i].content if i is not None else ""
+    return "edit" if isinstance(request, str) and is_followup(request) else "full"
+
+
+def after_edit(state: AgentState) -> Literal["execute", "full"]:
+    return "execute" if state.get("edit_applied") else "full"
+
+def should_fix(state: AgentState, budget: int = FIX_BUDGET) -> Literal["fix", "done"]:
+    """执行后路由：有错误且还有修复轮数（重试次数 <= budget）→ 修复，否则结束
+
+    限流 / 瞬时错误的重试由 RateLimitedLLM 处理，不占用这里的预算。
+    """
+    if state.get("error") and state.get("retry_count", 0) <= budget:
         return "fix"
     return "done"
 
 
+def after_execute(state: AgentState) -> Literal["autofix", "done"]:
+    """执行后路由：出错先尝试本地修补"""
+    return "autofix" if state.get("error") else "done"
+
+
+def after_autofix(state: AgentState,
+                  budget: int = FIX_BUDGET) -> Literal["execute", "fix", "done"]:
+    """有补丁 → 重新执行，否则按重试次数决定是否交给 LLM 修复"""
+    if state.get("autofix_patched"):
+        return "execute"
+    return should_fix(state, budget)
+
+
 # ========== Graph Builder ==========
 
-def build_graph(llm):
-    """构建 LangGraph 工作流
+def _compile(generate, execute, speculate=None, retrieve=None, edit=None, mode=CODE_MODE,
+             fix_budget=FIX_BUDGET, tiers=None, planner=None):
+    def autofix(state):
+        update = autofix_node(state, mode)
+        # 本地修补不了时本档这次生成算失败
+        if tiers and state.get("tier") and not update.get("autofix_patched"):
+            tiers.stats.record(state["tier"], state.get("complexity") or 0, ok=False)
+        return update
 
-    流程:
-      generate → execute → (success) → END
-                         → (error, retry<2) → fix → generate → ...
-                         → (error, retry>=2) → END
-    """
-    graph = StateGraph(AgentState)
+    def fix(state):
+        update = fix_node(state, mode)
+        if tiers and state.get("tier"):
+            update["tier"] = tiers.escalate(state["tier"])
+        return update
 
-    # 绑定 LLM 到 generate node
-    def gen(state):
-        return generate_node(state, llm)
+    def route_execute(state):
+        if tiers and state.get("tier") and not state.get("error"):
+            tiers.stats.record(state["tier"], state.get("complexity") or 0, ok=True)
+        return after_execute(state)
+
+    def route_autofix(state):
+        return after_autofix(state, fix_budget)
+
+    graph = StateGraph(AgentState)
 
-    graph.add_node("generate", gen)
-    graph.add_node("execute", execute_node)
-    graph.add_node("fix", fix_node)
+    graph.add_node("generate", generate)
+    graph.add_node("execute", execute)
+    graph.add_node("autofix", autofix)
+    graph.add_node("fix", fix)
 
     # 边
-    graph.set_entry_point("generate")
+    if speculate:
+        # 首轮推测执行，全部失败后回到普通的 fix → generate → execute 循环
+        graph.add_node("speculate", speculate)
+        graph.add_conditional_edges("speculate", route_execute, {
+            "autofix": "autofix",
+            "done": END,
+        })
+    first = "speculate" if speculate else "generate"
+    if edit:
+        # 编辑打不上时回到完整生成；打上后与普通回复一样执行、修复
+        graph.add_node("edit", edit)
+        graph.add_conditional_edges("edit", after_edit, {"execute": "execute", "full": first})
+    routes = {"edit": "edit", "full": first}
+    if retrieve:
+        # 每轮只检索一次，之后的修复轮次沿用
+        graph.add_node("retrieve", retrieve)
+        if edit:
+            graph.add_conditional_edges("retrieve", route_request, routes)
+        else:
+            graph.add_edge("retrieve", first)
+
+    if planner:
+        # 拆分后各子图在子流程里生成、执行、修复，这里只负责组合
+        plan, parts, compose = planner
+        graph.add_node("plan", plan)
+        graph.add_node("parts", parts)
+        graph.add_node("compose", compose)
+        graph.set_entry_point("plan")
+
+        def after_plan(state):
+            if state.get("plan"):
+                return "parts"
+            if retrieve:
+                return "retrieve"
+            return route_request(state) if edit else "full"
+
+        targets = {"parts": "parts", "full": first}
+        if retrieve:
+            targets["retrieve"] = "retrieve"
+        elif edit:
+            targets["edit"] = "edit"
+        graph.add_conditional_edges("plan", after_plan, targets)
+        graph.add_edge("parts", "compose")
+        graph.add_edge("compose", END)
+    elif retrieve:
+        graph.set_entry_point("retrieve")
+    elif edit:
+        graph.set_conditional_entry_point(route_request, routes)
+    else:
+        graph.set_entry_point(first)
     graph.add_edge("generate", "execute")
-    graph.add_conditional_edges("execute", should_fix, {
+    graph.add_conditional_edges("execute", route_execute, {
+        "autofix": "autofix",
+        "done": END,
+    })
+    graph.add_conditional_edges("autofix", route_autofix, {
+        "execute": "execute",
         "fix": "fix",
         "done": END,
     })
     graph.add_edge("fix", "generate")
 
     return graph.compile()
+
+
+def build_graph(llm, cache=None, stream: bool = False,
+                on_progress: Optional[ProgressCallback] = None,
+                speculative_k: int = 0, speculative_strategy: str = "temperature",
+                response_cache=None, persist: bool = True, retriever=None,
+                edit_mode: bool = False, output_mode: str = CODE_MODE,
+                fix_budget: int = FIX_BUDGET, tiers=None, plan_complexity: int = 0,
+                preview: bool = False):
+    """构建 LangGraph 工作流
+
+    cache: 可选的 RenderCache，相同代码再次执行时直接复用结果
+    response_cache: 可选的 ResponseCache，相同对话直接复用执行成功过的 LLM 回复
+    persist: False 时导出内容留在内存（结果的 artifacts），由调用方决定是否写盘
+    stream: 流式生成，代码块闭合后立即执行；on_progress 接收生成进度
+    speculative_k: 大于 1 时首轮并发生成 K 个候选，取第一个成功的
+    retriever: 可选的 retrieval.Retriever，入口先检索参考资料，调用 LLM 时附在请求之后；
+               此时 system 消息应使用 build_system_message(..., compact=True)
+    edit_mode: 输入状态带 base_code（上一轮成功的代码）且本轮是追问时，
+               先请求 SEARCH/REPLACE 编辑块在本地打补丁，打不上再完整生成
+    output_mode: "code" 生成 TypeScript 脚本；"spec" 生成 JSON 图表描述，由 worker 直接解释，
+                 此时 system 消息应使用 build_system_message(..., mode="spec")
+    fix_budget: 一次请求最多请 LLM 修复几轮（本地 autofix 不计入）
+    tiers: 可选的 tiers.ModelTiers，generate / edit / speculate 按本轮请求的复杂度选用档位的模型，
+           执行失败或静态检查出错后 fix 升一档；此时 llm 不再使用
+    plan_complexity: 大于 0 时，复杂度（tiers.estimate_complexity）不低于该值的新请求先由
+                     LLM 拆成几张子图，各子图并发走 生成 → 执行 → 修复 的子流程（只重试失败的那张），
+                     再组合为一张图导出；结果的 last_code 为组合用的 JSON 图表描述
+    preview: 渐进导出（需 worker 池且 persist），SVG 预览写出即结束本轮，结果的 preview 为预览文件，
+             exports 为仍在后台导出光栅 / PDF 的 Future；子图不输出预览与额外格式
+
+    流程（speculative_k > 1 时入口为 speculate，失败后同样进入 autofix）:
+      generate → execute → (success) → END
+                         → (error) → autofix → (已知错误，本地修补) → execute
+                                             → (retry<=fix_budget) → fix → generate → ...
+                                             → (retry>fix_budget) → END
+    edit_mode 下的追问: edit → (打上) → execute → ...
+                            → (打不上) → generate
+    plan_complexity > 0 时入口为 plan: (拆分) → parts → compose → END
+                                       → (不拆分) → 上述流程
+    """
+    # 绑定 LLM 到 generate node
+    def gen(state, model=llm):
+        return generate_node(state, model, stream, on_progress, response_cache)
+
+    def exe(state):
+        return execute_node(state, cache, response_cache, persist, output_mode, preview)
+
+    def spec(state, model=llm):
+        return speculate_node(state, model, speculative_k, cache, speculative_strategy, persist,
+                              output_mode)
+
+    def ret(state):
+        return retrieve_node(state, retriever)
+
+    def edit(state, model=llm):
+        return edit_node(state, model, output_mode)
+
+    if tiers:
+        gen, spec, edit = (_tiered(tiers, f) for f in (gen, spec, edit))
+    speculate = spec if speculative_k > 1 else None
+    retrieve = ret if retriever else None
+
+    planner = None
+    if plan_complexity > 0:
+        # 子图是 compose 读取后即删的中间文件，无论 persist 如何都写到子图目录
+        def part_exe(state):
+            return execute_node(state, cache, response_cache, True, output_mode, formats=())
+
+        def part_spec(state, model=llm):
+            return speculate_node(state, model, speculative_k, cache, speculative_strategy,
+                                  True, output_mode, formats=())
+
+        if tiers:
+            part_spec = _tiered(tiers, part_spec)
+        parts_app = _compile(gen, part_exe, part_spec if speculate else None, retrieve, None,
+                             output_mode, fix_budget, tiers)
+        # 拆分用最强的模型
+        plan_llm = tiers.llm(STRONG_TIER) if tiers else llm
+
+        def plan(state):
+            return plan_node(state, plan_llm, plan_complexity)
+
+        def parts(state):
+            return parts_node(state, parts_app)
+
+        def compose(state):
+            return compose_node(state, persist, output_mode, preview)
+
+        planner = (plan, parts, compose)
+
+    return _compile(gen, exe, speculate, retrieve, edit if edit_mode else None, output_mode,
+                    fix_budget, tiers, planner)
+
+
+def build_async_graph(llm, cache=None, llm_timeout: Optional[float] = 120,
+                      stream: bool = False,
+                      on_progress: Optional[ProgressCallback] = None,
+                      speculative_k: int = 0, speculative_strategy: str = "temperature",
+                      response_cache=None, persist: bool = True, retriever=None,
+                      edit_mode: bool = False, output_mode: str = CODE_MODE,
+                      fix_budget: int = FIX_BUDGET, tiers=None, plan_complexity: int = 0,
+                      preview: bool = False):
+    """构建异步工作流，用 app.ainvoke() 调用；流程与 build_graph 相同
+
+    多个会话可以共享同一个事件循环并发运行。
+    """
+    async def gen(state, model=llm):
+        return await agenerate_node(state, model, llm_timeout, stream, on_progress,
+                                    response_cache)
+
+    async def exe(state):
+        return await aexecute_node(state, cache, response_cache, persist, output_mode, preview)
+
+    async def spec(state, model=llm):
+        return await aspeculate_node(state, model, speculative_k, cache,
+                                     speculative_strategy, llm_timeout, persist, output_mode)
+
+    def ret(state):
+        return retrieve_node(state, retriever)
+
+    async def edit(state, model=llm):
+        return await aedit_node(state, model, llm_timeout, output_mode)
+
+    if tiers:
+        gen, spec, edit = (_atiered(tiers, f) for f in (gen, spec, edit))
+    speculate = spec if speculative_k > 1 else None
+    retrieve = ret if retriever else None
+
+    planner = None
+    if plan_complexity > 0:
+        async def part_exe(state):
+            return await aexecute_node(state, cache, response_cache, True, output_mode,
+                                       formats=())
+
+        async def part_spec(state, model=llm):
+            return await aspeculate_node(state, model, speculative_k, cache,
+                                         speculative_strategy, llm_timeout, True,
+                                         output_mode, formats=())
+
+        if tiers:
+            part_spec = _atiered(tiers, part_spec)
+        parts_app = _compile(gen, part_exe, part_spec if speculate else None, retrieve, None,
+                             output_mode, fix_budget, tiers)
+        plan_llm = tiers.llm(STRONG_TIER) if tiers else llm
+
+        async def plan(state):
+            return await aplan_node(state, plan_llm, plan_complexity, llm_timeout)
+
+        async def parts(state):
+            return await aparts_node(state, parts_app)
+
+        async def compose(state):
+            return await acompose_node(state, persist, output_mode, preview)
+
+        planner = (plan, parts, compose)
+
+    return _compile(gen, exe, speculate, retrieve, edit if edit_mode else None, output_mode,
+                    fix_budget, tiers, planner)
@@ -0,0 +1,206 @@
+"""对话历史管理 — 按 token 预算压缩多轮对话"""
+
+import re
+import threading
+from collections.abc import Sequence as SequenceABC
+from typing import Iterable, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# fix_node 生成的修复请求以此开头
+FIX_PREFIX = "代码执行报错:"
+SUMMARY_PREFIX = "[早前对话摘要]"
+CODE_PLACEHOLDER = "（此前生成的代码已省略，以最新版本为准）"
+
+_CJK = re.compile(r"[⺀-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个，其余按 4 个字符 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _text(msg: BaseMessage) -> str:
+    if isinstance(msg.content, str):
+        return msg.content
+    return "".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in msg.content)
+
+
+def message_tokens(messages: Sequence[BaseMessage]) -> int:
+    # 每条消息另计 4 个 token 的角色 / 分隔开销
+    return sum(estimate_tokens(_text(m)) + 4 for m in messages)
+
+
+def is_fix_message(msg: BaseMessage) -> bool:
+    return isinstance(msg, HumanMessage) and _text(msg).startswith(FIX_PREFIX)
+
+
+# ========== 只追加的消息序列 ==========
+
+_append_lock = threading.Lock()
+
+
+class MessageLog(SequenceABC):
+    """只追加、结构共享的消息序列
+
+    每个 MessageLog 是共享底层 list 的前 n 条。在末端追加时直接扩展底层 list，
+    返回更长的新视图，旧视图看到的内容不变；从中间分叉追加不同的消息时才复制前缀。
+    一轮对话里各节点的追加因此只花 O(新增条数)，而不是每次复制整段对话。
+    """
+
+    __slots__ = ("_items", "_len")
+
+    def __init__(self, messages: Iterable[BaseMessage] = ()):
+        self._items = list(messages)
+        self._len = len(self._items)
+
+    @classmethod
+    def of(cls, messages: Iterable[BaseMessage]) -> "MessageLog":
+        return messages if isinstance(messages, MessageLog) else cls(messages)
+
+    def extend(self, messages: Iterable[BaseMessage]) -> "MessageLog":
+        new = list(messages)
+        if not new:
+            return self
+        end = self._len + len(new)
+        with _append_lock:
+            items = self._items
+            if len(items) == self._len:
+                items.extend(new)
+            elif len(items) < end or any(x is not y for x, y in zip(items[self._len:end], new)):
+                items = items[:self._len] + new
+            # 否则这些消息已经由别的视图追加过（langgraph 在副本上预演更新以计算路由），直接共享
+            length = end
+        log = MessageLog.__new__(MessageLog)
+        log._items = items
+        log._len = length
+        return log
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._items[i] for i in range(self._len)[index]]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("MessageLog index out of range")
+        return self._items[index]
+
+    def __iter__(self):
+        items = self._items
+        for i in range(self._len):
+            yield items[i]
+
+    def __reversed__(self):
+        items = self._items
+        for i in range(self._len - 1, -1, -1):
+            yield items[i]
+
+    def __repr__(self) -> str:
+        return f"MessageLog({self._len} messages)"
+
+
+def append_messages(a: Sequence[BaseMessage], b: Sequence[BaseMessage]) -> MessageLog:
+    """AgentState.messages 的 reducer：a 为空时直接沿用 b（通常是历史的 MessageLog）"""
+    if not a:
+        return MessageLog.of(b)
+    return MessageLog.of(a).extend(b)
+
+
+class HistoryManager:
+    """按轮次维护对话，每轮结束后压缩
+
+    - 成功的一轮只保留用户请求和最终回复，丢掉失败的尝试和修复请求
+    - 只保留最近一次成功的代码，更早的代码替换为占位文字
+    - 超出 token 预算时，把最早的若干轮折叠成一条摘要
+
+    messages 是缓存的 MessageLog：add_user 只在末端追加，压缩或改 system 后才重建。
+    """
+
+    def __init__(self, system: SystemMessage, budget: int = 8000):
+        self._system = system
+        self.budget = budget
+        self.turns: List[List[BaseMessage]] = []
+        self.summary: List[str] = []
+        self._log: Optional[MessageLog] = None
+
+    @property
+    def system(self) -> SystemMessage:
+        return self._system
+
+    @system.setter
+    def system(self, message: SystemMessage) -> None:
+        self._system = message
+        self._log = None
+
+    @property
+    def messages(self) -> MessageLog:
+        if self._log is None:
+            msgs: List[BaseMessage] = [self._system]
+            if self.summary:
+                msgs.append(HumanMessage(content="\n".join([SUMMARY_PREFIX, *self.summary])))
+            for turn in self.turns:
+                msgs.extend(turn)
+            self._log = MessageLog(msgs)
+        return self._log
+
+    def add_user(self, text: str) -> None:
+        message = HumanMessage(content=text)
+        self.turns.append([message])
+        if self._log is not None:
+            self._log = self._log.extend([message])
+
+    def clear(self) -> None:
+        self.turns = []
+        self.summary = []
+        self._log = None
+
+    def commit_turn(self, result: Sequence[BaseMessage], success: bool) -> int:
+        """用工作流返回的完整消息替换当前轮并压缩，返回下次请求节省的 token 数"""
+        if not self.turns:
+            return 0
+        before = message_tokens(result)
+        self._log = None
+
+        turn = self._current_turn(result)
+        if success:
+            turn = self._collapse(turn)
+            # 最新代码已成功，更早各轮的失败尝试、修复请求和旧代码都不再需要
+            for i, earlier in enumerate(self.turns[:-1]):
+                self.turns[i] = [self._strip_code(m) for m in self._collapse(earlier)]
+        self.turns[-1] = turn
+
+        while len(self.turns) > 1 and message_tokens(self.messages) > self.budget:
+            oldest = self.turns.pop(0)
+            self._log = None
+            request = " ".join(_text(oldest[0]).split())
+            self.summary.append(f"- 用户曾要求: {request[:100]}")
+
+        return max(0, before - message_tokens(self.messages))
+
+    def _current_turn(self, result: Sequence[BaseMessage]) -> List[BaseMessage]:
+        """result 中从本轮用户消息开始的部分"""
+        start = self.turns[-1][0]
+        for i in range(len(result) - 1, -1, -1):
+            m = result[i]
+            if m is start or (
+                isinstance(m, HumanMessage) and not is_fix_message(m)
+                and m.content == start.content
+            ):
+                return list(result[i:])
+        return [start]
+
+    @staticmethod
+    def _collapse(turn: List[BaseMessage]) -> List[BaseMessage]:
+        """只保留用户请求和最后一条 AI 回复"""
+        final = next((m for m in reversed(turn) if isinstance(m, AIMessage)), None)
+        return [turn[0]] + ([final] if final else [])
+
+    @staticmethod
+    def _strip_code(msg: BaseMessage) -> BaseMessage:
+        if isinstance(msg, AIMessage) and "```" in _text(msg):
+            return AIMessage(content=CODE_PLACEHOLDER)
+        return msg
@@ -0,0 +1,183 @@
+"""LLM 客户端 — 按配置创建并复用 LangChain 聊天模型
+
+同一份服务商配置只创建一次客户端，/switch、/setup 和 HTTP 服务的各个请求共用，
+底层 HTTP 连接池（keep-alive）随之复用。配置了 routing.providers 时，
+build_llm() 返回在多个服务商之间对冲 / 切换的 HedgedLLM。
+
+服务商 SDK 在 create_llm 中按需导入（各自需要 1 秒以上），只加载实际用到的那个。
+
+启用 rate_limit 时每个客户端外面包一层 RateLimitedLLM：同一服务商 / 模型在进程内
+共享令牌桶，429 / 5xx 由它退避重试，SDK 自身的重试关闭。
+
+启用 tiers 时 build_tiers() 另外返回按复杂度选择的快速档，失败后升到 build_llm() 的模型。
+"""
+
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+from ratelimit import RateLimitedLLM, get_limiter, limits_for
+from routing import HedgedLLM, ProviderStats
+from tiers import STRONG_TIER, ModelTiers, Tier
+
+PROVIDERS = ("tongyi", "claude", "custom")
+
+
+def create_llm(config: dict, max_retries: Optional[int] = None):
+    """根据配置创建 LangChain LLM 实例；max_retries 为 None 时使用 SDK 默认的重试次数"""
+    provider = config.get("provider", "tongyi")
+    extra = {} if max_retries is None else {"max_retries": max_retries}
+
+    if provider == "tongyi":
+        from langchain_openai import ChatOpenAI
+
+        cfg = config.get("tongyi", {})
+        return ChatOpenAI(
+            api_key=cfg.get("api_key", ""),
+            base_url=cfg.get("endpoint", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+            model=cfg.get("model", "qwen-plus"),
+            temperature=0.3,
+            stream_usage=True,
+            **extra,
+        )
+
+    elif provider == "claude":
+        from langchain_anthropic import ChatAnthropic
+
+        cfg = config.get("claude", {})
+        token = cfg.get("oauth_token") or cfg.get("api_key", "")
+        return ChatAnthropic(
+            api_key=token,
+            model_name=cfg.get("model", "claude-sonnet-4-20250514"),
+            temperature=0.3,
+            max_tokens=4096,
+            **extra,
+        )
+
+    elif provider == "custom":
+        from langchain_openai import ChatOpenAI
+
+        cfg = config.get("custom", {})
+        return ChatOpenAI(
+            api_key=cfg.get("api_key", ""),
+            base_url=cfg.get("endpoint", ""),
+            model=cfg.get("model", ""),
+            temperature=0.3,
+            stream_usage=True,
+            **extra,
+        )
+
+    else:
+        raise ValueError(f"未知的 provider: {provider}")
+
+
+_clients: Dict[Tuple[str, str], object] = {}
+_lock = threading.Lock()
+
+
+def get_llm(config: dict, max_retries: Optional[int] = None):
+    """create_llm 的缓存版本：服务商及其配置不变时返回同一个客户端"""
+    provider = config.get("provider", "tongyi")
+    key = (provider, json.dumps([config.get(provider, {}), max_retries], sort_keys=True))
+    with _lock:
+        llm = _clients.get(key)
+        if llm is None:
+            llm = _clients[key] = create_llm(config, max_retries)
+        return llm
+
+
+def _configured(config: dict, provider: str) -> bool:
+    cfg = config.get(provider, {})
+    return bool(cfg.get("api_key") or cfg.get("oauth_token")) and (
+        provider != "custom" or bool(cfg.get("endpoint")))
+
+
+def _limited(config: dict, provider: str, routed: bool):
+    """按 rate_limit 配置给服务商客户端加上共享限流；未启用时返回 SDK 默认重试的客户端
+
+    routed 为 True 时由 HedgedLLM 切换服务商并在整轮失败后退避，限流层不再重试同一个服务商。
+    """
+    settings = config.get("rate_limit", {})
+    if not settings.get("enabled", True):
+        return get_llm({**config, "provider": provider}, max_retries=0 if routed else None)
+    model = config.get(provider, {}).get("model", "")
+    limits = limits_for(settings, provider, model)
+    return RateLimitedLLM(
+        get_llm({**config, "provider": provider}, max_retries=0),
+        get_limiter(provider, model, limits.get("rpm", 0), limits.get("tpm", 0),
+                    limits.get("burst_seconds", 1.0)),
+        max_retries=0 if routed else limits.get("max_retries", 4),
+        backoff_base=limits.get("backoff_base", 1.0),
+        backoff_max=limits.get("backoff_max", 30.0),
+    )
+
+
+_routers: Dict[Tuple[str, ...], object] = {}
+# 按服务商累计的延迟 / 错误统计，各路由器共享
+_stats: Dict[str, ProviderStats] = {}
+
+
+def build_llm(config: dict):
+    """当前服务商的客户端；routing.providers 中有多个已配置的服务商时返回 HedgedLLM
+
+    当前 provider 排在首位，其余按 routing.providers 的顺序。
+    同一组服务商复用同一个路由器；延迟统计按服务商保存，/switch 后保留。
+    所有服务商都返回可重试错误时按 routing.retries 整轮重试，退避参数取首选服务商的 rate_limit 配置。
+    各服务商客户端按 rate_limit 配置限流，限流状态按服务商 / 模型在进程内共享。
+    """
+    routing = config.get("routing", {})
+    primary = config.get("provider", "tongyi")
+    names = [primary] + [p for p in routing.get("providers", []) if p != primary]
+    names = [p for p in names if p in PROVIDERS and (p == primary or _configured(config, p))]
+    if len(names) < 2:
+        return _limited(config, primary, routed=False)
+
+    # 由路由器负责切换，SDK 内部不再重试同一个服务商
+    llms = {p: _limited(config, p, routed=True) for p in names}
+    limits = limits_for(config.get("rate_limit", {}), primary,
+                        config.get(primary, {}).get("model", ""))
+    key = tuple(names) + (json.dumps([config.get(p, {}) for p in names]
+                                     + [config.get("rate_limit", {})], sort_keys=True),)
+    with _lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = HedgedLLM(
+                llms,
+                hedge=routing.get("hedge", True),
+                hedge_min=routing.get("hedge_min_seconds", 1.0),
+                hedge_default=routing.get("hedge_default_seconds", 8.0),
+                min_samples=routing.get("min_samples", 5),
+                error_threshold=routing.get("error_threshold", 0.5),
+                stats={p: _stats.setdefault(p, ProviderStats()) for p in names},
+                retries=routing.get("retries", 2),
+                backoff_base=limits.get("backoff_base", 1.0),
+                backoff_max=limits.get("backoff_max", 30.0),
+            )
+        return router
+
+
+def build_tiers(config: dict, llm=None) -> Optional[ModelTiers]:
+    """按 tiers 配置构建模型分档；未启用或没有可用的快速档时返回 None
+
+    快速档只用各自的服务商，不参与 routing 对冲，同样按 rate_limit 限流；
+    最后一档 strong 为 llm（缺省为 build_llm(config)）。
+    """
+    settings = config.get("tiers", {})
+    if not settings.get("enabled", False):
+        return None
+    primary = config.get("provider", "tongyi")
+    tiers = []
+    for level in settings.get("levels", []):
+        provider = level.get("provider") or primary
+        if provider not in PROVIDERS or (provider != primary and not _configured(config, provider)):
+            continue
+        model = level.get("model") or config.get(provider, {}).get("model", "")
+        cfg = {**config, "provider": provider,
+               provider: {**config.get(provider, {}), "model": model}}
+        tiers.append(Tier(level.get("name") or f"tier{len(tiers) + 1}",
+                          _limited(cfg, provider, routed=False),
+                          level.get("max_complexity", 6)))
+    if not tiers:
+        return None
+    tiers.append(Tier(STRONG_TIER, llm if llm is not None else build_llm(config)))
+    return ModelTiers(tiers)
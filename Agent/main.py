@@ -1,55 +1,69 @@
 #!/usr/bin/env python3
-"""Flowing Agent — LangGraph 驱动的智能图表生成器"""
+"""Flowing Agent — LangGraph 驱动的智能图表生成器
 
+启动时只加载配置与消息类型：langgraph 在首个请求编译工作流时导入，
+服务商 SDK 在 create_llm 中按需导入。启动耗时见 python bench.py --startup。
+"""
+
+import atexit
 import os
 import sys
+import time
 
 # 确保 Agent/ 目录在 path 中
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-
-from config import load_config, setup_wizard
-from prompt import build_system_prompt
-from graph import build_graph
+from batch import run_batch
+from cache import RenderCache, ResponseCache
+from config import DEFAULT_CONFIG, load_config, setup_wizard
+from executor import CODE_MODE, OUTPUT_MODES, configure_pool, save_artifacts, shutdown_pool
+from history import HistoryManager
+from llm import PROVIDERS, build_llm, build_tiers
+from metrics import latency, serve_metrics, tracer, turn_stats
+from prompt import build_system_message, prompt_cache_usage
+from ratelimit import summary as rate_limit_summary
+from retrieval import Retriever
+from routing import is_retryable
+from tiers import tier_stats
+
+
+def show_progress(chars: int, done: bool) -> None:
+    """流式生成时在同一行刷新进度"""
+    if done:
+        print(f"\r生成中... {chars} 字符，代码块完成，开始执行", flush=True)
+    else:
+        print(f"\r生成中... {chars} 字符", end="", flush=True)
 
 
-def create_llm(config: dict):
-    """根据配置创建 LangChain LLM 实例"""
-    provider = config.get("provider", "tongyi")
+def report_exports(future) -> None:
+    """渐进导出的后台阶段完成时在 REPL 中报告"""
+    def done(f):
+        if f.exception():
+            print(f"\n(后台导出失败: {str(f.exception())[:300]})")
+        else:
+            print(f"\n(后台导出完成: {', '.join(f.result())})")
+    future.add_done_callback(done)
 
-    if provider == "tongyi":
-        cfg = config.get("tongyi", {})
-        return ChatOpenAI(
-            api_key=cfg.get("api_key", ""),
-            base_url=cfg.get("endpoint", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
-            model=cfg.get("model", "qwen-plus"),
-            temperature=0.3,
-        )
 
-    elif provider == "claude":
-        cfg = config.get("claude", {})
-        token = cfg.get("oauth_token") or cfg.get("api_key", "")
-        return ChatAnthropic(
-            api_key=token,
-            model_name=cfg.get("model", "claude-sonnet-4-20250514"),
-            temperature=0.3,
-            max_tokens=4096,
-        )
+def wait_exports(pending: list, timeout: float = 60) -> None:
+    """退出前等待仍在后台进行的导出，避免 worker 先被关闭"""
+    pending = [f for f in pending if not f.done()]
+    if pending:
+        print("等待后台导出完成...")
+    for f in pending:
+        try:
+            f.result(timeout)
+        except Exception:
+            pass
 
-    elif provider == "custom":
-        cfg = config.get("custom", {})
-        return ChatOpenAI(
-            api_key=cfg.get("api_key", ""),
-            base_url=cfg.get("endpoint", ""),
-            model=cfg.get("model", ""),
-            temperature=0.3,
-        )
 
-    else:
-        raise ValueError(f"未知的 provider: {provider}")
+def _option(args: list, name: str, default=None):
+    """读取 `--name value` 形式的命令行参数"""
+    if name in args:
+        idx = args.index(name)
+        if idx + 1 < len(args):
+            return args[idx + 1]
+    return default
 
 
 def main():
@@ -67,19 +81,137 @@ def main():
         config = setup_wizard()
 
     # --provider 临时切换
-    if "--provider" in args:
-        idx = args.index("--provider")
-        if idx + 1 < len(args):
-            config["provider"] = args[idx + 1]
+    config["provider"] = _option(args, "--provider", config["provider"])
 
     provider_name = config["provider"]
-    llm = create_llm(config)
+    executor_cfg = dict(config.get("executor", DEFAULT_CONFIG["executor"]))
+    # --formats webp,pdf 临时指定额外导出的格式
+    formats = _option(args, "--formats")
+    if formats is not None:
+        executor_cfg["formats"] = [f for f in formats.split(",") if f]
+    configure_pool(executor_cfg)
+    persist = executor_cfg.get("persist", True)
+    # --preview 开启渐进导出：先返回 SVG 预览（导出为光栅 / PDF 时另写一个同名 .svg），其余格式在后台导出
+    preview = executor_cfg.get("preview", False) or "--preview" in args
+    atexit.register(shutdown_pool)
     output_dir = os.getcwd()
-    system_prompt = build_system_prompt(output_dir)
-    app = build_graph(llm)
+    # --no-cache 关闭渲染缓存与回复缓存
+    use_cache = "--no-cache" not in args
+    cache_cfg = config.get("render_cache", DEFAULT_CONFIG["render_cache"])
+    cache = (
+        RenderCache(max_bytes=cache_cfg.get("max_mb", 200) * 1024 * 1024)
+        if use_cache and cache_cfg.get("enabled", True) else None
+    )
+    reply_cfg = config.get("response_cache", DEFAULT_CONFIG["response_cache"])
+    response_cache = (
+        ResponseCache(ttl=reply_cfg.get("ttl_hours", 168) * 3600,
+                      max_bytes=reply_cfg.get("max_mb", 50) * 1024 * 1024)
+        if use_cache and reply_cfg.get("enabled", False) else None
+    )
+    metrics_cfg = config.get("metrics", DEFAULT_CONFIG["metrics"])
+    if not metrics_cfg.get("trace", True):
+        tracer.path = None
+    metrics_port = int(_option(args, "--metrics-port", metrics_cfg.get("port", 0)))
+    if metrics_port:
+        serve_metrics(metrics_port)
+        print(f"Prometheus 指标: http://127.0.0.1:{metrics_port}/metrics")
+    agent_cfg = config.get("agent", DEFAULT_CONFIG["agent"])
+    stream = agent_cfg.get("stream", True)
+    speculative_k = agent_cfg.get("speculative_k", 0)
+    speculative_strategy = agent_cfg.get("speculative_strategy", "temperature")
+    edit_mode = agent_cfg.get("edit_mode", True)
+    # --output-mode code|spec：生成 TypeScript 脚本或 JSON 图表描述
+    output_mode = _option(args, "--output-mode", agent_cfg.get("output_mode", CODE_MODE))
+    if output_mode not in OUTPUT_MODES:
+        print(f"未知的输出模式: {output_mode}，改用 {CODE_MODE}")
+        output_mode = CODE_MODE
+    fix_budget = agent_cfg.get("fix_budget", 2)
+    plan_complexity = agent_cfg.get("plan_complexity", 0)
+    mode = f"speculative-k{speculative_k}" if speculative_k > 1 else "serial"
+    # --no-retrieval 关闭参考资料检索，使用完整 system prompt
+    retrieval_cfg = config.get("retrieval", DEFAULT_CONFIG["retrieval"])
+    retriever = (
+        Retriever(top_k=retrieval_cfg.get("top_k", 3),
+                  max_chars=retrieval_cfg.get("max_chars", 2500))
+        if "--no-retrieval" not in args and retrieval_cfg.get("enabled", True) else None
+    )
+    compact = retriever is not None
+
+    # LLM 客户端与工作流在首个请求时创建；/switch、/setup 后重新创建
+    llm = None
+    app = None
+
+    def ensure_app():
+        nonlocal llm, app
+        if app is None:
+            from graph import build_graph
+
+            if llm is None:
+                llm = build_llm(config)
+            app = build_graph(llm, cache, stream=stream, on_progress=show_progress,
+                              speculative_k=speculative_k,
+                              speculative_strategy=speculative_strategy,
+                              response_cache=response_cache, persist=persist,
+                              retriever=retriever, edit_mode=edit_mode,
+                              output_mode=output_mode, fix_budget=fix_budget,
+                              tiers=build_tiers(config, llm),
+                              plan_complexity=plan_complexity, preview=preview)
+        return app
+
+    # --batch prompts.jsonl --out results.jsonl --concurrency N
+    if "--batch" in args:
+        prompts_path = _option(args, "--batch")
+        out_path = _option(args, "--out", "results.jsonl")
+        concurrency = int(_option(args, "--concurrency", "4"))
+        if not prompts_path:
+            print("用法: --batch prompts.jsonl [--out results.jsonl] [--concurrency N]")
+            return
+        from graph import build_async_graph
+
+        llm = build_llm(config)
+        run_batch(build_async_graph(llm, cache, stream=stream,
+                                    speculative_k=speculative_k,
+                                    speculative_strategy=speculative_strategy,
+                                    response_cache=response_cache, persist=persist,
+                                    retriever=retriever, output_mode=output_mode,
+                                    fix_budget=fix_budget, tiers=build_tiers(config, llm),
+                                    plan_complexity=plan_complexity),
+                  prompts_path, out_path,
+                  concurrency, output_dir, provider_name, compact, output_mode)
+        return
 
-    # 对话历史（LangGraph 的 messages 会自动累积，这里维护完整历史）
-    history = [SystemMessage(content=system_prompt)]
+    # 对话历史：每轮结束后按 token 预算压缩
+    history_budget = agent_cfg.get("history_budget", 8000)
+
+    # --serve [--host H] [--port N]
+    if "--serve" in args:
+        from graph import build_graph
+        from server import AgentService, serve
+
+        server_cfg = config.get("server", DEFAULT_CONFIG["server"])
+        llm = build_llm(config)
+        # 导出内容留在内存，由每个请求决定是否写盘 / 内联返回
+        service = AgentService(
+            build_graph(llm, cache, speculative_k=speculative_k,
+                        speculative_strategy=speculative_strategy,
+                        response_cache=response_cache, persist=False,
+                        retriever=retriever, edit_mode=edit_mode,
+                        output_mode=output_mode, fix_budget=fix_budget,
+                        tiers=build_tiers(config, llm), plan_complexity=plan_complexity),
+            provider_name, output_dir,
+            concurrency=server_cfg.get("concurrency", 4),
+            queue_size=server_cfg.get("queue_size", 16),
+            per_client=server_cfg.get("per_client", 2),
+            max_sessions=server_cfg.get("max_sessions", 100),
+            history_budget=history_budget,
+            compact=compact,
+            output_mode=output_mode,
+        )
+        serve(service, _option(args, "--host", server_cfg.get("host", "127.0.0.1")),
+              int(_option(args, "--port", server_cfg.get("port", 8765))))
+        return
+    history = HistoryManager(
+        build_system_message(output_dir, provider_name, compact, output_mode), history_budget)
 
     print()
     print("╔══════════════════════════════════════╗")
@@ -94,9 +226,16 @@ def main():
     print("  /setup    重新配置")
     print("  /last     查看上次生成的代码")
     print("  /clear    清除对话历史")
+    print("  /cache    查看渲染缓存与回复缓存命中情况")
+    print("  /latency  查看各模式的端到端延迟")
+    print("  /stats    查看各阶段耗时、重试与 token 统计")
     print()
 
     last_code = ""
+    # 上一轮成功的代码，追问时在其上增量编辑
+    base_code = None
+    # 渐进导出中仍在后台进行的光栅 / PDF 导出
+    pending_exports = []
 
     while True:
         try:
@@ -123,15 +262,71 @@ def main():
             continue
 
         if user_input == "/clear":
-            history = [SystemMessage(content=system_prompt)]
+            history.clear()
+            base_code = None
             print("对话历史已清除。\n")
             continue
 
+        if user_input == "/cache":
+            if cache:
+                st = cache.stats()
+                print(f"渲染缓存: 命中 {st['hits']} / 未命中 {st['misses']} "
+                      f"(命中率 {st['hit_rate']:.0%})")
+            else:
+                print("渲染缓存未启用。")
+            if response_cache:
+                st = response_cache.stats()
+                print(f"回复缓存: 命中 {st['hits']} / 未命中 {st['misses']} "
+                      f"(命中率 {st['hit_rate']:.0%})，{st['entries']} 条 "
+                      f"{st['bytes'] / 1024:.0f} KB")
+            else:
+                print("回复缓存未启用。")
+            print()
+            continue
+
+        if user_input == "/latency":
+            summary = latency.summary()
+            if not summary:
+                print("还没有延迟数据。\n")
+            for m, st in summary.items():
+                print(f"{m}: {st['count']} 次, p50 {st['p50']:.2f}s, p95 {st['p95']:.2f}s")
+            print()
+            continue
+
+        if user_input == "/stats":
+            summary = tracer.summary()
+            if not summary["stages"]:
+                print("还没有统计数据。\n")
+                continue
+            print(f"{'阶段':<14s}{'次数':>6s}{'p50':>9s}{'p95':>9s}")
+            for stage, st in summary["stages"].items():
+                print(f"{stage:<16s}{st['count']:>6d}{st['p50']:>8.2f}s{st['p95']:>8.2f}s")
+            req = summary["requests"]
+            if req["count"]:
+                print(f"每次请求: 修复 p50 {req['retries_p50']} / p95 {req['retries_p95']} "
+                      f"(平均 {req['retries_mean']:.2f})，"
+                      f"tokens p50 {req['tokens_p50']} / p95 {req['tokens_p95']} "
+                      f"(平均 {req['tokens_mean']:.0f})")
+            if llm is not None and hasattr(llm, "summary"):
+                for name, st in llm.summary().items():
+                    detail = "，".join(f"{k} {v}" for k, v in st.items())
+                    print(f"服务商 {name}: {detail}")
+            for name, st in rate_limit_summary().items():
+                detail = "，".join(f"{k} {v}" for k, v in st.items())
+                print(f"限流 {name}: {detail}")
+            for name, st in tier_stats.summary().items():
+                detail = "，".join(f"{k} {v}" for k, v in st.items())
+                print(f"档位 {name}: {detail}")
+            if tracer.path:
+                print(f"追踪文件: {tracer.path}")
+            print()
+            continue
+
         if user_input == "/setup":
             config = setup_wizard()
-            llm = create_llm(config)
-            app = build_graph(llm)
+            llm, app = build_llm(config), None
             provider_name = config["provider"]
+            history.system = build_system_message(output_dir, provider_name, compact, output_mode)
             print(f"配置已更新，当前 LLM: {provider_name}\n")
             continue
 
@@ -142,12 +337,12 @@ def main():
                 print("用法: /switch tongyi|claude|custom\n")
             else:
                 p = parts[1]
-                if p in ("tongyi", "claude", "custom"):
+                if p in PROVIDERS:
                     config["provider"] = p
                     try:
-                        llm = create_llm(config)
-                        app = build_graph(llm)
+                        llm, app = build_llm(config), None
                         provider_name = p
+                        history.system = build_system_message(output_dir, p, compact, output_mode)
                         print(f"已切换到 {p}\n")
                     except Exception as e:
                         print(f"切换失败: {e}\n")
@@ -156,30 +351,62 @@ def main():
             continue
 
         # 正常对话 — 调用 LangGraph
-        history.append(HumanMessage(content=user_input))
-        print("\n生成中...")
+        history.add_user(user_input)
+        # 流式模式下由 show_progress 打印进度
+        print("\n生成中..." if not stream else "")
 
         try:
-            result = app.invoke({
-                "messages": list(history),
-                "last_code": None,
-                "output_file": None,
-                "retry_count": 0,
-                "error": None,
-            })
-
-            # 更新历史（从 result messages 中取新增的部分）
-            new_messages = result.get("messages", [])
-            if len(new_messages) > len(history):
-                history = list(new_messages)
-
+            started = time.perf_counter()
+            with tracer.span("request", mode=mode) as span:
+                result = ensure_app().invoke({
+                    "messages": history.messages,
+                    "last_code": None,
+                    "output_file": None,
+                    "retry_count": 0,
+                    "error": None,
+                    "output_dir": output_dir,
+                    "base_code": base_code,
+                })
+                span["ok"] = not result.get("error")
+            latency.record(mode, time.perf_counter() - started)
+            tracer.record_request(*turn_stats(result.get("messages", [])[len(history.messages):]))
+
+            # persist=False 时导出内容在内存中，REPL 需要文件，统一写盘
+            save_artifacts(result.get("artifacts") or [])
             last_code = result.get("last_code", "") or ""
             output_file = result.get("output_file")
             error = result.get("error")
-
+            if not error:
+                # 拆分组合的结果是 JSON 图表描述，追问时完整生成
+                base_code = None if result.get("plan") else (last_code or None)
+            if result.get("edit_applied"):
+                print("(增量修改，未重新生成整份代码)")
+            if result.get("plan"):
+                print(f"(拆分为 {len(result['plan']['parts'])} 张子图并发生成后组合)")
+
+            # 更新并压缩历史
+            messages = result.get("messages", [])
+            if result.get("context_sources"):
+                print(f"(参考资料: {', '.join(result['context_sources'])})")
+            usage = prompt_cache_usage(messages[len(history.messages) - 1:])
+            if usage["cache_read"]:
+                print(f"(提示缓存命中 {usage['cache_read']} / {usage['input']} 输入 tokens)")
+            saved = history.commit_turn(messages, success=not error)
+            if saved:
+                print(f"(历史已压缩，下次请求节省约 {saved} tokens)")
+
+            exports = result.get("exports")
             if output_file and not error:
                 print(f"\n生成成功!")
-                print(f"输出文件: {output_file}\n")
+                if result.get("preview") and result["preview"] != output_file:
+                    print(f"预览: {result['preview']}")
+                if exports and not exports.done():
+                    print(f"输出文件: {output_file}（后台导出中）\n")
+                    pending_exports.append(exports)
+                else:
+                    print(f"输出文件: {output_file}\n")
+                if exports:
+                    report_exports(exports)
             elif error:
                 print(f"\n执行失败: {error[:300]}")
                 print("请用 /last 查看代码，调整描述重试。\n")
@@ -187,7 +414,13 @@ def main():
                 print("\n完成（未检测到输出文件路径）\n")
 
         except Exception as e:
-            print(f"\n错误: {e}\n")
+            if is_retryable(e):
+                print(f"\n服务商限流或暂时不可用，退避重试后仍失败: {e}")
+                print("稍后重试，或在配置的 rate_limit 中调低 rpm / tpm。\n")
+            else:
+                print(f"\n错误: {e}\n")
+
+    wait_exports(pending_exports)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,295 @@
+"""运行指标 — 端到端延迟、分阶段追踪与 Prometheus 文本格式导出
+
+每个阶段（generate / execute / fix / extract_code / execute_code ...）记录为一个 span，
+追加写入 ~/.flowing/trace.jsonl，同一请求内的 span 共享 trace id。
+"""
+
+import asyncio
+import atexit
+import functools
+import http.server
+import json
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from config import CONFIG_DIR
+from history import is_fix_message
+
+TRACE_FILE = CONFIG_DIR / "trace.jsonl"
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """最近秩法百分位，q 取 0-100"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LatencyTracker:
+    """每种模式保留最近 window 个样本"""
+
+    def __init__(self, window: int = 1000):
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, mode: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[mode].append(seconds)
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            snapshot = {mode: list(s) for mode, s in self._samples.items()}
+        return {
+            mode: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+            }
+            for mode, values in snapshot.items()
+        }
+
+
+# 进程内共享的端到端延迟统计
+latency = LatencyTracker()
+
+
+# ========== 分阶段追踪 ==========
+
+# 当前所在的 span，子 span 由此继承 trace id
+_current_span: ContextVar[Optional[dict]] = ContextVar("flowing_span", default=None)
+
+
+def turn_stats(messages: Sequence[BaseMessage]) -> Tuple[int, int]:
+    """一次请求新增消息中的 (LLM 修复次数, 输入 + 输出 token 数)"""
+    retries = sum(is_fix_message(m) for m in messages)
+    tokens = 0
+    for m in messages:
+        meta = getattr(m, "usage_metadata", None) if isinstance(m, AIMessage) else None
+        if meta:
+            tokens += meta.get("input_tokens", 0) + meta.get("output_tokens", 0)
+    return retries, tokens
+
+
+class Tracer:
+    """span 式的分阶段计时
+
+    path 为 None 时只做内存统计，不写追踪文件；文件超过 max_bytes 时轮转为 .1。
+    span 由后台线程批量追加到文件，记录 span 的线程（服务线程、事件循环）不做文件 I/O；
+    读追踪文件前先 flush()。
+    """
+
+    def __init__(self, path=TRACE_FILE, window: int = 1000, max_bytes: int = 20 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stages = LatencyTracker(window)
+        self._retries: deque = deque(maxlen=window)
+        self._tokens: deque = deque(maxlen=window)
+        # 累计值（Prometheus 的 _count / _sum 要求单调递增，不能用窗口）
+        self._totals: Dict[str, list] = defaultdict(lambda: [0, 0.0, 0])
+        self._requests = [0, 0, 0]  # 请求数, 修复次数, token 数
+        self._lock = threading.Lock()
+        self._pending: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    @contextmanager
+    def span(self, stage: str, **attrs):
+        """计时一个阶段；可往 yield 出的 dict 里补充属性，设置 ok=False 表示失败"""
+        parent = _current_span.get()
+        span = {
+            "trace": parent["trace"] if parent else uuid.uuid4().hex[:16],
+            "span": uuid.uuid4().hex[:8],
+            "parent": parent["span"] if parent else None,
+            "stage": stage,
+            **attrs,
+        }
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield span
+        except BaseException as e:
+            failed = True
+            span["error"] = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            _current_span.reset(token)
+            duration = time.perf_counter() - start
+            span["ok"] = span.get("ok", True) and not failed
+            span["duration"] = round(duration, 4)
+            span["ts"] = round(time.time(), 3)
+            self._finish(stage, duration, span)
+
+    def _finish(self, stage: str, duration: float, span: dict) -> None:
+        self.stages.record(stage, duration)
+        with self._lock:
+            totals = self._totals[stage]
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] += 0 if span["ok"] else 1
+        self._write(span)
+
+    def _write(self, span: dict) -> None:
+        path = self.path
+        if not path:
+            return
+        line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._drain, name="flowing-trace",
+                                                daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+        self._pending.put((path, line))
+
+    def _drain(self) -> None:
+        """后台线程：取出当前积压的全部 span，按文件合并成一次写入"""
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for path in dict.fromkeys(p for p, _ in batch):
+                    self._append(path, "".join(line for p, line in batch if p == path))
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _append(self, path, text: str) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if path.exists() and path.stat().st_size > self.max_bytes:
+                path.replace(path.with_name(path.name + ".1"))
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(text)
+        except OSError:
+            pass
+
+    def flush(self) -> None:
+        """等待已记录的 span 全部写入文件"""
+        self._pending.join()
+
+    def record_request(self, retries: int, tokens: int) -> None:
+        with self._lock:
+            self._retries.append(retries)
+            self._tokens.append(tokens)
+            self._requests[0] += 1
+            self._requests[1] += retries
+            self._requests[2] += tokens
+
+    def summary(self) -> dict:
+        with self._lock:
+            retries, tokens = list(self._retries), list(self._tokens)
+        return {
+            "stages": self.stages.summary(),
+            "requests": {
+                "count": len(retries),
+                "retries_p50": percentile(retries, 50),
+                "retries_p95": percentile(retries, 95),
+                "retries_mean": sum(retries) / len(retries) if retries else 0.0,
+                "tokens_p50": percentile(tokens, 50),
+                "tokens_p95": percentile(tokens, 95),
+                "tokens_mean": sum(tokens) / len(tokens) if tokens else 0.0,
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        summary = self.summary()
+        with self._lock:
+            totals = {stage: list(t) for stage, t in self._totals.items()}
+            requests = list(self._requests)
+
+        lines = [
+            "# HELP flowing_stage_duration_seconds Duration of each pipeline stage.",
+            "# TYPE flowing_stage_duration_seconds summary",
+        ]
+        for stage, st in sorted(summary["stages"].items()):
+            count, total, _ = totals.get(stage, (0, 0.0, 0))
+            for q, key in (("0.5", "p50"), ("0.95", "p95")):
+                lines.append(f'flowing_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} {st[key]:.6f}')
+            lines.append(f'flowing_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'flowing_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+        lines += [
+            "# HELP flowing_stage_failures_total Stage executions that raised or reported failure.",
+            "# TYPE flowing_stage_failures_total counter",
+        ]
+        for stage, (_, _, errors) in sorted(totals.items()):
+            lines.append(f'flowing_stage_failures_total{{stage="{stage}"}} {errors}')
+
+        req = summary["requests"]
+        for name, key, total, help_text in (
+            ("flowing_request_retries", "retries", requests[1], "LLM fix rounds per request."),
+            ("flowing_request_tokens", "tokens", requests[2], "Input plus output tokens per request."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+            lines.append(f'{name}{{quantile="0.5"}} {req[key + "_p50"]}')
+            lines.append(f'{name}{{quantile="0.95"}} {req[key + "_p95"]}')
+            lines.append(f"{name}_sum {total}")
+            lines.append(f"{name}_count {requests[0]}")
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的追踪器
+tracer = Tracer()
+
+
+def traced(stage: str, annotate: Optional[Callable[[object], dict]] = None):
+    """把函数调用记录为一个 span；annotate 从返回值中提取要附加的属性"""
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(stage) as span:
+                    result = await fn(*args, **kwargs)
+                    if annotate:
+                        span.update(annotate(result))
+                    return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(stage) as span:
+                result = fn(*args, **kwargs)
+                if annotate:
+                    span.update(annotate(result))
+                return result
+        return wrapper
+    return wrap
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+    """在后台线程提供 GET /metrics，供 Prometheus 抓取"""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = tracer.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 静默日志
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
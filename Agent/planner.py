@@ -0,0 +1,264 @@
+"""大图拆分 — 把复杂请求拆成几张独立的子图并发生成、执行，再组合为一张图
+
+planner 先请 LLM 给出拆分方案（JSON）：子图列表、各子图对外的连接点（锚点），以及
+子图之间的连线。每张子图各自走一遍 生成 → 执行 → 修复 的流程并导出为 SVG，
+失败时只重试出错的那一张。全部成功后生成一份 JSON 图表描述：每张子图作为 image 元素，
+用 group 加标题，按 row / col / grid 排列，锚点之间画箭头，由 worker 导出最终结果。
+"""
+
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from executor import CODE_MODE, SPEC_MODE, extract_code, fence, parse_spec
+
+# 一次最多拆成几张子图
+MAX_PARTS = 6
+
+# 组合画布四周留给 group 标题与边框的空间
+COMPOSE_PADDING = 60
+
+LAYOUTS = ("row", "col", "grid")
+SIDES = ("top", "bottom", "left", "right")
+SIDE_NAMES = {"top": "上", "bottom": "下", "left": "左", "right": "右"}
+
+_NAME = re.compile(r"^[A-Za-z][\w-]{0,31}$")
+_SVG_SIZE = re.compile(r"<svg\b[^>]*?\bwidth=\"([\d.]+)\"[^>]*?\bheight=\"([\d.]+)\"")
+
+PLAN_PROMPT = """## 拆分方案
+
+这张图较大，先把它拆成 2～{max_parts} 张可以独立绘制的子图（如编码器 / 解码器、各个阶段），
+由系统分别生成后再组合。只输出一个 ```json 代码块，例如:
+
+{{
+  "layout": "row",
+  "gap": 80,
+  "export": "transformer.png",
+  "parts": [
+    {{"name": "encoder", "title": "Encoder", "prompt": "这张子图要画的内容，写清楚其中的元素",
+     "anchors": {{"out": {{"side": "right", "at": 50}}}}}},
+    {{"name": "decoder", "title": "Decoder", "prompt": "...",
+     "anchors": {{"memory": {{"side": "left", "at": 50}}}}}}
+  ],
+  "links": [{{"from": "encoder.out", "to": "decoder.memory", "label": "K, V"}}]
+}}
+
+- layout 为子图的排列: row（横排）| col（竖排）| grid（另给 cols 列数）；export 为最终导出的文件名
+- name 为英文标识符；anchors 是子图与其他子图相连的位置，side 为 top/bottom/left/right，
+  at 为沿该边的百分比 0-100；links 只能引用已声明的锚点
+- 如果这张图拆开后难以表达（各部分之间连线很多），输出 {{"parts": []}}"""
+
+PART_PROMPT = """这是一张大图中的一张子图，整张图的需求:
+{request}
+
+现在只画子图「{title}」: {prompt}
+
+- 只画这一部分，不要画其他子图，也不要画整张图的标题
+- 导出为 SVG，路径必须是 {path}，使用 fit: true
+{anchors}"""
+
+
+class PlanError(Exception):
+    """拆分方案不是合法的 JSON 或引用了不存在的子图 / 锚点"""
+
+
+@dataclass
+class Anchor:
+    side: str
+    at: float = 50
+
+
+@dataclass
+class Part:
+    name: str
+    title: str
+    prompt: str
+    anchors: Dict[str, Anchor] = field(default_factory=dict)
+
+
+@dataclass
+class Link:
+    source: str
+    source_anchor: str
+    target: str
+    target_anchor: str
+    label: str = ""
+
+
+@dataclass
+class Plan:
+    parts: List[Part]
+    links: List[Link] = field(default_factory=list)
+    layout: str = "row"
+    cols: int = 2
+    gap: float = 80
+    export: str = "diagram.png"
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Plan":
+        return cls(
+            parts=[Part(p["name"], p["title"], p["prompt"],
+                        {k: Anchor(**a) for k, a in p["anchors"].items()})
+                   for p in data["parts"]],
+            links=[Link(**l) for l in data["links"]],
+            layout=data["layout"], cols=data["cols"], gap=data["gap"], export=data["export"],
+        )
+
+
+def plan_request(max_parts: int = MAX_PARTS) -> str:
+    return PLAN_PROMPT.format(max_parts=max_parts)
+
+
+def _anchor(name: str, value) -> Anchor:
+    if isinstance(value, str):
+        value = {"side": value}
+    if not isinstance(value, dict) or value.get("side") not in SIDES:
+        raise PlanError(f"锚点 {name} 的 side 必须是 {'/'.join(SIDES)}")
+    try:
+        at = min(100.0, max(0.0, float(value.get("at", 50))))
+    except (TypeError, ValueError):
+        raise PlanError(f"锚点 {name} 的 at 必须是 0-100 的数字")
+    return Anchor(value["side"], at)
+
+
+def _endpoint(ref, parts: Dict[str, Part]) -> Tuple[str, str]:
+    name, _, anchor = str(ref).partition(".")
+    part = parts.get(name)
+    if part is None:
+        raise PlanError(f"连线引用了不存在的子图: {ref}")
+    if anchor not in part.anchors:
+        raise PlanError(f"连线引用了子图 {name} 未声明的锚点: {ref}")
+    return name, anchor
+
+
+def parse_plan(reply: str, max_parts: int = MAX_PARTS) -> Optional[Plan]:
+    """解析 LLM 给出的拆分方案；不需要拆分（少于 2 张子图）时返回 None，不合法时抛 PlanError"""
+    code = extract_code(reply, SPEC_MODE)
+    data = parse_spec(code) if code else None
+    if data is None:
+        raise PlanError("拆分方案不是合法的 JSON")
+    raw_parts = data.get("parts") or []
+    if not isinstance(raw_parts, list) or len(raw_parts) < 2:
+        return None
+    if len(raw_parts) > max_parts:
+        raise PlanError(f"子图过多（{len(raw_parts)} 张，最多 {max_parts} 张）")
+
+    parts: Dict[str, Part] = {}
+    for raw in raw_parts:
+        if not isinstance(raw, dict):
+            raise PlanError("parts 的每一项必须是对象")
+        name = str(raw.get("name") or "")
+        if not _NAME.match(name) or name in parts:
+            raise PlanError(f"子图名必须是不重复的英文标识符: {name!r}")
+        if not str(raw.get("prompt") or "").strip():
+            raise PlanError(f"子图 {name} 缺少 prompt")
+        anchors = raw.get("anchors") or {}
+        if not isinstance(anchors, dict):
+            raise PlanError(f"子图 {name} 的 anchors 必须是对象")
+        parts[name] = Part(name, str(raw.get("title") or name), str(raw["prompt"]),
+                           {str(k): _anchor(f"{name}.{k}", v) for k, v in anchors.items()})
+
+    links = []
+    for raw in data.get("links") or []:
+        if not isinstance(raw, dict):
+            raise PlanError("links 的每一项必须是对象")
+        source, source_anchor = _endpoint(raw.get("from"), parts)
+        target, target_anchor = _endpoint(raw.get("to"), parts)
+        links.append(Link(source, source_anchor, target, target_anchor,
+                          str(raw.get("label") or "")))
+
+    layout = data.get("layout") if data.get("layout") in LAYOUTS else "row"
+    try:
+        cols = max(1, int(data.get("cols") or 2))
+        gap = max(0.0, float(data.get("gap") or 80))
+    except (TypeError, ValueError):
+        raise PlanError("cols / gap 必须是数字")
+    export = os.path.basename(str(data.get("export") or "")) or "diagram.png"
+    return Plan(list(parts.values()), links, layout, cols, gap, export)
+
+
+# ========== 子图 ==========
+
+def part_path(parts_dir: str, part: Part) -> str:
+    return os.path.join(parts_dir, f"{part.name}.svg")
+
+
+def part_request(plan: Plan, part: Part, request: str, parts_dir: str) -> str:
+    """发给子图生成流程的用户消息"""
+    lines = [f"- 连接点「{name}」在{SIDE_NAMES[a.side]}边 {a.at:g}% 处：与之相连的元素贴近这个位置"
+             for name, a in part.anchors.items()]
+    return PART_PROMPT.format(request=request, title=part.title, prompt=part.prompt,
+                              path=part_path(parts_dir, part), anchors="\n".join(lines)).rstrip()
+
+
+def svg_size(svg: str) -> Optional[Tuple[float, float]]:
+    m = _SVG_SIZE.search(svg)
+    return (float(m.group(1)), float(m.group(2))) if m else None
+
+
+# ========== 组合 ==========
+
+def _canvas(plan: Plan, sizes: List[Tuple[float, float]]) -> Tuple[float, float]:
+    """能放下所有子图的画布尺寸；最终导出时 fit 裁掉多余的空白"""
+    gap = plan.gap
+    if plan.layout == "row":
+        w = sum(s[0] for s in sizes) + gap * (len(sizes) - 1)
+        h = max(s[1] for s in sizes)
+    elif plan.layout == "col":
+        w = max(s[0] for s in sizes)
+        h = sum(s[1] for s in sizes) + gap * (len(sizes) - 1)
+    else:
+        # 与 fig.grid 一致：每列取该列最宽的子图，每行取该行最高的
+        cols = min(plan.cols, len(sizes))
+        rows = [sizes[i:i + cols] for i in range(0, len(sizes), cols)]
+        w = sum(max(s[0] for s in sizes[c::cols]) for c in range(cols)) + gap * (cols - 1)
+        h = sum(max(s[1] for s in row) for row in rows) + gap * (len(rows) - 1)
+    return round(w + 2 * COMPOSE_PADDING), round(h + 2 * COMPOSE_PADDING)
+
+
+def compose_spec(plan: Plan, files: Dict[str, Tuple[str, Tuple[float, float]]],
+                 export_path: str) -> dict:
+    """由各子图的 (SVG 路径, 尺寸) 生成组合用的 JSON 图表描述"""
+    names = [p.name for p in plan.parts]
+    width, height = _canvas(plan, [files[n][1] for n in names])
+    layout = {"type": plan.layout, "elements": names, "gap": plan.gap}
+    if plan.layout == "grid":
+        layout["cols"] = plan.cols
+    anchors = {p.name: p.anchors for p in plan.parts}
+    arrows = []
+    for link in plan.links:
+        src = anchors[link.source][link.source_anchor]
+        dst = anchors[link.target][link.target_anchor]
+        arrow = {"from": link.source, "to": link.target,
+                 "fromSide": src.side, "fromAt": src.at, "toSide": dst.side, "toAt": dst.at}
+        if link.label:
+            arrow["label"] = link.label
+        arrows.append(arrow)
+    return {
+        "width": width,
+        "height": height,
+        "elements": [{"id": n, "type": "image", "src": files[n][0],
+                      "size": [round(files[n][1][0], 2), round(files[n][1][1], 2)]}
+                     for n in names],
+        "layouts": [layout],
+        "arrows": arrows,
+        "groups": [{"members": [p.name], "label": p.title, "padding": 12}
+                   for p in plan.parts],
+        "export": {"path": export_path, "fit": True, "margin": 20},
+    }
+
+
+def summary_reply(plan: Plan, codes: Dict[str, str], mode: str = CODE_MODE) -> str:
+    """本轮的 AI 回复：各子图最终的代码，供之后的追问参考"""
+    blocks = [f"### {p.title}（{p.name}）\n{fence(codes[p.name], mode)}" for p in plan.parts]
+    return (f"已拆分为 {len(plan.parts)} 张子图分别生成，按 {plan.layout} 排列组合为一张图。\n\n"
+            + "\n\n".join(blocks))
+
+
+def dump_spec(spec: dict) -> str:
+    return json.dumps(spec, ensure_ascii=False, indent=2)
@@ -1,27 +1,46 @@
-"""System prompt 构建 — 包含完整 flowing API 参考"""
+"""System prompt 构建 — 包含完整 flowing API 参考
+
+prompt 分为两段：
+  STATIC_PROMPT  规则 + API 参考 + 模板，与路径无关，整段可被服务商缓存
+  运行环境        FLOWING_ROOT 与输出目录，放在缓存前缀之后
+
+compact=True 时静态段改用 COMPACT_PROMPT（去掉 REFERENCE_SECTIONS），
+这些内容连同指南与示例由 retrieval 按请求检索，附在用户消息之后，静态段仍可缓存。
+mode="spec" 时静态段改用 SPEC_PROMPT：模型输出 JSON 图表描述而不是 TypeScript 脚本。
+"""
 
 import os
+from typing import Optional, Sequence
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from executor import CODE_MODE, SPEC_MODE
 
 FLOWING_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# 支持显式 cache_control 标记的服务商（Anthropic、DashScope 兼容模式）；
+# 其余 OpenAI 兼容服务只要前缀稳定即可命中自动前缀缓存
+CACHE_CONTROL_PROVIDERS = ("claude", "tongyi")
 
-def build_system_prompt(output_dir: str) -> str:
-    return f"""你是 Flowing 图表生成助手。用户用自然语言描述想要的图表，你生成 TypeScript 代码并使用 flowing 库输出 SVG/PNG。
+# 规则、方法签名与代码模板：精简模式下 system prompt 只含这些
+_CORE = [
+    """你是 Flowing 图表生成助手。用户用自然语言描述想要的图表，你生成 TypeScript 代码并使用 flowing 库输出 SVG/PNG。
 
 ## 重要规则
 
 1. 只输出一个完整的 TypeScript 代码块，用 ```typescript 包裹
-2. import 路径必须使用: import {{ Figure }} from '{FLOWING_ROOT}/src'
-3. 必须调用 fig.export() 输出文件到: {output_dir}/
+2. import 路径必须使用: import { Figure } from '<FLOWING_ROOT>/src'
+3. 必须调用 fig.export() 输出文件到: <OUTPUT_DIR>/
 4. 文件名用英文，格式为 output_<描述>.png
 5. 代码末尾调用 main() 函数
 6. 不要输出任何代码以外的解释文字
+7. <FLOWING_ROOT> 和 <OUTPUT_DIR> 的实际值见末尾「运行环境」，代码中必须替换为实际路径
 
 ## Flowing API 参考
 
 ### 构造器
 new Figure(width?: number, height?: number, options?)
-  options: {{ bg?: string, fontFamily?: string, autoAlign?: boolean }}
+  options: { bg?: string, fontFamily?: string, autoAlign?: boolean }
 
 ### 元素创建（返回 Element，可作为箭头端点）
 fig.rect(label, config?)        矩形（最常用，可作容器）
@@ -40,7 +59,7 @@ pos: [x, y]           位置（像素或百分比如'50%'）
 size: [width, height]  尺寸
 fill: string           填充色，'none' 透明
 color: string          主题色（同时设置 stroke 和 fontColor）
-stroke: string | {{ color, width, dash }}   边框
+stroke: string | { color, width, dash }   边框
 radius: number         圆角（Rect）
 r: number              半径（Circle/Sphere，默认 30）
 fontSize: number       字体大小
@@ -53,56 +72,201 @@ topRatio: number       梯形上下宽度比 (0-1)
 count: number          叠层数（Stack，默认 3）
 stackOffset: [dx, dy]  叠层偏移（默认 [6,-6]）
 
-### 连接
+""",
+    """### 连接
 fig.arrow(source, target, config?)
 fig.arrows(source, [t1,t2,t3], config?)   扇出 1→N
 fig.arrows([s1,s2,s3], target, config?)   扇入 N→1
 
-ArrowConfig:
-  from/to: 'top'|'bottom'|'left'|'right'   锚点
-  label: string     标签
-  style: 'solid'|'dashed'|'dotted'
-  color: string
-  head: 'triangle'|'stealth'|'vee'|'circle'|'diamond'|'bar'|'none'  等
-  path: 'straight'|'curve'|'polyline'
-  curve: number     弯曲程度（正=上弯，负=下弯）
-  bidirectional: boolean   双向箭头
-
-### 布局
-fig.row([a,b,c], {{ gap: 40 }})     水平排列
-fig.col([a,b,c], {{ gap: 40 }})     垂直排列
-fig.grid([a,b,c,d], {{ cols: 2 }})  网格排列
-fig.group([a,b], {{ label, stroke, padding }})  分组框
-
-### 文字 Markdown
-**bold**  *italic*  `code`  $formula$
+""",
+    """### 布局
+fig.row([a,b,c], { gap: 40 })     水平排列
+fig.col([a,b,c], { gap: 40 })     垂直排列
+fig.grid([a,b,c,d], { cols: 2 })  网格排列
+fig.group([a,b], { label, stroke, padding })  分组框
 
-### 导出
-fig.export('path.png', {{ fit: true, margin: 20, scale: 2 }})
-fig.export('path.svg', {{ fit: true, margin: 20 }})
+""",
+    """### 导出
+fig.export('path.png', { fit: true, margin: 20, scale: 2 })
+fig.export('path.svg', { fit: true, margin: 20 })
 
 ## 代码模板
 
 ```typescript
-import {{ Figure }} from '{FLOWING_ROOT}/src'
+import { Figure } from '<FLOWING_ROOT>/src'
 
-async function main() {{
-  const fig = new Figure(800, 400, {{ bg: '#ffffff' }})
+async function main() {
+  const fig = new Figure(800, 400, { bg: '#ffffff' })
 
   // ... 创建元素 ...
   // ... 连接箭头 ...
 
-  await fig.export('{output_dir}/output.png', {{ fit: true, margin: 20, scale: 2 }})
-}}
+  await fig.export('<OUTPUT_DIR>/output.png', { fit: true, margin: 20, scale: 2 })
+}
 
 main()
 ```
 
-## 配色建议
+""",
+]
+
+# 箭头参数、Markdown 与配色：完整模式下按原位置插入，精简模式下交给 retrieval 按需检索
+REFERENCE_SECTIONS = [
+    ("ArrowConfig 箭头参数", """ArrowConfig:
+  from/to: 'top'|'bottom'|'left'|'right'   锚点
+  label: string     标签
+  style: 'solid'|'dashed'|'dotted'
+  color: string
+  head: 'triangle'|'stealth'|'vee'|'circle'|'diamond'|'bar'|'none'  等
+  path: 'straight'|'curve'|'polyline'
+  curve: number     弯曲程度（正=上弯，负=下弯）
+  bidirectional: boolean   双向箭头
+
+"""),
+    ("文字 Markdown", """### 文字 Markdown
+**bold**  *italic*  `code`  $formula$
+
+"""),
+    ("配色建议", """## 配色建议
 蓝色系: fill='#e3f2fd' color='#1565c0'   (输入/编码)
 绿色系: fill='#e8f5e9' color='#2e7d32'   (处理/注意力)
 橙色系: fill='#fff3e0' color='#e65100'   (输出/解码)
 红色系: fill='#fce4ec' color='#c62828'   (损失/错误)
 紫色系: fill='#f3e5f5' color='#7b1fa2'   (特殊/嵌入)
 灰色系: fill='#f5f5f5' color='#333'      (通用)
+"""),
+]
+
+# 完整 prompt：每张参数表紧跟在对应的 API 小节之后
+STATIC_PROMPT = _CORE[0] + "".join(
+    core + text for core, (_, text) in zip(_CORE[1:], REFERENCE_SECTIONS))
+
+COMPACT_PROMPT = "".join(_CORE) + """## 参考资料
+箭头参数、配色和相近的示例代码按本次请求检索后附在用户消息末尾。
+"""
+
+# spec 模式：字段与 src/spec.ts 的 DiagramSchema 对应，由 worker 直接解释
+SPEC_PROMPT = """你是 Flowing 图表生成助手。用户用自然语言描述想要的图表，你输出一份 JSON 图表描述，由 flowing 渲染器直接生成 SVG/PNG。
+
+## 重要规则
+
+1. 只输出一个 JSON 代码块，用 ```json 包裹，不要写 TypeScript 代码
+2. 元素用唯一的 id 标识，箭头、分组、布局都通过 id 引用元素
+3. export.path 必须在 <OUTPUT_DIR>/ 下，文件名用英文，格式为 output_<描述>.png
+4. 不要输出任何 JSON 以外的解释文字，JSON 中不能有注释
+5. <OUTPUT_DIR> 的实际值见末尾「运行环境」
+6. 附带的参考资料若是 TypeScript 示例，按同名字段改写成 JSON：fig.rect(label, config) 即 {"type": "rect", "label": ..., ...config}
+
+## 图表描述格式
+
+### 顶层字段
+width, height     画布尺寸（默认 800×400）
+bg                背景色
+fontFamily        默认字体
+autoAlign         同一行的元素自动对齐（默认 true）
+elements          元素
+layouts           布局（在创建箭头之前应用）
+arrows            箭头
+fanArrows         扇出 / 扇入箭头
+forks             共享主干的分叉箭头
+groups            分组框
+export            导出: { path, fit, margin, scale, quality }
+
+### 元素 elements[]
+{ "id": "a", "type": "rect", "label": "文字", ...ElementConfig }
+type: rect | circle | text | image | diamond | trapezoid | cylinder | cuboid | sphere | stack
+image 用 src 指定图片路径
+
+ElementConfig:
+pos: [x, y]  size: [w, h]  fill  fillOpacity  color  stroke: "#333" | { color, width, dash }
+radius  r  fontSize  fontFamily  fontColor  fontWeight  bold  opacity  shadow  padding
+depth  count  stackOffset: [dx, dy]  topRatio
+
+### 箭头
+arrows[]      { "from": "a", "to": "b", ...箭头参数 }
+fanArrows[]   { "from": "a", "to": ["b", "c"] }   from / to 都可以是 id 或 id 数组（1→N、N→1）
+forks[]       { "from": "a", "to": ["b", "c"] }   一个源经共享主干分到多个目标
+
+箭头参数:
+  fromSide / toSide: 'top'|'bottom'|'left'|'right'   fromAt / toAt: 0-100（沿边百分比）
+  label  style: 'solid'|'dashed'|'dotted'  color  width  headSize  bidirectional
+  head: 'triangle'|'stealth'|'vee'|'circle'|'diamond'|'bar'|'none'  等
+  path: 'straight'|'curve'|'polyline'  curve（正=上弯，负=下弯）  cornerRadius  labelOffset
+
+### 布局与分组
+layouts[]   { "type": "row" | "col" | "grid", "elements": ["a", "b"], "gap": 40, "cols": 2 }
+groups[]    { "members": ["a", "b"], "label": "...", "stroke": "#999", "padding": 20 }
+
+### 文字 Markdown
+label 中可用 **bold**  *italic*  `code`  $formula$
+
+## 模板
+
+```json
+{
+  "width": 800, "height": 400, "bg": "#ffffff",
+  "elements": [
+    { "id": "input", "type": "rect", "label": "Input", "size": [120, 60], "fill": "#e3f2fd", "color": "#1565c0", "radius": 6 },
+    { "id": "model", "type": "rect", "label": "Model", "size": [120, 60], "fill": "#e8f5e9", "color": "#2e7d32", "radius": 6 }
+  ],
+  "layouts": [{ "type": "row", "elements": ["input", "model"], "gap": 80 }],
+  "arrows": [{ "from": "input", "to": "model", "label": "data" }],
+  "export": { "path": "<OUTPUT_DIR>/output.png", "fit": true, "margin": 20, "scale": 2 }
+}
+```
+
+""" + REFERENCE_SECTIONS[2][1]
+
+
+def build_environment(output_dir: str, mode: str = CODE_MODE) -> str:
+    """prompt 的可变部分"""
+    if mode == SPEC_MODE:
+        return f"""## 运行环境
+
+OUTPUT_DIR = {output_dir}
+"""
+    return f"""## 运行环境
+
+FLOWING_ROOT = {FLOWING_ROOT}
+OUTPUT_DIR = {output_dir}
+import 语句: import {{ Figure }} from '{FLOWING_ROOT}/src'
 """
+
+
+def _static_prompt(compact: bool, mode: str) -> str:
+    if mode == SPEC_MODE:
+        return SPEC_PROMPT
+    return COMPACT_PROMPT if compact else STATIC_PROMPT
+
+
+def build_system_prompt(output_dir: str, compact: bool = False, mode: str = CODE_MODE) -> str:
+    return _static_prompt(compact, mode) + "\n" + build_environment(output_dir, mode)
+
+
+def build_system_message(output_dir: str, provider: Optional[str] = None,
+                         compact: bool = False, mode: str = CODE_MODE) -> SystemMessage:
+    """构建 system 消息；支持的服务商把静态前缀标记为可缓存
+
+    spec 模式的 prompt 本身已经很短，不区分 compact。
+    """
+    if provider not in CACHE_CONTROL_PROVIDERS:
+        return SystemMessage(content=build_system_prompt(output_dir, compact, mode))
+    return SystemMessage(content=[
+        {"type": "text", "text": _static_prompt(compact, mode),
+         "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": build_environment(output_dir, mode)},
+    ])
+
+
+def prompt_cache_usage(messages: Sequence[BaseMessage]) -> dict:
+    """汇总 AI 回复里的输入 token 与缓存命中 / 写入 token 数"""
+    usage = {"input": 0, "cache_read": 0, "cache_creation": 0}
+    for msg in messages:
+        meta = getattr(msg, "usage_metadata", None)
+        if not meta:
+            continue
+        usage["input"] += meta.get("input_tokens", 0)
+        details = meta.get("input_token_details") or {}
+        usage["cache_read"] += details.get("cache_read", 0) or 0
+        usage["cache_creation"] += details.get("cache_creation", 0) or 0
+    return usage
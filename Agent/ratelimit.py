@@ -0,0 +1,308 @@
+"""LLM 限流 — 按服务商 + 模型共享的令牌桶，429 / 5xx 按带抖动的指数退避重试
+
+同一进程内的所有调用（REPL、batch 的并发会话、HTTP 服务的各执行线程）对同一
+服务商 / 模型共用一个 RateLimiter：每分钟请求数（rpm）与 token 数（tpm）各一个令牌桶，
+请求前按估算的输入 token 预留，返回后按 usage_metadata 的实际用量补差。
+任一调用收到 429 时整组暂停一段时间，其余会话排在暂停之后，而不是继续撞限流。
+
+这里的重试只针对限流与瞬时错误，与 agent.fix_budget（代码执行失败后请 LLM 修复的次数）分开计算。
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from history import message_tokens
+from routing import is_retryable
+
+
+def is_throttled(error: BaseException) -> bool:
+    """429 / RateLimitError：整组暂停；其余可重试错误只退避当前调用"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """服务商在 Retry-After 响应头里给出的等待秒数"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0,
+                  error: Optional[BaseException] = None) -> float:
+    """第 attempt 次重试前的等待：有 Retry-After 时以它为准，否则 base·2^attempt 取一半加随机抖动"""
+    hinted = retry_after(error) if error is not None else None
+    if hinted is not None:
+        return min(cap, hinted) + random.uniform(0, base)
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class TokenBucket:
+    """每分钟补充 per_minute 个令牌的令牌桶；per_minute 为 0 时不限
+
+    容量只有 burst 秒的配额：服务商通常按秒级窗口执行每分钟限额，
+    攒满一分钟再一次发出同样会被 429。
+    reserve() 立即扣除并返回需要等待的秒数，余额可以为负，
+    后来的调用按到达顺序排在前面的欠额之后，不会互相抢占，超过容量的大请求也只是等得更久。
+    """
+
+    def __init__(self, per_minute: float, burst: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst)
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, delta: float) -> None:
+        """按实际用量补差：delta 为正表示比预留的多用了"""
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - delta)
+
+    def hold(self, seconds: float) -> None:
+        """清空余额并把之后的预留整体推迟 seconds 秒，暂停结束后仍按速率逐个放行"""
+        if not self.rate:
+            return
+        with self._lock:
+            self._refill()
+            self.level = min(self.level, 0.0) - self.rate * seconds
+
+
+class RateLimiter:
+    """一个服务商 / 模型的请求与 token 限额，以及 429 后的整组暂停"""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, burst: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst
+        self.requests = TokenBucket(rpm, burst, clock)
+        self.tokens = TokenBucket(tpm, burst, clock)
+        self._clock = clock
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waited = 0.0
+        self.throttled = 0
+        self.retries = 0
+
+    def reserve(self, tokens: int) -> float:
+        """预留一次请求与 tokens 个 token，返回调用前应等待的秒数"""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        with self._lock:
+            wait = max(wait, self._paused_until - self._clock())
+            self.calls += 1
+            self.waited += wait
+        return wait
+
+    def settle(self, estimate: int, actual: Optional[int]) -> None:
+        if actual is not None:
+            self.tokens.adjust(actual - estimate)
+
+    def pause(self, seconds: float) -> None:
+        """收到 429：之后的预留都排到暂停结束之后；并发的多个 429 只按超出已有暂停的部分推迟"""
+        with self._lock:
+            now = self._clock()
+            extra = now + seconds - max(self._paused_until, now)
+            if extra > 0:
+                self._paused_until = now + seconds
+                self.requests.hold(extra)
+            self.throttled += 1
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "calls": self.calls,
+                "waited_s": round(self.waited, 2),
+                "throttled": self.throttled,
+                "retries": self.retries,
+            }
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_lock = threading.Lock()
+
+
+def get_limiter(provider: str, model: str, rpm: float = 0, tpm: float = 0,
+                burst: float = 1.0) -> RateLimiter:
+    """进程内同一服务商 / 模型共用一个 RateLimiter；限额变化（/setup 之后）时重建"""
+    key = (provider, model)
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None or (limiter.rpm, limiter.tpm, limiter.burst) != (rpm, tpm, burst):
+            limiter = _limiters[key] = RateLimiter(rpm, tpm, burst)
+        return limiter
+
+
+def limits_for(settings: dict, provider: str, model: str) -> dict:
+    """rate_limit 配置中该服务商的限额：providers 下 "<provider>/<model>" 优先于 "<provider>" """
+    overrides = settings.get("providers") or {}
+    return {**settings, **(overrides.get(provider) or {}),
+            **(overrides.get(f"{provider}/{model}") or {})}
+
+
+def summary() -> dict:
+    with _lock:
+        items = list(_limiters.items())
+    return {f"{provider}/{model}": limiter.summary() for (provider, model), limiter in items}
+
+
+def _usage(reply) -> Optional[int]:
+    meta = getattr(reply, "usage_metadata", None)
+    return meta.get("total_tokens") if meta else None
+
+
+class RateLimitedLLM:
+    """给单个聊天模型加上共享限流与退避重试，对 graph 提供 invoke / ainvoke / stream / astream / bind
+
+    max_retries 为限流与瞬时错误的重试次数；由 HedgedLLM 负责切换服务商时设为 0，
+    出错后直接交给路由器，但 429 仍会暂停整组。其余属性转发给底层模型。
+    """
+
+    def __init__(self, llm, limiter: RateLimiter, max_retries: int = 4,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0):
+        self.llm = llm
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def bind(self, **kwargs) -> "RateLimitedLLM":
+        return RateLimitedLLM(self.llm.bind(**kwargs), self.limiter, self.max_retries,
+                              self.backoff_base, self.backoff_max)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """可以重试时返回本调用还需自行等待的秒数，否则重新抛出"""
+        if not is_retryable(error):
+            raise error
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_max, error)
+        if is_throttled(error):
+            # 暂停整组；不再重试（交给 HedgedLLM）时同样暂停，其下一轮在 reserve 时一并等待
+            self.limiter.pause(delay)
+        if attempt >= self.max_retries:
+            raise error
+        self.limiter.record_retry()
+        return 0.0 if is_throttled(error) else delay
+
+    # ---------- 非流式 ----------
+
+    def _call(self, fn, estimate: int):
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.limiter.reserve(estimate))
+            try:
+                reply = fn()
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt))
+                continue
+            return reply
+
+    async def _acall(self, fn, estimate: int):
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.limiter.reserve(estimate))
+            try:
+                reply = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                continue
+            return reply
+
+    def invoke(self, messages: Sequence, **kwargs):
+        estimate = message_tokens(messages)
+        reply = self._call(lambda: self.llm.invoke(messages, **kwargs), estimate)
+        self.limiter.settle(estimate, _usage(reply))
+        return reply
+
+    async def ainvoke(self, messages: Sequence, **kwargs):
+        estimate = message_tokens(messages)
+        reply = await self._acall(lambda: self.llm.ainvoke(messages, **kwargs), estimate)
+        self.limiter.settle(estimate, _usage(reply))
+        return reply
+
+    def generate(self, batches: Sequence[Sequence], **kwargs):
+        estimate = sum(message_tokens(m) for m in batches)
+        return self._call(lambda: self.llm.generate(batches, **kwargs), estimate)
+
+    async def agenerate(self, batches: Sequence[Sequence], **kwargs):
+        estimate = sum(message_tokens(m) for m in batches)
+        return await self._acall(lambda: self.llm.agenerate(batches, **kwargs), estimate)
+
+    # ---------- 流式：只在收到首个 chunk 之前重试 ----------
+
+    def stream(self, messages: Sequence, **kwargs):
+        estimate = message_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.limiter.reserve(estimate))
+            merged = None
+            chunks = self.llm.stream(messages, **kwargs)
+            try:
+                for chunk in chunks:
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+            except Exception as e:
+                # 已经输出了部分内容，不能再重试
+                if merged is not None:
+                    raise
+                time.sleep(self._retry_delay(e, attempt))
+                continue
+            finally:
+                chunks.close()
+                if merged is not None:
+                    self.limiter.settle(estimate, _usage(merged))
+            return
+
+    async def astream(self, messages: Sequence, **kwargs):
+        estimate = message_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.limiter.reserve(estimate))
+            merged = None
+            chunks = self.llm.astream(messages, **kwargs)
+            try:
+                async for chunk in chunks:
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+            except Exception as e:
+                if merged is not None:
+                    raise
+                await asyncio.sleep(self._retry_delay(e, attempt))
+                continue
+            finally:
+                await chunks.aclose()
+                if merged is not None:
+                    self.limiter.settle(estimate, _usage(merged))
+            return
@@ -0,0 +1,280 @@
+/**
+ * 常驻渲染 worker — 由 Agent/worker_pool.py 启动，复用已加载的 figcraft 与 sharp
+ *
+ * 协议（stdin / stdout，每行一个 JSON）:
+ *   启动完成  ← @@flowing@@{"ready":true}
+ *   提交任务  → {"id":1,"file":"/tmp/flowing_agent_xxx.ts","capture":false}
+ *   任务结果  ← @@flowing@@{"id":1,"ok":true,"stdout":"...","error":null,"artifacts":[]}
+ *
+ * formats（可选，如 ["webp","pdf"]）：每次 fig.export() 额外按这些格式导出同名文件，
+ * 一次执行得到多种格式，全部由同一份 SVG 编码，不重复渲染。
+ *
+ * preview 为 true（且不 capture）时渐进导出：fig.export() 渲染出 SVG 后立即写出预览
+ * （目标本身是 .svg 时即为目标文件，否则为同名 .svg），光栅 / PDF 的编码留到脚本跑完之后。
+ * 任务结果在预览写出后就返回，带 "preview" 与 "background":true；后台编码完成时再发一行
+ *   后台导出  ← @@flowing@@{"id":1,"done":true,"ok":true,"files":["out.png","out.pdf"],"error":null}
+ * 在此之前 worker 不接下一个任务。
+ *
+ * file 以 .json 结尾时为图表描述（spec 模式）：按 src/spec.ts 的 schema 校验后直接解释执行，
+ * 不经过 tsx 转译与模块加载。
+ *
+ * capture 为 true 时 fig.export() 不写文件，导出内容以 base64 放在
+ * artifacts: [{"path","format","data"}] 中经管道返回，由调用方决定是否落盘。
+ *
+ * 单次模式: npx tsx render_worker.ts --once <file|spec.json> [--capture] [--formats webp,pdf]，
+ * 输出一行任务结果后退出。
+ *
+ * 脚本里的 console 输出会被捕获到结果中，不会混入协议行。
+ */
+import * as fs from 'fs'
+import * as path from 'path'
+import * as readline from 'readline'
+import { Figure, encodeSvg } from '../src'
+import type { ExportOptions } from '../src'
+import { buildDiagram, parseSpec } from '../src/spec'
+
+const MARK = '@@flowing@@'
+const writeOut = process.stdout.write.bind(process.stdout)
+
+function send(msg: object): void {
+  writeOut(MARK + JSON.stringify(msg) + '\n')
+}
+
+// 预热 sharp（光栅导出用），失败时留给具体任务报错
+import('sharp').catch(() => undefined)
+
+// ========== 任务跟踪 ==========
+
+interface Artifact {
+  path: string
+  format: string
+  data: string
+}
+
+/** 当前任务中尚未完成的 export 调用 */
+let pending: Promise<unknown>[] = []
+/** 当前任务中未捕获的异步错误 */
+let asyncErrors: unknown[] = []
+/** 当前任务是否把导出内容留在内存中 */
+let capturing = false
+/** capture 模式下收集的导出内容 */
+let artifacts: Artifact[] = []
+/** 每次导出额外输出的格式 */
+let extraFormats: string[] = []
+/** 当前任务是否渐进导出（先 SVG 预览，其余格式留到后台） */
+let previewing = false
+/** 当前任务写出的 SVG 预览 */
+let previews: string[] = []
+/** 渐进导出时推迟到任务结果之后的编码 */
+let deferred: (() => Promise<string>)[] = []
+
+function withFormat(filePath: string, format: string): string {
+  const ext = path.extname(filePath)
+  return filePath.slice(0, filePath.length - ext.length) + '.' + format.replace(/^\./, '').toLowerCase()
+}
+
+/** 编码并写出（或 capture）一个导出目标，返回其路径 */
+async function emit(svg: string, target: string, options?: ExportOptions, log = true): Promise<string> {
+  const buf = await encodeSvg(svg, path.extname(target), options)
+  if (capturing) {
+    const format = path.extname(target).slice(1).toLowerCase()
+    artifacts.push({ path: target, format, data: buf.toString('base64') })
+  } else {
+    fs.writeFileSync(target, buf)
+  }
+  if (log) console.log(`Exported → ${target}`)
+  return target
+}
+
+async function exportFigure(fig: Figure, filePath: string, options?: ExportOptions): Promise<void> {
+  // 只渲染一次，所有格式共用这份 SVG
+  const svg = fig.render(options)
+  const targets = [...new Set([filePath, ...extraFormats.map(f => withFormat(filePath, f))])]
+  if (!previewing) {
+    await Promise.all(targets.map(t => emit(svg, t, options)))
+    return
+  }
+  const preview = path.extname(filePath).toLowerCase() === '.svg' ? filePath : withFormat(filePath, 'svg')
+  await emit(svg, preview, options)
+  previews.push(preview)
+  for (const t of targets) {
+    if (t !== preview) deferred.push(() => emit(svg, t, options, false))
+  }
+}
+
+Figure.prototype.export = function (this: Figure, ...args: Parameters<Figure['export']>) {
+  const [filePath, options] = args
+  const p = exportFigure(this, filePath, options)
+  pending.push(p.catch(err => { asyncErrors.push(err) }))
+  return p
+}
+
+process.on('unhandledRejection', err => { asyncErrors.push(err) })
+process.on('uncaughtException', err => { asyncErrors.push(err) })
+
+class ExitSignal extends Error {
+  constructor(public code: number) {
+    super(`process.exit(${code})`)
+  }
+}
+
+/** 事件循环中按类型计数的活跃资源（定时器、文件 / 网络请求、子进程等，不含 unref 的） */
+function activeResources(): Map<string, number> {
+  const counts = new Map<string, number>()
+  for (const type of process.getActiveResourcesInfo()) counts.set(type, (counts.get(type) ?? 0) + 1)
+  return counts
+}
+
+function busierThan(baseline: Map<string, number>): boolean {
+  for (const [type, n] of activeResources()) {
+    if (n > (baseline.get(type) ?? 0)) return true
+  }
+  return false
+}
+
+/**
+ * 等待脚本的异步 main() 跑完：没有未完成的 export，且脚本开启的定时器 / I/O 都已结束
+ * （活跃资源回到任务开始时的水平），即单次执行时进程会退出的时刻。
+ * 只看一轮 setImmediate 会把 await 定时器或 I/O 之后的导出算到下一个任务上；
+ * 脚本留下不会结束的 setInterval / 连接时任务一直不结束，由 Python 侧超时回收 worker。
+ */
+async function settle(baseline: Map<string, number>): Promise<void> {
+  for (;;) {
+    const batch = pending
+    pending = []
+    if (batch.length > 0) {
+      await Promise.all(batch)
+      continue
+    }
+    await new Promise(resolve => setImmediate(resolve))
+    if (pending.length > 0) continue
+    if (!busierThan(baseline)) return
+    await new Promise(resolve => setTimeout(resolve, 5))
+  }
+}
+
+function formatError(err: unknown): string {
+  if (err instanceof Error) return err.stack || err.message
+  return String(err)
+}
+
+interface JobResult {
+  ok: boolean
+  stdout: string
+  error: string | null
+  artifacts: Artifact[]
+  preview?: string | null
+  background?: boolean
+}
+
+interface JobOptions {
+  capture?: boolean
+  formats?: string[]
+  preview?: boolean
+}
+
+async function runJob(file: string, opts: JobOptions = {}): Promise<JobResult> {
+  const out: string[] = []
+  const errs: string[] = []
+  const saved = {
+    log: console.log, info: console.info, warn: console.warn, error: console.error,
+    exit: process.exit,
+  }
+  const collect = (buf: string[]) => (...args: unknown[]) => {
+    buf.push(args.map(a => (typeof a === 'string' ? a : JSON.stringify(a))).join(' '))
+  }
+  console.log = console.info = collect(out)
+  console.warn = console.error = collect(errs)
+  process.exit = ((code?: number) => { throw new ExitSignal(code ?? 0) }) as typeof process.exit
+  pending = []
+  asyncErrors = []
+  capturing = !!opts.capture
+  artifacts = []
+  extraFormats = opts.formats || []
+  previewing = !!opts.preview && !capturing
+  previews = []
+  deferred = []
+
+  let failure: unknown = null
+  const baseline = activeResources()
+  try {
+    if (file.endsWith('.json')) {
+      await buildDiagram(parseSpec(JSON.parse(fs.readFileSync(file, 'utf-8'))))
+    } else {
+      delete require.cache[require.resolve(file)]
+      require(file)
+    }
+    await settle(baseline)
+  } catch (err) {
+    if (!(err instanceof ExitSignal && err.code === 0)) failure = err
+  } finally {
+    console.log = saved.log
+    console.info = saved.info
+    console.warn = saved.warn
+    console.error = saved.error
+    process.exit = saved.exit
+    capturing = false
+    delete require.cache[file]
+  }
+
+  const realErrors = asyncErrors.filter(e => !(e instanceof ExitSignal && e.code === 0))
+  if (!failure && realErrors.length > 0) failure = realErrors[0]
+  const stderr = errs.join('\n')
+  if (failure) {
+    const msg = formatError(failure)
+    deferred = []
+    return { ok: false, stdout: out.join('\n'), error: stderr ? `${stderr}\n${msg}` : msg, artifacts: [] }
+  }
+  if (!previewing) return { ok: true, stdout: out.join('\n'), error: null, artifacts }
+  return {
+    ok: true, stdout: out.join('\n'), error: null, artifacts,
+    preview: previews[previews.length - 1] ?? null, background: deferred.length > 0,
+  }
+}
+
+/** 渐进导出的后台阶段：并发编码推迟的各个格式 */
+async function runDeferred(): Promise<{ ok: boolean; files: string[]; error: string | null }> {
+  const jobs = deferred
+  deferred = []
+  const results = await Promise.allSettled(jobs.map(job => job()))
+  const files = results.flatMap(r => (r.status === 'fulfilled' ? [r.value] : []))
+  const failed = results.flatMap(r => (r.status === 'rejected' ? [formatError(r.reason)] : []))
+  return { ok: failed.length === 0, files, error: failed.length > 0 ? failed.join('\n') : null }
+}
+
+// ========== 主循环 ==========
+
+function serve(): void {
+  // 任务串行执行：并发由 Python 侧的 worker 数量控制
+  let queue: Promise<void> = Promise.resolve()
+
+  const rl = readline.createInterface({ input: process.stdin })
+  rl.on('line', line => {
+    if (!line.trim()) return
+    let job: { id: number; file: string } & JobOptions
+    try {
+      job = JSON.parse(line)
+    } catch {
+      return
+    }
+    queue = queue.then(async () => {
+      const result = await runJob(job.file, job)
+      send({ id: job.id, ...result })
+      if (result.background) send({ id: job.id, done: true, ...(await runDeferred()) })
+    })
+  })
+  rl.on('close', () => process.exit(0))
+
+  send({ ready: true })
+}
+
+const argv = process.argv.slice(2)
+if (argv[0] === '--once' && argv[1]) {
+  const formats = argv.includes('--formats') ? argv[argv.indexOf('--formats') + 1].split(',') : []
+  runJob(path.resolve(argv[1]), { capture: argv.includes('--capture'), formats }).then(result => {
+    send({ id: 0, ...result })
+    process.exit(result.ok ? 0 : 1)
+  })
+} else {
+  serve()
+}
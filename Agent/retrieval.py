@@ -0,0 +1,311 @@
+"""参考资料检索 — 按请求从指南与示例中选出最相关的几段，附在用户消息之后
+
+索引覆盖 prompts/AI_GUIDE.md、prompts/diagram-optimization.md 的各小节、
+examples/*.ts 示例脚本，以及精简 system prompt 中移出的 API 参数表（prompt.REFERENCE_SECTIONS）。
+打分用 BM25；中文按相邻二字切词，英文按单词并拆开驼峰。
+索引首次使用时构建并保存到 ~/.flowing/cache/retrieval.json，源文件变化后自动重建。
+
+    python retrieval.py "画一个张量流动的示意图"      # 查看检索结果
+"""
+
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import CONFIG_DIR
+from prompt import FLOWING_ROOT, REFERENCE_SECTIONS
+
+INDEX_FILE = CONFIG_DIR / "cache" / "retrieval.json"
+# 分词或切分规则变化时加一，旧索引随之失效
+INDEX_VERSION = 1
+
+GUIDE_FILES = ("prompts/AI_GUIDE.md", "prompts/diagram-optimization.md")
+EXAMPLES_GLOB = "examples/*.ts"
+
+# 附在用户消息之后的标题；bench 等需要原始请求时据此切掉
+CONTEXT_HEADER = "## 参考资料（按本次请求检索，仅供参考）"
+
+# 单个片段的最大字符数，过长的示例按行截断
+MAX_SNIPPET_CHARS = 1200
+
+# 用户描述里的常见说法 → 指南 / 示例中的用词
+QUERY_ALIASES = {
+    "tensor": "cuboid stack 3d 张量",
+    "张量": "cuboid stack 3d tensor",
+    "特征图": "cylinder stack feature map",
+    "feature map": "cylinder stack",
+    "3d": "cuboid cylinder sphere",
+    "立体": "cuboid cylinder sphere 3d",
+    "数据库": "cylinder database",
+    "database": "cylinder",
+    "判断": "diamond 菱形",
+    "decision": "diamond",
+    "流程图": "flowchart diamond",
+    "神经网络": "layer 层 resnet transformer",
+    "network": "layer",
+    "箭头": "arrow",
+    "对齐": "align 垂直 水平",
+    "分叉": "fork curve",
+    "配色": "color 颜色 fill",
+    "颜色": "color 配色 fill",
+    "容器": "group 背景 container",
+    "分组": "group 容器",
+    "布局": "row col grid layout",
+    "公式": "markdown formula",
+    "导出": "export png svg pdf",
+    "论文": "学术 academic",
+}
+
+
+@dataclass
+class Snippet:
+    id: str
+    title: str
+    text: str
+
+
+# ========== 分词 ==========
+
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z0-9]*|\d+|[一-鿿]+")
+_CAMEL = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in _TOKEN.findall(text):
+        if "一" <= word[0] <= "鿿":
+            tokens.extend([word] if len(word) == 1 else
+                          [word[i:i + 2] for i in range(len(word) - 1)])
+            continue
+        tokens.append(word.lower())
+        parts = _CAMEL.findall(word)
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts)
+    return tokens
+
+
+def expand_query(query: str) -> str:
+    lowered = query.lower()
+    extra = [v for k, v in QUERY_ALIASES.items() if k in lowered]
+    return " ".join([query] + extra)
+
+
+# ========== 语料 ==========
+
+_HEADING = re.compile(r"^(#{1,3})\s+(.+?)\s*$")
+
+
+def split_markdown(name: str, text: str) -> List[Snippet]:
+    """按一到三级标题切分；标题路径作为片段标题，代码块里的 # 不算标题"""
+    snippets, path, body, in_fence = [], [], [], False
+
+    def flush():
+        content = "\n".join(body).strip()
+        if len(content) >= 40 and path:
+            title = " › ".join(path[1:] or path)
+            snippets.append(Snippet(f"{name}#{title}", f"{name} › {title}", content))
+        body.clear()
+
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        m = None if in_fence else _HEADING.match(line)
+        if m:
+            flush()
+            level = len(m.group(1))
+            path[level - 1:] = [m.group(2)]
+            continue
+        body.append(line)
+    flush()
+    return snippets
+
+
+def _truncate(text: str, limit: int = MAX_SNIPPET_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit)
+    return text[:cut if cut > 0 else limit] + "\n  // …（已截断）"
+
+
+def example_snippet(path: str, source: str) -> Snippet:
+    """示例脚本：import 与导出路径换成 system prompt 中的占位符"""
+    name = os.path.basename(path)
+    code = re.sub(r"""(from\s*)(['"])\.\./src\2""", r"\1'<FLOWING_ROOT>/src'", source)
+    code = re.sub(r"""(\.export\(\s*)(['"])examples/""", r"\1\2<OUTPUT_DIR>/", code)
+    return Snippet(f"examples/{name}", f"示例 {name}", code.strip())
+
+
+def load_corpus(root: str = FLOWING_ROOT) -> Tuple[List[Snippet], List[str]]:
+    """返回 (片段, 用于索引的文本)；示例按全文索引，片段里只保留开头"""
+    docs, texts = [], []
+    for title, text in REFERENCE_SECTIONS:
+        docs.append(Snippet(f"api#{title}", f"API › {title}", text.strip()))
+        texts.append(f"{title}\n{text}")
+    for rel in GUIDE_FILES:
+        try:
+            text = Path(root, rel).read_text(encoding="utf-8")
+        except OSError:
+            continue
+        for s in split_markdown(os.path.basename(rel), text):
+            docs.append(Snippet(s.id, s.title, _truncate(s.text)))
+            texts.append(f"{s.title}\n{s.text}")
+    for path in sorted(glob.glob(os.path.join(root, EXAMPLES_GLOB))):
+        try:
+            source = Path(path).read_text(encoding="utf-8")
+        except OSError:
+            continue
+        s = example_snippet(path, source)
+        docs.append(Snippet(s.id, s.title, _truncate(s.text)))
+        # 文件名（gan、3d-shapes-test）本身就是很强的信号
+        texts.append(f"{re.sub(r'[-_.]', ' ', s.id)}\n{s.text}")
+    return docs, texts
+
+
+def corpus_signature(root: str = FLOWING_ROOT) -> str:
+    h = hashlib.sha256(f"v{INDEX_VERSION}".encode())
+    h.update(json.dumps(REFERENCE_SECTIONS, ensure_ascii=False).encode("utf-8"))
+    files = [os.path.join(root, rel) for rel in GUIDE_FILES]
+    files += sorted(glob.glob(os.path.join(root, EXAMPLES_GLOB)))
+    for path in files:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        h.update(f"{os.path.relpath(path, root)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+# ========== BM25 ==========
+
+class BM25Index:
+    def __init__(self, docs: List[Snippet], tfs: List[Dict[str, int]],
+                 k1: float = 1.5, b: float = 0.75):
+        self.docs = docs
+        self.tfs = tfs
+        self.k1 = k1
+        self.b = b
+        self.lengths = [sum(tf.values()) for tf in tfs]
+        self.avg_len = sum(self.lengths) / len(self.lengths) if tfs else 0.0
+        df = Counter(term for tf in tfs for term in tf)
+        n = len(tfs)
+        self.idf = {t: math.log(1 + (n - c + 0.5) / (c + 0.5)) for t, c in df.items()}
+
+    @classmethod
+    def build(cls, docs: List[Snippet], texts: Sequence[str]) -> "BM25Index":
+        return cls(docs, [dict(Counter(tokenize(t))) for t in texts])
+
+    def search(self, query: str, k: int) -> List[Tuple[float, Snippet]]:
+        terms = set(tokenize(query)) & self.idf.keys()
+        scored = []
+        for doc, tf, length in zip(self.docs, self.tfs, self.lengths):
+            score = 0.0
+            for t in terms:
+                f = tf.get(t)
+                if f:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self.avg_len or 1))
+                    score += self.idf[t] * f * (self.k1 + 1) / (f + norm)
+            if score > 0:
+                scored.append((score, doc))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored[:k]
+
+    def to_dict(self) -> dict:
+        return {"docs": [asdict(d) for d in self.docs], "tfs": self.tfs}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls([Snippet(**d) for d in data["docs"]], data["tfs"])
+
+
+# ========== 检索 ==========
+
+def attach_context(request: str, context: str) -> str:
+    return f"{request}\n\n{context}"
+
+
+def strip_context(text: str) -> str:
+    """去掉 attach_context 附加的参考资料，得到原始请求"""
+    return text.split(f"\n\n{CONTEXT_HEADER}", 1)[0]
+
+
+class Retriever:
+    """懒加载的 BM25 索引；top_k 个片段、总计不超过 max_chars 字符
+
+    分数低于最高分 min_ratio 倍的片段不附加，避免无关内容挤占 prompt。
+    """
+
+    def __init__(self, path: Optional[Path] = INDEX_FILE, root: str = FLOWING_ROOT,
+                 top_k: int = 3, max_chars: int = 2500, min_ratio: float = 0.4):
+        self.path = path
+        self.root = root
+        self.top_k = top_k
+        self.max_chars = max_chars
+        self.min_ratio = min_ratio
+        self._index: Optional[BM25Index] = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> BM25Index:
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_or_build()
+            return self._index
+
+    def _load_or_build(self) -> BM25Index:
+        signature = corpus_signature(self.root)
+        if self.path:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("signature") == signature:
+                    return BM25Index.from_dict(data)
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        index = BM25Index.build(*load_corpus(self.root))
+        if self.path:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"signature": signature, **index.to_dict()}, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except OSError:
+                pass
+        return index
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Tuple[float, Snippet]]:
+        hits = self.index.search(expand_query(query), k or self.top_k)
+        if not hits:
+            return []
+        floor = hits[0][0] * self.min_ratio
+        return [(score, doc) for score, doc in hits if score >= floor]
+
+    def context(self, query: str) -> Tuple[str, List[str]]:
+        """返回 (附在请求之后的文本, 片段 id)；没有相关片段时为 ("", [])"""
+        parts, ids, used = [], [], 0
+        for _, doc in self.search(query):
+            block = f"### {doc.title}\n{doc.text}"
+            if parts and used + len(block) > self.max_chars:
+                break
+            parts.append(block)
+            ids.append(doc.id)
+            used += len(block)
+        if not parts:
+            return "", []
+        return CONTEXT_HEADER + "\n\n" + "\n\n".join(parts), ids
+
+
+if __name__ == "__main__":
+    import sys
+
+    retriever = Retriever()
+    for score, doc in retriever.search(" ".join(sys.argv[1:]) or "tensor", k=8):
+        print(f"{score:7.2f}  {doc.title}")
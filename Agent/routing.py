@@ -0,0 +1,431 @@
+"""多服务商路由 — 按滚动延迟对冲请求，遇到 429 / 5xx / 连接错误自动切换
+
+主服务商超过自身 p95 延迟仍未返回（流式为首个 chunk）时，向下一个服务商
+发出同样的请求，取先返回的一个，另一个被丢弃。错误率过高的服务商排到最后。
+一轮里所有服务商都返回可重试错误（如同时 429）时，退避后整轮重试，最多 retries 轮。
+"""
+
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+from metrics import percentile
+
+# 状态码之外按异常类名识别的可重试错误（openai / anthropic / httpx）
+RETRYABLE_ERRORS = (
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ServiceUnavailableError", "OverloadedError", "ConnectError", "ReadTimeout",
+    "RemoteProtocolError", "TimeoutError",
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """429 / 5xx / 网络层错误可以换一个服务商重试；4xx 参数错误不行"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, TimeoutError)
+
+
+class ProviderStats:
+    """每个服务商最近 window 次调用的延迟与成败"""
+
+    def __init__(self, window: int = 50):
+        self._latency: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._outcomes: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, seconds: Optional[float], ok: bool) -> None:
+        with self._lock:
+            if ok and seconds is not None:
+                self._latency[kind].append(seconds)
+            self._outcomes.append(ok)
+
+    def p95(self, kind: str, min_samples: int) -> Optional[float]:
+        with self._lock:
+            values = list(self._latency[kind])
+        return percentile(values, 95) if len(values) >= min_samples else None
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def summary(self) -> dict:
+        with self._lock:
+            latency = {k: list(v) for k, v in self._latency.items()}
+            calls = len(self._outcomes)
+        return {
+            "calls": calls,
+            "error_rate": round(self.error_rate, 3),
+            **{f"{k}_p50": round(percentile(v, 50), 3) for k, v in latency.items()},
+            **{f"{k}_p95": round(percentile(v, 95), 3) for k, v in latency.items()},
+        }
+
+
+class HedgedLLM:
+    """在多个聊天模型之间对冲与切换，对 graph 提供 invoke / ainvoke / generate / agenerate /
+    stream / astream / bind
+
+    llms 按优先级排列，第一个为主服务商。其余属性（model_name 等）转发给主服务商。
+    hedge_delay = max(hedge_min, 主服务商 p95)；样本不足 min_samples 时用 hedge_default。
+    各服务商的限流层不再重试，整轮失败后的退避（backoff_base / backoff_max）在这里做。
+    """
+
+    def __init__(self, llms: Dict[str, object], hedge: bool = True,
+                 hedge_min: float = 1.0, hedge_default: float = 8.0,
+                 min_samples: int = 5, error_threshold: float = 0.5,
+                 stats: Optional[Dict[str, ProviderStats]] = None,
+                 retries: int = 2, backoff_base: float = 1.0, backoff_max: float = 30.0):
+        if not llms:
+            raise ValueError("至少需要一个服务商")
+        self.llms = dict(llms)
+        self.hedge = hedge
+        self.hedge_min = hedge_min
+        self.hedge_default = hedge_default
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # bind() 出的副本与原对象共享统计
+        self.stats = stats if stats is not None else {name: ProviderStats() for name in self.llms}
+
+    @property
+    def primary(self):
+        return next(iter(self.llms.values()))
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def bind(self, **kwargs) -> "HedgedLLM":
+        return HedgedLLM(
+            {name: llm.bind(**kwargs) for name, llm in self.llms.items()},
+            self.hedge, self.hedge_min, self.hedge_default,
+            self.min_samples, self.error_threshold, self.stats,
+            self.retries, self.backoff_base, self.backoff_max,
+        )
+
+    def _ranked(self) -> List[str]:
+        """配置顺序，错误率超过阈值的排到最后"""
+        names = list(self.llms)
+        return sorted(names, key=lambda n: self.stats[n].error_rate > self.error_threshold)
+
+    def _hedge_delay(self, name: str, kind: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.stats[name].p95(kind, self.min_samples)
+        return max(self.hedge_min, p95) if p95 is not None else self.hedge_default
+
+    def summary(self) -> dict:
+        return {name: self.stats[name].summary() for name in self.llms}
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """整轮失败后可以再试一轮时返回等待秒数，否则重新抛出"""
+        if attempt >= self.retries or not is_retryable(error):
+            raise error
+        from ratelimit import backoff_delay  # ratelimit 依赖本模块的 is_retryable
+        return backoff_delay(attempt, self.backoff_base, self.backoff_max, error)
+
+    # ---------- 非流式 ----------
+
+    def invoke(self, messages, **kwargs):
+        return self._retrying("invoke", messages, kwargs)
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self._aretrying("invoke", messages, kwargs)
+
+    def generate(self, batches, **kwargs):
+        """多候选（n=k）同样对冲 / 切换，整组候选来自同一个服务商"""
+        return self._retrying("generate", batches, kwargs)
+
+    async def agenerate(self, batches, **kwargs):
+        return await self._aretrying("generate", batches, kwargs)
+
+    def _retrying(self, kind: str, payload, kwargs):
+        for attempt in itertools.count():
+            try:
+                return self._call(kind, payload, kwargs)
+            except Exception as e:
+                delay = self._backoff(attempt, e)
+            time.sleep(delay)
+
+    async def _aretrying(self, kind: str, payload, kwargs):
+        for attempt in itertools.count():
+            try:
+                return await self._acall(kind, payload, kwargs)
+            except Exception as e:
+                delay = self._backoff(attempt, e)
+            await asyncio.sleep(delay)
+
+    def _call(self, kind: str, payload, kwargs):
+        """一轮：按排名依次调用 llm.<kind>，超过对冲延迟时并发下一个
+
+        不可重试的错误不再对冲 / 切换，但要等仍在进行的另一路结束：它成功就用它的结果。
+        """
+        order = self._ranked()
+        results: "queue.Queue" = queue.Queue()
+        started: Dict[str, float] = {}
+
+        def call(name):
+            started[name] = time.perf_counter()
+            try:
+                reply = getattr(self.llms[name], kind)(payload, **kwargs)
+            except Exception as e:
+                self.stats[name].record(kind, None, False)
+                results.put((name, None, e))
+                return
+            self.stats[name].record(kind, time.perf_counter() - started[name], True)
+            results.put((name, reply, None))
+
+        def launch():
+            name = order.pop(0)
+            threading.Thread(target=call, args=(name,), daemon=True).start()
+            return name
+
+        running = {launch()}
+        last_error = fatal = None
+        while running:
+            timeout = self._hedge_delay(next(iter(running)), kind) if order and len(running) == 1 else None
+            try:
+                name, reply, error = results.get(timeout=timeout)
+            except queue.Empty:
+                running.add(launch())  # 对冲
+                continue
+            running.discard(name)
+            if error is None:
+                return reply
+            if is_retryable(error):
+                last_error = error
+            else:
+                fatal = fatal or error
+                order.clear()
+            if not running and order:
+                running.add(launch())  # 切换
+        raise fatal or last_error
+
+    async def _acall(self, kind: str, payload, kwargs):
+        order = self._ranked()
+
+        async def call(name):
+            start = time.perf_counter()
+            try:
+                reply = await getattr(self.llms[name], "a" + kind)(payload, **kwargs)
+            except Exception:
+                self.stats[name].record(kind, None, False)
+                raise
+            self.stats[name].record(kind, time.perf_counter() - start, True)
+            return reply
+
+        def launch():
+            name = order.pop(0)
+            task = asyncio.ensure_future(call(name))
+            tasks[task] = name
+            return task
+
+        tasks: Dict[asyncio.Future, str] = {}
+        running = {launch()}
+        last_error = fatal = None
+        try:
+            while running:
+                timeout = (self._hedge_delay(tasks[next(iter(running))], kind)
+                           if order and len(running) == 1 else None)
+                done, _ = await asyncio.wait(running, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    running.add(launch())  # 对冲
+                    continue
+                for task in done:
+                    running.discard(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if is_retryable(error):
+                        last_error = error
+                    else:
+                        fatal = fatal or error
+                        order.clear()
+                if not running and order:
+                    running.add(launch())  # 切换
+            raise fatal or last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # ---------- 流式：以首个 chunk 为准，只在输出之前重试 ----------
+
+    def stream(self, messages, **kwargs):
+        for attempt in itertools.count():
+            started = False
+            chunks = self._stream(messages, kwargs)
+            try:
+                for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                chunks.close()
+            time.sleep(delay)
+
+    async def astream(self, messages, **kwargs):
+        for attempt in itertools.count():
+            started = False
+            chunks = self._astream(messages, kwargs)
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                await chunks.aclose()
+            await asyncio.sleep(delay)
+
+    def _stream(self, messages, kwargs):
+        order = self._ranked()
+        events: "queue.Queue" = queue.Queue()
+        stops: Dict[str, threading.Event] = {}
+
+        def pump(name, stop):
+            start = time.perf_counter()
+            first = True
+            try:
+                for chunk in self.llms[name].stream(messages, **kwargs):
+                    if stop.is_set():
+                        return
+                    if first:
+                        self.stats[name].record("first_chunk", time.perf_counter() - start, True)
+                        first = False
+                    events.put((name, "chunk", chunk))
+                events.put((name, "end", None))
+            except Exception as e:
+                self.stats[name].record("first_chunk", None, False)
+                events.put((name, "error", e))
+
+        def launch():
+            name = order.pop(0)
+            stops[name] = threading.Event()
+            threading.Thread(target=pump, args=(name, stops[name]), daemon=True).start()
+            return name
+
+        running = {launch()}
+        winner = None
+        last_error = fatal = None
+        try:
+            while running:
+                timeout = None
+                if winner is None and order and len(running) == 1:
+                    timeout = self._hedge_delay(next(iter(running)), "first_chunk")
+                try:
+                    name, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    running.add(launch())  # 对冲
+                    continue
+                if winner is not None and name != winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = name
+                        for other in running - {name}:
+                            stops[other].set()
+                        running = {name}
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    running.discard(name)
+                    # 已经输出了部分内容，不能再换服务商
+                    if winner is not None:
+                        raise payload
+                    if is_retryable(payload):
+                        last_error = payload
+                    else:
+                        # 等对冲的另一路：它先出 chunk 就用它
+                        fatal = fatal or payload
+                        order.clear()
+                    if not running and order:
+                        running.add(launch())  # 切换
+            raise fatal or last_error
+        finally:
+            for stop in stops.values():
+                stop.set()
+
+    async def _astream(self, messages, kwargs):
+        order = self._ranked()
+        events: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def pump(name):
+            start = time.perf_counter()
+            first = True
+            try:
+                async for chunk in self.llms[name].astream(messages, **kwargs):
+                    if first:
+                        self.stats[name].record("first_chunk", time.perf_counter() - start, True)
+                        first = False
+                    await events.put((name, "chunk", chunk))
+                await events.put((name, "end", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats[name].record("first_chunk", None, False)
+                await events.put((name, "error", e))
+
+        def launch():
+            name = order.pop(0)
+            tasks[name] = asyncio.ensure_future(pump(name))
+            return name
+
+        running = {launch()}
+        winner = None
+        last_error = fatal = None
+        try:
+            while running:
+                timeout = None
+                if winner is None and order and len(running) == 1:
+                    timeout = self._hedge_delay(next(iter(running)), "first_chunk")
+                try:
+                    name, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    running.add(launch())  # 对冲
+                    continue
+                if winner is not None and name != winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = name
+                        for other in running - {name}:
+                            tasks[other].cancel()
+                        running = {name}
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    running.discard(name)
+                    if winner is not None:
+                        raise payload
+                    if is_retryable(payload):
+                        last_error = payload
+                    else:
+                        fatal = fatal or payload
+                        order.clear()
+                    if not running and order:
+                        running.add(launch())  # 切换
+            raise fatal or last_error
+        finally:
+            for task in tasks.values():
+                task.cancel()
@@ -0,0 +1,310 @@
+"""HTTP 服务模式 — 把工作流以 JSON 接口暴露给内部工具
+
+    POST /generate  {"prompt": "...", "save": true, "inline": false}   新会话
+    POST /refine    {"session": "<id>", "prompt": "..."}                在会话上继续修改（增量编辑上一版代码）
+    GET  /status    队列、会话、各阶段与各模型档位的统计
+    GET  /metrics   Prometheus 文本格式
+
+请求先进入有界队列，由固定数量的执行线程处理；队列已满或同一客户端
+（X-Client-Id 请求头，缺省为来源 IP）在途请求超过上限时立即返回 429。
+save 为 false 时导出内容不写盘；inline 为 true 时以 base64 放在响应的 artifacts 中。
+"""
+
+import base64
+import http.server
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from executor import CODE_MODE, save_artifacts
+from history import HistoryManager
+from metrics import tracer, turn_stats
+from prompt import build_system_message
+from tiers import tier_stats
+
+# 单个请求体的上限
+MAX_BODY = 1024 * 1024
+
+
+class Busy(Exception):
+    """队列已满或客户端超出并发上限"""
+
+
+class Session:
+    def __init__(self, sid: str, history: HistoryManager, output_dir: str):
+        self.id = sid
+        self.history = history
+        self.output_dir = output_dir
+        self.last_code: Optional[str] = None
+        self.output_file: Optional[str] = None
+        # 同一会话的 refine 串行执行
+        self.lock = threading.Lock()
+
+
+class AgentService:
+    """会话管理 + 有界队列 + 按客户端限流"""
+
+    def __init__(self, app, provider: str, output_dir: str, concurrency: int = 4,
+                 queue_size: int = 16, per_client: int = 2, max_sessions: int = 100,
+                 history_budget: int = 8000, compact: bool = False,
+                 output_mode: str = CODE_MODE):
+        self.app = app
+        # app 带 retriever 时使用精简 system prompt；output_mode 与构建 app 时一致
+        self.compact = compact
+        self.output_mode = output_mode
+        self.provider = provider
+        self.output_dir = output_dir
+        self.per_client = per_client
+        self.max_sessions = max_sessions
+        self.history_budget = history_budget
+        self.concurrency = max(1, concurrency)
+        self.capacity = self.concurrency + max(0, queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                            thread_name_prefix="flowing-serve")
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._inflight: dict = defaultdict(int)
+        self._pending = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    # ---------- 准入 ----------
+
+    def _admit(self, client: str) -> None:
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise Busy("队列已满")
+            if self._inflight[client] >= self.per_client:
+                raise Busy(f"客户端 {client} 的在途请求已达上限 {self.per_client}")
+            self._pending += 1
+            self._inflight[client] += 1
+
+    def _release(self, client: str) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._inflight[client] -= 1
+            if self._inflight[client] <= 0:
+                del self._inflight[client]
+
+    def submit(self, client: str, fn, *args) -> dict:
+        """排队执行 fn，阻塞到完成；无法入队时抛 Busy"""
+        self._admit(client)
+        try:
+            return self._executor.submit(self._run, fn, *args).result()
+        finally:
+            self._release(client)
+
+    def _run(self, fn, *args) -> dict:
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    # ---------- 会话 ----------
+
+    def _new_session(self) -> Session:
+        sid = uuid.uuid4().hex[:12]
+        out = os.path.join(self.output_dir, sid)
+        os.makedirs(out, exist_ok=True)
+        history = HistoryManager(build_system_message(out, self.provider, self.compact,
+                                                      self.output_mode),
+                                 self.history_budget)
+        session = Session(sid, history, out)
+        with self._lock:
+            self._sessions[sid] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def session(self, sid: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session:
+                self._sessions.move_to_end(sid)
+            return session
+
+    # ---------- 请求 ----------
+
+    def generate(self, prompt: str, save: bool = True, inline: bool = False) -> dict:
+        return self._turn(self._new_session(), prompt, save, inline)
+
+    def refine(self, session: Session, prompt: str, save: bool = True,
+               inline: bool = False) -> dict:
+        return self._turn(session, prompt, save, inline)
+
+    def _turn(self, session: Session, prompt: str, save: bool, inline: bool) -> dict:
+        with session.lock:
+            history = session.history
+            history.add_user(prompt)
+            started = time.perf_counter()
+            with tracer.span("request", mode="serve", session=session.id) as span:
+                result = self.app.invoke({
+                    "messages": history.messages,
+                    "last_code": None,
+                    "output_file": None,
+                    "retry_count": 0,
+                    "error": None,
+                    "output_dir": session.output_dir,
+                    "base_code": session.last_code,
+                })
+                span["ok"] = not result.get("error")
+            messages = result.get("messages", [])
+            retries, tokens = turn_stats(messages[len(history.messages) - 1:])
+            tracer.record_request(retries, tokens)
+            history.commit_turn(messages, success=not result.get("error"))
+
+            artifacts = result.get("artifacts") or []
+            if save:
+                save_artifacts(artifacts)
+            if not result.get("error"):
+                # 拆分组合的结果是 JSON 图表描述，不作为增量编辑的基础
+                session.last_code = None if result.get("plan") else result.get("last_code")
+                session.output_file = result.get("output_file")
+
+            body = {
+                "session": session.id,
+                "success": not result.get("error"),
+                "code": result.get("last_code"),
+                "output_file": result.get("output_file") if save else None,
+                "error": result.get("error"),
+                "retries": retries,
+                "tokens": tokens,
+                "edited": bool(result.get("edit_applied")),
+                "context": result.get("context_sources") or [],
+                "tier": result.get("tier"),
+                "parts": [p["name"] for p in (result.get("plan") or {}).get("parts", [])],
+                "elapsed": round(time.perf_counter() - started, 3),
+            }
+            if inline:
+                body["artifacts"] = [
+                    {"path": a.path, "format": a.format,
+                     "data": base64.b64encode(a.data).decode("ascii")}
+                    for a in artifacts
+                ]
+            return body
+
+    def status(self) -> dict:
+        with self._lock:
+            queue = {
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "capacity": self.capacity,
+                "concurrency": self.concurrency,
+                "per_client": self.per_client,
+                "clients": dict(self._inflight),
+            }
+            sessions = len(self._sessions)
+        return {
+            "provider": self.provider,
+            "uptime": round(time.time() - self.started, 1),
+            "queue": queue,
+            "sessions": sessions,
+            "stats": tracer.summary(),
+            "tiers": tier_stats.summary(),
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def make_handler(service: AgentService):
+
+    class AgentHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body, content_type: str = "application/json",
+                  headers: Optional[dict] = None) -> None:
+            data = body if isinstance(body, bytes) else (
+                json.dumps(body, ensure_ascii=False).encode("utf-8"))
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _client(self) -> str:
+            return self.headers.get("X-Client-Id") or self.client_address[0]
+
+        def _body(self) -> Optional[dict]:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY:
+                self._send(413, {"error": "请求体过大"})
+                return None
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": "请求体不是合法的 JSON"})
+                return None
+            if not isinstance(body, dict) or not str(body.get("prompt") or "").strip():
+                self._send(400, {"error": "缺少 prompt"})
+                return None
+            return body
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/status":
+                self._send(200, service.status())
+            elif path == "/metrics":
+                self._send(200, tracer.prometheus().encode("utf-8"),
+                           "text/plain; version=0.0.4")
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            if path not in ("/generate", "/refine"):
+                self._send(404, {"error": "not found"})
+                return
+            body = self._body()
+            if body is None:
+                return
+            options = (bool(body.get("save", True)), bool(body.get("inline", False)))
+
+            if path == "/refine":
+                session = service.session(str(body.get("session") or ""))
+                if not session:
+                    self._send(404, {"error": "会话不存在或已过期"})
+                    return
+                job = (service.refine, session, body["prompt"], *options)
+            else:
+                job = (service.generate, body["prompt"], *options)
+
+            try:
+                result = service.submit(self._client(), *job)
+            except Busy as e:
+                self._send(429, {"error": str(e)}, headers={"Retry-After": "1"})
+                return
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+            self._send(200, result)
+
+        def log_message(self, format, *args):
+            pass  # 静默日志
+
+    return AgentHandler
+
+
+def serve(service: AgentService, host: str = "127.0.0.1", port: int = 8765) -> None:
+    """阻塞运行，Ctrl-C 退出"""
+    server = http.server.ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Flowing Agent 服务已启动: http://{host}:{server.server_address[1]}")
+    print("  POST /generate  POST /refine  GET /status  GET /metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服务已停止。")
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,21 @@
+"""Agent 下的模块按平铺方式导入（与 python main.py 的运行方式一致）"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """trace / 指纹 / 档位统计写到临时目录，测试不碰 ~/.flowing"""
+    import graph
+    import metrics
+    import tiers
+
+    state = tmp_path / ".flowing"
+    monkeypatch.setattr(metrics.tracer, "path", state / "trace.jsonl")
+    monkeypatch.setattr(graph._fingerprints, "path", state / "fingerprints.jsonl")
+    monkeypatch.setattr(tiers.tier_stats, "path", state / "tiers.jsonl")
+    yield state
+    metrics.tracer.flush()
@@ -0,0 +1,80 @@
+import os
+
+from autofix import FingerprintStats, fingerprint, try_autofix
+from executor import FLOWING_ROOT
+from validator import format_errors, validate_code
+
+GOOD_IMPORT = f"import {{ Figure }} from '{FLOWING_ROOT}/src'\n"
+
+
+def test_fingerprint_ignores_paths_lines_and_stack():
+    a = ("/tmp/flowing_agent_abc123.ts:12:7\n    fig.foo()\n"
+         "TypeError: fig.foo is not a function\n    at Object.<anonymous> (/tmp/x.ts:12:7)")
+    b = ("/tmp/flowing_agent_zzz999.ts:40:3\n    fig.foo()\n"
+         "TypeError: fig.foo is not a function\n    at main (/tmp/y.ts:40:3)")
+    assert fingerprint(a) == fingerprint(b) == "TypeError: fig.foo is not a function"
+    assert fingerprint("") == "<empty>"
+
+
+def test_validation_errors_are_patched_locally(tmp_path):
+    code = (
+        "import { Figure } from 'figcraft'\n"
+        "async function main() {\n"
+        "  const fig = new Figure(200, 100)\n"
+        "  const a = fig.rect('A')\n"
+        "  fig.arrow(a, a, { path: 'bezier', head: 'arrow' })\n"
+        "  await fig.export('/elsewhere/out.png')\n"
+        "}\n")
+    error = format_errors(validate_code(code, str(tmp_path)))
+    patched, applied = try_autofix(code, error, str(tmp_path))
+    assert set(applied) == {"import_path", "missing_main", "export_dir", "enum_alias"}
+    assert validate_code(patched, str(tmp_path)) == []
+    assert f"'{tmp_path}{os.sep}out.png'" in patched
+
+
+def test_relative_export_inside_output_dir_is_left_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = GOOD_IMPORT + "fig.export('gallery/a.png')\nfig.export('b.png')\n"
+    out = os.path.join(FLOWING_ROOT, "gallery")
+    patched, applied = try_autofix(code, "- [export_dir] 导出路径不在输出目录下", out)
+    assert applied == ["export_dir"]
+    assert "'gallery/a.png'" in patched
+    assert f"'{out}{os.sep}b.png'" in patched
+
+
+def test_unknown_errors_and_unknown_aliases_are_not_patched():
+    code = GOOD_IMPORT + "fig.arrow(a, b, { path: 'wiggle' })\n"
+    assert try_autofix(code, "TypeError: x is not a function") == (None, [])
+    assert try_autofix(code, "- [enum] 第 2 行: path: 'wiggle' 无效，可选: curve") == (None, [])
+
+
+def test_enum_alias_only_rewrites_the_flagged_arrow_call(tmp_path):
+    code = (
+        GOOD_IMPORT +
+        "async function main() {\n"
+        "  const fig = new Figure(200, 100)\n"
+        "  const a = fig.rect('A', { label: { style: 'dash' } })\n"
+        "  const b = fig.rect('B')\n"
+        "  fig.arrow(a, b, { style: 'dash' })\n"
+        f"  await fig.export('{tmp_path}/out.png')\n"
+        "}\nmain()\n")
+    error = format_errors(validate_code(code, str(tmp_path)))
+    assert "第 6 行" in error
+    patched, applied = try_autofix(code, error, str(tmp_path))
+    assert applied == ["enum_alias"]
+    assert "fig.rect('A', { label: { style: 'dash' } })" in patched
+    assert "fig.arrow(a, b, { style: 'dashed' })" in patched
+
+
+def test_fingerprint_stats_accumulate_across_instances(tmp_path):
+    path = tmp_path / "fingerprints.jsonl"
+    a, b = FingerprintStats(path), FingerprintStats(path)
+    a.record("TypeError: x", "TypeError: x\n  at main")
+    b.record("TypeError: x", "TypeError: x", "import_path")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"fp": "Type\n')  # 写到一半的行
+    a.record("[main] 缺少 main()", "- [main] 缺少 main()")
+    (fp, entry), _ = a.top()
+    assert fp == "TypeError: x"
+    assert entry == {"count": 2, "patched": 1, "rule": "import_path",
+                     "example": "TypeError: x\n  at main"}
@@ -0,0 +1,47 @@
+import os
+
+from cache import RenderCache
+from executor import Artifact, ExecResult
+
+
+def _script(out):
+    return (f"await fig.export('{out}/a.svg')\n"
+            f"await fig.export('{out}/a.png', {{ scale: 2 }})\n")
+
+
+def test_every_export_is_restored_from_disk_entries(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    files = {"a.svg": b"<svg/>", "a.png": b"png", "a.pdf": b"pdf"}
+    for name, data in files.items():
+        (out / name).write_bytes(data)
+    cache = RenderCache(tmp_path / "cache")
+    code = _script(out)
+    cache.put(ExecResult(success=True, code=code, output_file=f"{out}/a.svg"), formats=["pdf"])
+
+    for name in files:
+        (out / name).unlink()
+    assert cache.get(code).success
+    assert {p.name: p.read_bytes() for p in out.iterdir()} == files
+
+    inline = cache.get(code, persist=False)
+    assert {(os.path.basename(a.path), a.format, a.data) for a in inline.artifacts} == {
+        ("a.svg", "svg", b"<svg/>"), ("a.png", "png", b"png"), ("a.pdf", "pdf", b"pdf")}
+
+
+def test_captured_artifacts_are_all_cached(tmp_path):
+    cache = RenderCache(tmp_path / "cache")
+    code = _script(tmp_path)
+    artifacts = [Artifact(f"{tmp_path}/a.svg", "svg", b"<svg/>"),
+                 Artifact(f"{tmp_path}/a.png", "png", b"png")]
+    cache.put(ExecResult(success=True, code=code, output_file=artifacts[0].path,
+                         artifacts=artifacts))
+    assert cache.get(code, persist=False).artifacts == artifacts
+    assert not (tmp_path / "a.png").exists()
+
+
+def test_missing_main_export_is_not_cached(tmp_path):
+    cache = RenderCache(tmp_path / "cache")
+    code = _script(tmp_path)
+    cache.put(ExecResult(success=True, code=code, output_file=f"{tmp_path}/a.svg"))
+    assert cache.get(code) is None
@@ -0,0 +1,57 @@
+import pytest
+
+from edits import Edit, EditError, apply_edit, apply_edits, is_followup, parse_edits
+
+CODE = """const fig = new Figure(400, 300)
+const a = fig.rect('A', { fill: '#fff' })
+const b = fig.rect('B', { fill: '#fff' })
+fig.arrow(a, b)
+fig.export('out.png')"""
+
+
+def test_parse_edits_reads_multiple_blocks():
+    reply = ("改两处:\n<<<<<<< SEARCH\nconst a = fig.rect('A', { fill: '#fff' })\n=======\n"
+             "const a = fig.rect('A', { fill: '#eef' })\n>>>>>>> REPLACE\n\n"
+             "<<<<<<< SEARCH\nfig.arrow(a, b)\n=======\n>>>>>>> REPLACE\n")
+    assert parse_edits(reply) == [
+        Edit("const a = fig.rect('A', { fill: '#fff' })",
+             "const a = fig.rect('A', { fill: '#eef' })"),
+        Edit("fig.arrow(a, b)", ""),
+    ]
+
+
+def test_apply_edits_applies_in_order():
+    patched = apply_edits(CODE, [Edit("fig.rect('A'", "fig.circle('A'"),
+                                 Edit("fig.arrow(a, b)\n", "")])
+    assert "fig.circle('A'" in patched
+    assert "arrow" not in patched
+
+
+def test_loose_match_ignores_indentation():
+    code = "function main() {\n    const x = 1\n    const y = 2\n}"
+    assert apply_edit(code, Edit("const x = 1\nconst y = 2", "const x = 3")) == \
+        "function main() {\nconst x = 3\n}"
+
+
+@pytest.mark.parametrize("search, message", [
+    ("{ fill: '#fff' }", "出现了 2 次"),
+    ("fig.circle('C')", "找不到"),
+    ("   ", "为空"),
+])
+def test_apply_edit_failures(search, message):
+    with pytest.raises(EditError, match=message):
+        apply_edit(CODE, Edit(search, "x"))
+
+
+def test_apply_edits_is_all_or_nothing():
+    with pytest.raises(EditError):
+        apply_edits(CODE, [Edit("fig.rect('A'", "fig.circle('A'"), Edit("missing", "")])
+    with pytest.raises(EditError, match="没有"):
+        apply_edits(CODE, [])
+
+
+def test_is_followup():
+    assert is_followup("把箭头改成虚线")
+    assert is_followup("make the arrows dashed")
+    assert not is_followup("重新画一张神经网络图")
+    assert not is_followup("draw a new flowchart")
@@ -0,0 +1,50 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import graph
+from executor import FLOWING_ROOT, ExecResult
+
+CODE = (
+    "```typescript\n"
+    f"import {{ Figure }} from '{FLOWING_ROOT}/src'\n"
+    "const fig = new Figure(200, 100)\n"
+    "fig.export('{path}')\n"
+    "```")
+
+
+class CountingLLM:
+    def __init__(self, output_dir):
+        self.calls = 0
+        self.reply = CODE.replace("{path}", f"{output_dir}/out.png")
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        return AIMessage(content=self.reply)
+
+    def bind(self, **kwargs):
+        return self
+
+
+def _request(output_dir):
+    return {
+        "messages": [SystemMessage(content="system"), HumanMessage(content="画一个流程图")],
+        "last_code": None, "output_file": None, "retry_count": 0, "error": None,
+        "output_dir": str(output_dir),
+    }
+
+
+def test_default_budget_allows_two_llm_fix_rounds(tmp_path, monkeypatch):
+    monkeypatch.setattr(graph, "execute_code", lambda code, **kw: ExecResult(
+        success=False, code=code, error="Error: something unexpected"))
+    llm = CountingLLM(tmp_path)
+    result = graph.build_graph(llm).invoke(_request(tmp_path))
+    assert result["error"]
+    # 首次生成 + 两轮修复
+    assert llm.calls == 1 + graph.FIX_BUDGET == 3
+
+
+def test_zero_budget_disables_llm_fixes(tmp_path, monkeypatch):
+    monkeypatch.setattr(graph, "execute_code", lambda code, **kw: ExecResult(
+        success=False, code=code, error="Error: something unexpected"))
+    llm = CountingLLM(tmp_path)
+    graph.build_graph(llm, fix_budget=0).invoke(_request(tmp_path))
+    assert llm.calls == 1
@@ -0,0 +1,58 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from history import MessageLog, append_messages
+
+
+def _msgs(*texts):
+    return [HumanMessage(content=t) for t in texts]
+
+
+def test_extend_at_tail_shares_storage_and_keeps_old_views():
+    base = MessageLog(_msgs("a", "b"))
+    longer = base.extend(_msgs("c"))
+    assert [m.content for m in longer] == ["a", "b", "c"]
+    assert [m.content for m in base] == ["a", "b"]
+    assert longer._items is base._items
+
+
+def test_fork_from_middle_copies_prefix():
+    base = MessageLog(_msgs("a"))
+    left = base.extend(_msgs("left"))
+    right = base.extend(_msgs("right"))
+    assert [m.content for m in left] == ["a", "left"]
+    assert [m.content for m in right] == ["a", "right"]
+    assert right._items is not left._items
+
+
+def test_replaying_the_same_update_is_shared():
+    base = MessageLog(_msgs("a"))
+    reply = _msgs("b")
+    first = base.extend(reply)
+    again = base.extend(reply)
+    assert again._items is first._items
+    assert len(again) == 2
+
+
+def test_sequence_protocol():
+    log = MessageLog(_msgs("a", "b", "c")).extend([])
+    assert log[-1].content == "c"
+    assert [m.content for m in log[1:]] == ["b", "c"]
+    assert [m.content for m in reversed(log)] == ["c", "b", "a"]
+    with pytest.raises(IndexError):
+        log[3]
+    # 底层 list 之后被更长的视图扩展，短视图的边界不变
+    log.extend(_msgs("d"))
+    with pytest.raises(IndexError):
+        log[3]
+
+
+def test_reducer_appends_without_copying():
+    history = MessageLog([SystemMessage(content="s"), *_msgs("q")])
+    state = append_messages([], history)
+    assert state is history
+    reply = AIMessage(content="r")
+    updated = append_messages(state, [reply])
+    assert list(updated) == [*history, reply]
+    assert len(history) == 2
+    assert isinstance(append_messages(_msgs("x"), _msgs("y")), MessageLog)
@@ -0,0 +1,31 @@
+import threading
+
+from metrics import Tracer
+
+
+def test_spans_are_written_by_the_background_writer(tmp_path, monkeypatch):
+    tracer = Tracer(tmp_path / "a.jsonl")
+    writes = threading.Event()
+    callers = []
+    original = tracer._append
+
+    def append(path, text):
+        callers.append(threading.current_thread().name)
+        writes.wait(5)
+        original(path, text)
+
+    monkeypatch.setattr(tracer, "_append", append)
+    # 写文件被卡住时记录 span 不受影响
+    with tracer.span("generate"):
+        pass
+    with tracer.span("execute"):
+        pass
+    tracer.path = tmp_path / "b.jsonl"
+    with tracer.span("fix"):
+        pass
+    writes.set()
+    tracer.flush()
+
+    assert set(callers) == {"flowing-trace"}
+    assert (tmp_path / "a.jsonl").read_text().count("\n") == 2
+    assert '"stage": "fix"' in (tmp_path / "b.jsonl").read_text()
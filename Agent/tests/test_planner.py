@@ -0,0 +1,134 @@
+import json
+import os
+import re
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import graph
+import metrics
+from executor import FLOWING_ROOT, SPEC_MODE, Artifact, ExecResult, find_output_path
+from planner import (MAX_PARTS, Anchor, Plan, PlanError, compose_spec, parse_plan,
+                     svg_size)
+
+PLAN = {
+    "layout": "row",
+    "export": "whole.png",
+    "parts": [
+        {"name": "encoder", "title": "Encoder", "prompt": "编码器",
+         "anchors": {"out": {"side": "right", "at": 50}}},
+        {"name": "decoder", "title": "Decoder", "prompt": "解码器",
+         "anchors": {"memory": {"side": "left"}}},
+    ],
+    "links": [{"from": "encoder.out", "to": "decoder.memory"}],
+}
+
+SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="120" height="80"></svg>'
+
+
+class FakeLLM:
+    """拆分请求回复 PLAN，子图请求回复导出到指定路径的脚本"""
+
+    def invoke(self, messages, **kwargs):
+        text = messages[-1].content
+        if "拆分方案" in text:
+            return AIMessage(content=f"```json\n{json.dumps(PLAN)}\n```")
+        path = re.search(r"路径必须是 (\S+\.svg)", text).group(1)
+        return AIMessage(content=(
+            "```typescript\n"
+            f"import {{ Figure }} from '{FLOWING_ROOT}/src'\n"
+            "const fig = new Figure(200, 100)\n"
+            f"fig.export('{path}', {{ fit: true }})\n"
+            "```"))
+
+    def bind(self, **kwargs):
+        return self
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    """代替 tsx 执行：persist 时写出 SVG，否则只放在 artifacts 中"""
+    calls = []
+
+    def fake_execute(code, persist=True, mode="code", formats=None, preview=False):
+        calls.append((mode, persist))
+        output = find_output_path(code, mode)
+        if mode == SPEC_MODE:
+            return ExecResult(success=True, code=code, output_file=output)
+        if persist:
+            with open(output, "w", encoding="utf-8") as f:
+                f.write(SVG)
+            return ExecResult(success=True, code=code, output_file=output)
+        return ExecResult(success=True, code=code, output_file=output,
+                          artifacts=[Artifact(output, "svg", SVG.encode())])
+
+    monkeypatch.setattr(graph, "execute_code", fake_execute)
+    return calls
+
+
+def test_plan_composes_when_not_persisting(tmp_path, executed, isolated_state):
+    # --serve 以 persist=False 构建，子图仍须写到子图目录供 compose 读取
+    app = graph.build_graph(FakeLLM(), persist=False, plan_complexity=1)
+    result = app.invoke({
+        "messages": [SystemMessage(content="system"),
+                     HumanMessage(content="画一个 transformer 架构图")],
+        "last_code": None, "output_file": None, "retry_count": 0, "error": None,
+        "output_dir": str(tmp_path),
+    })
+    assert result["error"] is None
+    assert all(o["ok"] for o in result["parts"].values())
+    assert result["output_file"] == os.path.join(str(tmp_path), "whole.png")
+    assert executed[-1] == (SPEC_MODE, False)
+    assert [p for m, p in executed if m != SPEC_MODE] == [True, True]
+    assert not os.path.exists(result["plan"]["dir"])
+    # span 落在 conftest 的临时目录里，而不是 ~/.flowing/trace.jsonl
+    metrics.tracer.flush()
+    with open(isolated_state / "trace.jsonl", encoding="utf-8") as f:
+        stages = {json.loads(line)["stage"] for line in f}
+    assert {"plan", "parts", "compose"} <= stages
+
+
+def _reply(data):
+    return f"```json\n{data if isinstance(data, str) else json.dumps(data)}\n```"
+
+
+def test_parse_plan_reads_parts_links_and_anchor_shorthand():
+    plan = parse_plan(_reply({**PLAN, "layout": "diagonal", "export": "../../etc/x.png"}))
+    assert [p.name for p in plan.parts] == ["encoder", "decoder"]
+    assert plan.parts[1].anchors["memory"] == Anchor("left", 50)
+    assert plan.links[0].source_anchor == "out"
+    # 未知布局回退为 row，导出只保留文件名
+    assert (plan.layout, plan.export) == ("row", "x.png")
+    assert Plan.from_dict(plan.to_dict()) == plan
+
+
+def test_parse_plan_returns_none_when_not_worth_splitting():
+    assert parse_plan(_reply({"parts": []})) is None
+    assert parse_plan(_reply({"parts": PLAN["parts"][:1]})) is None
+
+
+@pytest.mark.parametrize("reply, message", [
+    ("没有代码块", "不是合法的 JSON"),
+    (_reply('{"parts": [,]}'), "不是合法的 JSON"),
+    (_reply({"parts": [PLAN["parts"][0], PLAN["parts"][0]]}), "不重复"),
+    (_reply({**PLAN, "links": [{"from": "encoder.nope", "to": "decoder.memory"}]}), "未声明的锚点"),
+    (_reply({**PLAN, "links": [{"from": "ghost.out", "to": "decoder.memory"}]}), "不存在的子图"),
+    (_reply({"parts": [{**PLAN["parts"][0], "anchors": {"x": {"side": "middle"}}},
+                       PLAN["parts"][1]]}), "side"),
+    (_reply({"parts": [dict(PLAN["parts"][0], name=f"p{i}") for i in range(MAX_PARTS + 1)]}),
+     "子图过多"),
+])
+def test_parse_plan_rejects_malformed_plans(reply, message):
+    with pytest.raises(PlanError, match=message):
+        parse_plan(reply)
+
+
+def test_compose_spec_places_parts_and_links_anchors():
+    plan = parse_plan(_reply(PLAN))
+    files = {"encoder": ("/p/encoder.svg", (100.0, 80.0)), "decoder": ("/p/decoder.svg", (60, 120))}
+    spec = compose_spec(plan, files, "/out/whole.png")
+    assert (spec["width"], spec["height"]) == (100 + 60 + 80 + 120, 120 + 120)
+    assert spec["arrows"] == [{"from": "encoder", "to": "decoder", "fromSide": "right",
+                               "fromAt": 50.0, "toSide": "left", "toAt": 50.0}]
+    assert [e["src"] for e in spec["elements"]] == ["/p/encoder.svg", "/p/decoder.svg"]
+    assert svg_size(SVG) == (120.0, 80.0)
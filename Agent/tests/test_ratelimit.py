@@ -0,0 +1,90 @@
+import pytest
+
+from ratelimit import (RateLimitedLLM, RateLimiter, TokenBucket, backoff_delay, is_throttled,
+                       limits_for)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_burst_then_queues_in_arrival_order():
+    clock = Clock()
+    bucket = TokenBucket(per_minute=60, burst=2, clock=clock)   # 1/s，容量 2
+    assert [bucket.reserve(1) for _ in range(4)] == [0.0, 0.0, 1.0, 2.0]
+
+
+def test_bucket_refills_up_to_capacity():
+    clock = Clock()
+    bucket = TokenBucket(per_minute=60, burst=2, clock=clock)
+    bucket.reserve(2)
+    clock.now = 1.0
+    assert bucket.reserve(1) == 0.0
+    clock.now = 100.0
+    # 空闲再久也只攒满 capacity
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 1.0]
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(per_minute=0)
+    assert bucket.reserve(10 ** 6) == 0.0
+
+
+def test_adjust_charges_actual_usage():
+    clock = Clock()
+    bucket = TokenBucket(per_minute=600, burst=1, clock=clock)   # 10/s，容量 10
+    bucket.reserve(5)
+    bucket.adjust(15)             # 实际用了 20
+    assert bucket.reserve(0) == pytest.approx(1.0)
+
+
+def test_pause_holds_the_group_and_overlapping_pauses_do_not_stack():
+    clock = Clock()
+    limiter = RateLimiter(rpm=60, burst=1, clock=clock)
+    assert limiter.reserve(0) == 0.0
+    limiter.pause(5)
+    limiter.pause(3)
+    assert limiter.reserve(0) == pytest.approx(6.0)
+    assert limiter.reserve(0) == pytest.approx(7.0)
+    assert limiter.summary()["throttled"] == 2
+
+
+class _Response:
+    status_code = 429
+    headers = {"retry-after": "7"}
+
+
+class _HTTPError(Exception):
+    response = _Response()
+
+
+def test_backoff_honours_retry_after_and_cap():
+    assert 7.0 <= backoff_delay(0, base=1.0, error=_HTTPError()) <= 8.0
+    assert backoff_delay(10, base=1.0, cap=4.0) <= 4.0
+    assert is_throttled(_HTTPError())
+
+
+def test_limits_for_prefers_model_override():
+    settings = {"rpm": 10, "tpm": 0,
+                "providers": {"claude": {"rpm": 50}, "claude/opus": {"tpm": 900}}}
+    limits = limits_for(settings, "claude", "opus")
+    assert (limits["rpm"], limits["tpm"]) == (50, 900)
+
+
+def test_routed_client_still_pauses_the_group_on_429():
+    class Throttling:
+        def invoke(self, messages, **kwargs):
+            raise _HTTPError()
+
+    clock = Clock()
+    limiter = RateLimiter(clock=clock)
+    llm = RateLimitedLLM(Throttling(), limiter, max_retries=0)
+    with pytest.raises(_HTTPError):
+        llm.invoke([])
+    # 不重试，但同组的下一次调用（HedgedLLM 的下一轮）排在 Retry-After 之后
+    assert limiter.reserve(0) >= 7.0
+    assert limiter.summary()["retries"] == 0
@@ -0,0 +1,64 @@
+from retrieval import (BM25Index, Retriever, Snippet, attach_context, split_markdown,
+                       strip_context, tokenize)
+
+
+def _index(docs):
+    return BM25Index.build([Snippet(i, i, t) for i, t in docs], [t for _, t in docs])
+
+
+def _retriever(index, **kwargs):
+    retriever = Retriever(path=None, **kwargs)
+    retriever._index = index
+    return retriever
+
+
+def test_tokenize_splits_camel_case_and_chinese_bigrams():
+    assert tokenize("fanArrows") == ["fanarrows", "fan", "arrows"]
+    assert tokenize("神经网络 3D") == ["神经", "经网", "网络", "3", "d"]
+
+
+def test_split_markdown_ignores_headings_inside_code_fences():
+    text = ("# Guide\n## Arrows\n" + "arrow text " * 5 + "\n```bash\n# not a heading\n```\n"
+            "## Groups\n" + "group text " * 5)
+    snippets = split_markdown("guide.md", text)
+    assert [s.title for s in snippets] == ["guide.md › Arrows", "guide.md › Groups"]
+    assert "# not a heading" in snippets[0].text
+
+
+def test_bm25_ranks_rare_matching_terms_first():
+    index = _index([
+        ("layout", "row col grid layout of boxes"),
+        ("cylinder", "cylinder database shape with boxes"),
+        ("boxes", "boxes boxes boxes"),
+    ])
+    hits = index.search("cylinder boxes", k=3)
+    assert hits[0][1].id == "cylinder"
+    assert [s for s, _ in hits] == sorted((s for s, _ in hits), reverse=True)
+    assert index.search("unrelated", k=3) == []
+
+
+def test_index_round_trips_through_dict():
+    index = _index([("a", "alpha beta"), ("b", "beta gamma")])
+    restored = BM25Index.from_dict(index.to_dict())
+    assert [(round(s, 6), d.id) for s, d in restored.search("gamma", 2)] == \
+        [(round(s, 6), d.id) for s, d in index.search("gamma", 2)]
+
+
+def test_min_ratio_drops_weak_hits():
+    index = _index([
+        ("strong", "tensor tensor cuboid feature map"),
+        ("weak", "a long unrelated paragraph that mentions tensor once " * 4),
+    ])
+    assert [d.id for _, d in _retriever(index, min_ratio=0.0).search("tensor cuboid")] == \
+        ["strong", "weak"]
+    assert [d.id for _, d in _retriever(index, min_ratio=0.4).search("tensor cuboid")] == \
+        ["strong"]
+
+
+def test_context_respects_max_chars_and_strips_cleanly():
+    index = _index([("a", "arrow " * 50), ("b", "arrow fork " * 50)])
+    retriever = _retriever(index, min_ratio=0.0, max_chars=400)
+    context, ids = retriever.context("arrow")
+    assert len(ids) == 1
+    assert strip_context(attach_context("画一个箭头", context)) == "画一个箭头"
+    assert _retriever(index).context("nothing here") == ("", [])
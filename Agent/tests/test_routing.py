@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import pytest
+
+import routing
+from routing import HedgedLLM
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+class FakeLLM:
+    """按顺序返回 / 抛出 replies 中的结果"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def invoke(self, messages, **kwargs):
+        return self._next()
+
+    async def ainvoke(self, messages, **kwargs):
+        return self._next()
+
+    def generate(self, batches, **kwargs):
+        return self._next()
+
+    async def agenerate(self, batches, **kwargs):
+        return self._next()
+
+    def stream(self, messages, **kwargs):
+        yield self._next()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waited = []
+    monkeypatch.setattr(routing.time, "sleep", waited.append)
+    return waited
+
+
+def _router(**llms):
+    return HedgedLLM(llms, hedge=False, retries=2, backoff_base=0.5, backoff_max=4.0)
+
+
+def test_all_providers_throttled_backs_off_and_retries_the_ranking(sleeps):
+    a, b = FakeLLM(Throttled(), Throttled(), "a"), FakeLLM(Throttled(), Throttled())
+    assert _router(a=a, b=b).invoke([]) == "a"
+    assert (a.calls, b.calls) == (3, 2)
+    assert len(sleeps) == 2 and all(0 < s <= 4.0 for s in sleeps)
+
+
+def test_gives_up_after_retries_rounds(sleeps):
+    a, b = FakeLLM(*[Throttled()] * 3), FakeLLM(*[Throttled()] * 3)
+    with pytest.raises(Throttled):
+        _router(a=a, b=b).invoke([])
+    assert (a.calls, b.calls, len(sleeps)) == (3, 3, 2)
+
+
+def test_non_retryable_errors_are_not_retried(sleeps):
+    a, b = FakeLLM(BadRequest()), FakeLLM("b")
+    with pytest.raises(BadRequest):
+        _router(a=a, b=b).invoke([])
+    assert (b.calls, sleeps) == (0, [])
+
+
+def test_async_and_stream_paths_back_off_too(sleeps, monkeypatch):
+    async def no_wait(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(routing.asyncio, "sleep", no_wait)
+    router = _router(a=FakeLLM(Throttled(), "a1", Throttled(), "a2"),
+                     b=FakeLLM(Throttled(), Throttled()))
+    assert asyncio.run(router.ainvoke([])) == "a1"
+    assert list(router.stream([])) == ["a2"]
+    assert len(sleeps) == 2
+
+
+def test_generate_fails_over_instead_of_going_to_the_primary_only(sleeps):
+    a, b = FakeLLM(Throttled(), Throttled()), FakeLLM("b1", "b2")
+    router = _router(a=a, b=b)
+    assert router.generate([[]], n=3) == "b1"
+    assert asyncio.run(router.agenerate([[]], n=3)) == "b2"
+    # a 失败后错误率超过阈值，第二次直接排到 b 之后
+    assert (a.calls, b.calls, sleeps) == (1, 2, [])
+
+
+class Slow:
+    def __init__(self, delay, reply):
+        self.delay, self.reply = delay, reply
+        self.finished = False
+
+    def invoke(self, messages, **kwargs):
+        time.sleep(self.delay)
+        self.finished = True
+        if isinstance(self.reply, Exception):
+            raise self.reply
+        return self.reply
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.finished = True
+        if isinstance(self.reply, Exception):
+            raise self.reply
+        return self.reply
+
+
+@pytest.mark.parametrize("hedged_reply", ["b", Throttled()])
+def test_non_retryable_error_waits_for_the_hedged_leg(hedged_reply):
+    # a 在对冲发出后以 400 失败，b 仍在进行：等 b 结束，成功就用它的结果
+    def router(a, b):
+        return HedgedLLM({"a": a, "b": b}, hedge_min=0.05, hedge_default=0.05, retries=0)
+
+    def check(run):
+        a, b = Slow(0.15, BadRequest()), Slow(0.3, hedged_reply)
+        if isinstance(hedged_reply, str):
+            assert run(router(a, b)) == hedged_reply
+        else:
+            with pytest.raises(BadRequest):
+                run(router(a, b))
+        assert b.finished
+
+    check(lambda r: r.invoke([]))
+    check(lambda r: asyncio.run(r.ainvoke([])))
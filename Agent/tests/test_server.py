@@ -0,0 +1,132 @@
+import base64
+import http.client
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from executor import Artifact
+from server import AgentService, Busy, make_handler
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+
+
+class FakeApp:
+    """代替编译好的图：回复固定代码，导出内容只放在 artifacts 中；gate 未打开时阻塞"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.states = []
+
+    def invoke(self, state):
+        self.states.append(state)
+        self.gate.wait(5)
+        code = f"// v{len(self.states)}"
+        out = os.path.join(state["output_dir"], "out.svg")
+        return {
+            "messages": list(state["messages"]) + [AIMessage(content=f"```typescript\n{code}\n```")],
+            "last_code": code, "output_file": out, "error": None,
+            "artifacts": [Artifact(out, "svg", SVG)],
+        }
+
+
+@pytest.fixture
+def served(tmp_path):
+    app = FakeApp()
+    service = AgentService(app, "tongyi", str(tmp_path), concurrency=1, queue_size=1,
+                           per_client=1)
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    def post(path, body, client="a"):
+        conn = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+        conn.request("POST", path, json.dumps(body), {"X-Client-Id": client})
+        resp = conn.getresponse()
+        data = json.loads(resp.read())
+        conn.close()
+        return resp.status, data
+
+    yield service, app, post
+    app.gate.set()
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+
+def _wait_for(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_admit_and_release_track_capacity_and_clients(tmp_path):
+    service = AgentService(FakeApp(), "tongyi", str(tmp_path), concurrency=1, queue_size=1,
+                           per_client=1)
+    service._admit("a")
+    with pytest.raises(Busy, match="在途请求已达上限"):
+        service._admit("a")
+    service._admit("b")
+    with pytest.raises(Busy, match="队列已满"):
+        service._admit("c")
+    service._release("a")
+    service._release("b")
+    assert service.status()["queue"]["clients"] == {}
+    service._admit("c")
+    service.close()
+
+
+def test_generate_inline_without_saving_then_refine(served, tmp_path):
+    service, app, post = served
+    status, body = post("/generate", {"prompt": "画一个流程图", "save": False, "inline": True})
+    assert status == 200 and body["success"]
+    assert body["output_file"] is None
+    [artifact] = body["artifacts"]
+    assert base64.b64decode(artifact["data"]) == SVG
+    assert not os.path.exists(artifact["path"])
+
+    status, body = post("/refine", {"session": body["session"], "prompt": "改成横向"})
+    assert status == 200 and body["success"]
+    assert "artifacts" not in body
+    assert os.path.exists(body["output_file"])
+    # 追问以上一版代码为增量编辑的基础
+    assert app.states[-1]["base_code"] == "// v1"
+
+
+def test_refine_unknown_session_is_404(served):
+    _, app, post = served
+    status, body = post("/refine", {"session": "nope", "prompt": "改一下"})
+    assert status == 404 and "会话不存在" in body["error"]
+    assert app.states == []
+
+
+def test_busy_clients_and_full_queue_get_429(served):
+    service, app, post = served
+    app.gate.clear()
+    results = []
+    first = threading.Thread(target=lambda: results.append(post("/generate", {"prompt": "1"})))
+    first.start()
+    _wait_for(lambda: service.status()["queue"]["running"] == 1)
+
+    status, body = post("/generate", {"prompt": "2"}, client="a")
+    assert status == 429 and "在途请求已达上限" in body["error"]
+
+    queued = threading.Thread(
+        target=lambda: results.append(post("/generate", {"prompt": "3"}, client="b")))
+    queued.start()
+    _wait_for(lambda: service.status()["queue"]["queued"] == 1)
+    status, body = post("/generate", {"prompt": "4"}, client="c")
+    assert status == 429 and body["error"] == "队列已满"
+
+    app.gate.set()
+    first.join(5)
+    queued.join(5)
+    assert [s for s, _ in results] == [200, 200]
+    queue = service.status()["queue"]
+    assert (queue["running"], queue["queued"], queue["clients"]) == (0, 0, {})
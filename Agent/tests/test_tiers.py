@@ -0,0 +1,23 @@
+from tiers import TierStats
+
+
+def test_stats_accumulate_across_instances_and_skip_bad_lines(tmp_path):
+    path = tmp_path / "tiers.jsonl"
+    a, b = TierStats(path), TierStats(path)
+    a.record("fast", 3, True)
+    b.record("fast", 3, False)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"tier": "fast", "compl\n')  # 写到一半的行
+    a.record("strong", 12, True)
+    assert a.by_complexity() == {
+        "fast": {3: {"ok": 1, "failed": 1}},
+        "strong": {12: {"ok": 1, "failed": 0}},
+    }
+    assert a.summary()["fast"]["ok"] == 1
+
+
+def test_stats_without_path_stay_in_memory():
+    stats = TierStats(None)
+    stats.record("fast", 1, True)
+    assert stats.summary()["fast"]["ok"] == 1
+    assert stats.by_complexity() == {}
@@ -0,0 +1,45 @@
+import json
+import os
+
+from validator import FLOWING_ROOT, validate_code, validate_spec
+
+HEADER = f"import {{ Figure }} from '{FLOWING_ROOT}/src'\nconst fig = new Figure(400, 300)\n"
+
+
+def _rules(errors):
+    return [e.rule for e in errors]
+
+
+def test_arrow_enum_values_are_checked():
+    code = HEADER + (
+        "const a = fig.rect('A')\nconst b = fig.rect('B')\n"
+        "fig.arrow(a, b, { path: 'zigzag', from: { side: 'middle', at: 30 } })\n"
+        "fig.export('out.png')\n")
+    errors = [e for e in validate_code(code) if e.rule == "enum"]
+    assert sorted(e.message.split(":")[0] for e in errors) == ["path", "side"]
+    assert all(e.line == 5 for e in errors)
+
+
+def test_enum_keys_outside_arrow_calls_are_ignored():
+    code = HEADER + (
+        "const meta = { path: './x.png', style: 'bold', from: 'db', to: 'api' }\n"
+        "const a = fig.rect('A', { label: meta.path })\n"
+        "fig.arrows(a, [a], { label: '(a)', style: 'dashed' })\n"
+        "fig.export('out.png')\n")
+    assert "enum" not in _rules(validate_code(code))
+
+
+def test_relative_export_resolves_against_flowing_root(tmp_path, monkeypatch):
+    # 与 Python 进程的当前目录无关
+    monkeypatch.chdir(tmp_path)
+    code = HEADER + "fig.export('Agent/out.png')\n"
+    assert "export_dir" not in _rules(validate_code(code, os.path.join(FLOWING_ROOT, "Agent")))
+    assert "export_dir" in _rules(validate_code(code, os.path.join(FLOWING_ROOT, "examples")))
+
+
+def test_spec_relative_export_resolves_against_flowing_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spec = json.dumps({"elements": [{"id": "a", "type": "rect"}],
+                       "export": {"path": "gallery/out.svg"}})
+    assert "export_dir" not in _rules(validate_spec(spec, os.path.join(FLOWING_ROOT, "gallery")))
+    assert "export_dir" in _rules(validate_spec(spec, os.path.join(FLOWING_ROOT, "Agent")))
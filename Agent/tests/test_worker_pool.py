@@ -0,0 +1,69 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+import executor
+import worker_pool
+from worker_pool import CancelToken, WorkerError, WorkerPool
+
+
+class HangingWorker:
+    """代替 npx tsx 的 worker：任务一直不返回，直到进程被杀"""
+    started = []
+
+    def __init__(self, root):
+        self.jobs = 0
+        self.proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        HangingWorker.started.append(self)
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def run(self, path, timeout, capture=False, formats=(), preview=False):
+        self.proc.wait()
+        raise WorkerError("worker 进程已退出")
+
+    def close(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    HangingWorker.started = []
+    monkeypatch.setattr(worker_pool, "RenderWorker", HangingWorker)
+    pool = WorkerPool(size=1, timeout=60)
+    yield pool
+    pool.close()
+    for w in HangingWorker.started:
+        w.close()
+
+
+def test_cancelling_aexecute_code_kills_the_pooled_worker(pool, monkeypatch):
+    monkeypatch.setattr(executor, "_pool", pool)
+
+    async def cancel_soon():
+        task = asyncio.ensure_future(executor.aexecute_code("// x", persist=False))
+        while not HangingWorker.started:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_soon())
+    [worker] = HangingWorker.started
+    assert worker.proc.wait(5) is not None
+    # 名额已让出
+    assert pool._slots.acquire(timeout=5)
+
+
+def test_cancelled_token_does_not_start_a_job(pool):
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(WorkerError, match="已取消"):
+        pool.run("/tmp/x.ts", cancel=token)
+    assert HangingWorker.started == []
+    assert pool._slots.acquire(timeout=0)
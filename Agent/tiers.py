@@ -0,0 +1,190 @@
+"""模型分档 — 按请求复杂度先用快速便宜的模型，执行失败或静态检查出错后升档
+
+复杂度是对请求的粗略打分：描述的框 / 步骤数，加上 3D、公式、分组、分叉、网络结构等
+较难画好的元素，追问时还计入上一版代码中的元素数。分数不超过某档 max_complexity 的请求
+从该档开始（按配置顺序取第一个），其余直接使用当前配置的模型（strong 档）。
+
+各档的调用次数、成功率、升档次数与 LLM 延迟记在进程内，同时按 (档位, 复杂度)
+追加到 ~/.flowing/tiers.jsonl，汇总后据此调整 max_complexity：python tiers.py
+"""
+
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import CONFIG_DIR
+from metrics import percentile, tracer
+
+STATS_FILE = CONFIG_DIR / "tiers.jsonl"
+
+# 当前配置的模型所在的最高档
+STRONG_TIER = "strong"
+
+# 较难画好的元素，每出现一类加 FEATURE_WEIGHT 分
+HARD_FEATURES = {
+    "3d": ("3d", "立体", "cuboid", "cylinder", "sphere", "张量", "tensor", "特征图", "feature map"),
+    "formula": ("公式", "formula", "latex", "markdown"),
+    "group": ("分组", "容器", "嵌套", "子图", "group", "nested", "subgraph", "container"),
+    "fork": ("分叉", "汇合", "回路", "循环", "反馈", "fork", "merge", "loop", "feedback"),
+    "network": ("神经网络", "架构", "transformer", "resnet", "encoder", "decoder", "attention",
+                "architecture", "network"),
+    "layout": ("对齐", "网格", "并排", "align", "grid", "side by side"),
+}
+FEATURE_WEIGHT = 3
+
+# 步骤之间的分隔：箭头、逗号、顿号、分号、换行、"然后"
+_SEPARATORS = re.compile(r"→|->|=>|⇒|，|,|、|;|；|\n|然后|接着|\bthen\b", re.I)
+# "8 个步骤"、"5 layers" 这类显式数量
+_COUNT = re.compile(
+    r"(\d+)\s*(?:个|步|层|块|框|节点|阶段|boxes|nodes|steps|stages|layers|blocks)", re.I)
+# 上一版代码中的元素：TypeScript 的 new Xxx(...) 或 JSON 图表描述的 "type"
+_ELEMENT = re.compile(r"\bnew\s+[A-Z]\w*\s*\(|\"type\"\s*:")
+
+
+def estimate_complexity(request: str, base_code: Optional[str] = None) -> int:
+    """请求的复杂度打分：框数 + 每类难点 FEATURE_WEIGHT 分 + 每 200 字 1 分"""
+    text = request.lower()
+    boxes = sum(1 for part in _SEPARATORS.split(request) if part.strip())
+    counts = [int(n) for n in _COUNT.findall(request)]
+    if counts:
+        boxes = max(boxes, max(counts))
+    if base_code:
+        boxes = max(boxes, len(_ELEMENT.findall(base_code)))
+    features = sum(any(word in text for word in words) for words in HARD_FEATURES.values())
+    return boxes + FEATURE_WEIGHT * features + len(request) // 200
+
+
+class TierStats:
+    """各档的调用结果与 LLM 延迟；每次结果追加一行到 JSONL 文件，读取时按 (档位, 复杂度) 汇总
+
+    只追加不改写：多个进程同时记录不会互相覆盖，写到一半的行在汇总时跳过。
+    """
+
+    def __init__(self, path=STATS_FILE, window: int = 200):
+        self.path = path
+        self._latency: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._counts: Dict[str, list] = defaultdict(lambda: [0, 0, 0])  # 成功, 失败, 升档
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        data: dict = {}
+        if not self.path:
+            return data
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                        entry = data.setdefault(row["tier"], {}).setdefault(
+                            str(row["complexity"]), {"ok": 0, "failed": 0})
+                        entry["ok" if row["ok"] else "failed"] += 1
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue
+        except OSError:
+            pass
+        return data
+
+    def record_latency(self, tier: str, seconds: float) -> None:
+        with self._lock:
+            self._latency[tier].append(seconds)
+
+    def record(self, tier: str, complexity: int, ok: bool) -> None:
+        """一次生成的最终结果（含本地修补后的重跑）"""
+        with self._lock:
+            self._counts[tier][0 if ok else 1] += 1
+        if not self.path:
+            return
+        line = json.dumps({"tier": tier, "complexity": complexity, "ok": ok}) + "\n"
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            pass
+
+    def record_escalation(self, tier: str) -> None:
+        with self._lock:
+            self._counts[tier][2] += 1
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            counts = {t: list(c) for t, c in self._counts.items()}
+            latency = {t: list(v) for t, v in self._latency.items()}
+        result = {}
+        for tier in sorted(counts.keys() | latency.keys()):
+            ok, failed, escalated = counts.get(tier, (0, 0, 0))
+            values = latency.get(tier, [])
+            result[tier] = {
+                "ok": ok,
+                "failed": failed,
+                "success_rate": round(ok / (ok + failed), 3) if ok + failed else None,
+                "escalated": escalated,
+                "llm_p50": round(percentile(values, 50), 3),
+                "llm_p95": round(percentile(values, 95), 3),
+            }
+        return result
+
+    def by_complexity(self) -> Dict[str, Dict[int, dict]]:
+        """累计数据：档位 → 复杂度 → {ok, failed}"""
+        return {tier: {int(c): v for c, v in rows.items()}
+                for tier, rows in self._load().items()}
+
+
+# 进程内共享的分档统计
+tier_stats = TierStats()
+
+
+@dataclass
+class Tier:
+    name: str
+    llm: object
+    # 不超过该分数的请求从此档开始；None 表示不限（strong 档）
+    max_complexity: Optional[int] = None
+
+
+class ModelTiers:
+    """按复杂度选档、失败后升档；tiers 从快到强排列，最后一档为当前配置的模型"""
+
+    def __init__(self, tiers: List[Tier], stats: TierStats = tier_stats):
+        self.tiers = tiers
+        self.stats = stats
+        self._index = {t.name: i for i, t in enumerate(tiers)}
+
+    def select(self, complexity: int) -> str:
+        for tier in self.tiers:
+            if tier.max_complexity is None or complexity <= tier.max_complexity:
+                return tier.name
+        return self.tiers[-1].name
+
+    def escalate(self, name: str) -> str:
+        """下一档；已是最强一档时不变"""
+        i = self._index.get(name, len(self.tiers) - 1)
+        nxt = self.tiers[min(i + 1, len(self.tiers) - 1)].name
+        if nxt != name:
+            self.stats.record_escalation(name)
+        return nxt
+
+    def llm(self, name: str):
+        return self.tiers[self._index.get(name, len(self.tiers) - 1)].llm
+
+    @contextmanager
+    def timed(self, name: str, complexity: Optional[int]):
+        """记录本档一次 LLM 调用的耗时；span 写入追踪文件，供按复杂度分析"""
+        start = time.perf_counter()
+        with tracer.span("tier", tier=name, complexity=complexity):
+            yield
+        self.stats.record_latency(name, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    for tier, rows in tier_stats.by_complexity().items():
+        print(f"[{tier}]")
+        for complexity, row in sorted(rows.items()):
+            total = row["ok"] + row["failed"]
+            rate = f"{row['ok'] / total:.0%}" if total else "-"
+            print(f"  复杂度 {complexity:>3d}: {row['ok']:>4d}/{total:<4d} 成功率 {rate}")
@@ -0,0 +1,349 @@
+"""执行前静态检查 — 在毫秒级拦截常见错误，省掉一次 tsx 启动和一轮 LLM 修复
+
+API 描述直接从 src/figure.ts、src/elements.ts、src/types.ts 解析，
+库新增方法或枚举值后无需手动同步。查看解析结果: python validator.py
+
+validate_code 检查 TypeScript 脚本，validate_spec 检查 spec 模式的 JSON 图表描述。
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+FLOWING_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(FLOWING_ROOT, "src")
+
+# 箭头配置中的键 → types.ts 中对应的枚举；只在参数含 ArrowConfig 的 Figure 方法
+# （fig.arrow / arrows / fork 等）的实参里检查，path、style 等键在其他对象里另有含义
+ENUM_KEYS = {
+    "head": "ArrowHead",
+    "path": "ArrowPath",
+    "style": "ArrowStyle",
+    "from": "Side",
+    "to": "Side",
+    "side": "Side",
+}
+
+
+@dataclass
+class ApiSpec:
+    """Figure API 的机器可读描述"""
+    figure_methods: Set[str] = field(default_factory=set)
+    element_methods: Set[str] = field(default_factory=set)
+    # 参数含 ArrowConfig 的 Figure 方法
+    arrow_methods: Set[str] = field(default_factory=set)
+    enums: Dict[str, Set[str]] = field(default_factory=dict)
+    # Element 的具体子类（小写即 spec 中的 type）与各配置接口的属性名
+    element_types: Set[str] = field(default_factory=set)
+    interfaces: Dict[str, Set[str]] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "figure_methods": sorted(self.figure_methods),
+            "element_methods": sorted(self.element_methods),
+            "arrow_methods": sorted(self.arrow_methods),
+            "enums": {k: sorted(v) for k, v in self.enums.items()},
+            "element_types": sorted(self.element_types),
+            "interfaces": {k: sorted(v) for k, v in self.interfaces.items()},
+        }
+
+
+@dataclass
+class ValidationError:
+    rule: str
+    message: str
+    line: Optional[int] = None
+
+    def __str__(self) -> str:
+        where = f"第 {self.line} 行: " if self.line else ""
+        return f"[{self.rule}] {where}{self.message}"
+
+
+def _read(name: str) -> str:
+    with open(os.path.join(SRC_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _class_methods(source: str, class_name: str) -> Set[str]:
+    """类体内两格缩进的公开方法（不含 getter）"""
+    m = re.search(rf"export (?:abstract )?class {class_name}\b", source)
+    if not m:
+        return set()
+    start = m.start()
+    end = source.find("\n}", start)
+    body = source[start:end if end > 0 else None]
+    names = set(re.findall(r"^  (?:async\s+)?([A-Za-z_]\w*)\s*[(<]", body, re.M))
+    names.discard("constructor")
+    return names
+
+
+def _methods_taking(source: str, class_name: str, type_name: str) -> Set[str]:
+    """类中参数列表（可跨行）含 type_name 的公开方法"""
+    m = re.search(rf"export (?:abstract )?class {class_name}\b", source)
+    if not m:
+        return set()
+    end = source.find("\n}", m.start())
+    body = source[m.start():end if end > 0 else None]
+    return {name for name, params in re.findall(r"^  (?:async\s+)?([A-Za-z_]\w*)\s*\(([^)]*)\)",
+                                                body, re.M)
+            if re.search(rf"\b{type_name}\b", params)}
+
+
+def _enums(source: str) -> Dict[str, Set[str]]:
+    enums: Dict[str, Set[str]] = {}
+    # export type X = | 'a' | 'b' ...（可跨行）
+    for m in re.finditer(r"export type (\w+) =((?:\s*\|?\s*'[^']+'[^\n]*)+)", source):
+        enums[m.group(1)] = set(re.findall(r"'([^']+)'", m.group(2)))
+    # 接口属性上的内联联合，按 <接口名去掉 Config><属性名> 命名:
+    #   ArrowConfig.style?: 'solid' | 'dashed' | 'dotted'  →  ArrowStyle
+    for iface in re.finditer(r"export interface (\w+) \{(.*?)\n\}", source, re.S):
+        prefix = iface.group(1).replace("Config", "")
+        for m in re.finditer(r"^\s*(\w+)\?:\s*('[^']+'(?:\s*\|\s*'[^']+')+)\s*$",
+                             iface.group(2), re.M):
+            enums[prefix + m.group(1).capitalize()] = set(re.findall(r"'([^']+)'", m.group(2)))
+    return enums
+
+
+def _interfaces(source: str) -> Dict[str, Set[str]]:
+    return {
+        m.group(1): set(re.findall(r"^\s*(\w+)\??:", m.group(2), re.M))
+        for m in re.finditer(r"export interface (\w+) \{(.*?)\n\}", source, re.S)
+    }
+
+
+@lru_cache(maxsize=1)
+def load_api_spec() -> ApiSpec:
+    elements = _read("elements.ts")
+    figure = _read("figure.ts")
+    return ApiSpec(
+        figure_methods=_class_methods(figure, "Figure"),
+        arrow_methods=_methods_taking(figure, "Figure", "ArrowConfig"),
+        element_methods=_class_methods(elements, "Element"),
+        enums=_enums(_read("types.ts")),
+        element_types={c.lower() for c in re.findall(r"export class (\w+) extends Element\b", elements)},
+        interfaces=_interfaces(_read("types.ts")),
+    )
+
+
+def _line_of(code: str, pos: int) -> int:
+    return code.count("\n", 0, pos) + 1
+
+
+def _call_args(code: str, methods: Set[str]) -> List[Tuple[int, str]]:
+    """.method(...) 调用的实参文本及其起始位置；按括号配对，跳过字符串里的括号"""
+    if not methods:
+        return []
+    calls = []
+    names = "|".join(sorted(methods))
+    for m in re.finditer(rf"\.(?:{names})\s*\(", code):
+        depth, quote, i = 1, None, m.end()
+        while i < len(code) and depth:
+            c = code[i]
+            if quote:
+                if c == "\\":
+                    i += 1
+                elif c == quote:
+                    quote = None
+            elif c in "'\"`":
+                quote = c
+            elif c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+            i += 1
+        calls.append((m.end(), code[m.end():i - 1]))
+    return calls
+
+
+def _export_target(target: str) -> str:
+    """脚本由 tsx 在 FLOWING_ROOT 下执行，相对导出路径以它为基准（同 executor.resolve_path）"""
+    return os.path.normpath(target if os.path.isabs(target) else os.path.join(FLOWING_ROOT, target))
+
+
+def validate_code(code: str, output_dir: Optional[str] = None,
+                  spec: Optional[ApiSpec] = None) -> List[ValidationError]:
+    """检查生成的代码，返回问题列表（空列表表示通过）"""
+    spec = spec or load_api_spec()
+    errors: List[ValidationError] = []
+    expected_import = f"{FLOWING_ROOT}/src"
+
+    # 1. import 路径
+    imports = list(re.finditer(
+        r"""import\s*\{[^}]*\bFigure\b[^}]*\}\s*from\s*['"]([^'"]+)['"]""", code))
+    if not imports:
+        errors.append(ValidationError(
+            "import", f"缺少 import {{ Figure }} from '{expected_import}'"))
+    for m in imports:
+        if m.group(1).rstrip("/") not in (expected_import, f"{expected_import}/index"):
+            errors.append(ValidationError(
+                "import", f"import 路径应为 '{expected_import}'，实际为 '{m.group(1)}'",
+                _line_of(code, m.start())))
+
+    # 2. main() 调用
+    if re.search(r"\bfunction\s+main\s*\(", code) and not re.search(r"^\s*(?:await\s+)?main\(\)", code, re.M):
+        errors.append(ValidationError("main", "定义了 main() 但没有调用，代码末尾需要加上 main()"))
+
+    # 3. 导出
+    exports = list(re.finditer(r"""\.export\(\s*(['"`])([^'"`]*)\1""", code))
+    if not re.search(r"\.export\(", code):
+        errors.append(ValidationError("export", "没有调用 fig.export()，不会产生输出文件"))
+    if output_dir:
+        root = os.path.abspath(output_dir)
+        for m in exports:
+            target = m.group(2)
+            if "${" in target:
+                continue
+            if not _export_target(target).startswith(root + os.sep):
+                errors.append(ValidationError(
+                    "export_dir", f"导出路径 '{target}' 不在输出目录 {root}/ 下",
+                    _line_of(code, m.start())))
+
+    # 4. Figure / Element 上不存在的方法
+    fig_vars = set(re.findall(r"\b(?:const|let|var)\s+(\w+)\s*(?::\s*\w+\s*)?=\s*new\s+Figure\b", code))
+    el_vars = {
+        m.group(1) for m in re.finditer(
+            r"\b(?:const|let|var)\s+(\w+)\s*=\s*\w+\.(\w+)\s*\(", code)
+        if m.group(2) in spec.element_methods
+    }
+    for kind, names, methods in (("Figure", fig_vars, spec.figure_methods),
+                                 ("Element", el_vars - fig_vars, spec.element_methods)):
+        if not methods:
+            continue
+        for name in names:
+            for m in re.finditer(rf"(?<![\w.]){re.escape(name)}\.(\w+)\s*\(", code):
+                if m.group(1) not in methods:
+                    errors.append(ValidationError(
+                        "method", f"{kind} 没有方法 {name}.{m.group(1)}()，"
+                                  f"可用: {', '.join(sorted(methods))}",
+                        _line_of(code, m.start())))
+
+    # 5. 箭头配置的枚举取值
+    for start, args in _call_args(code, spec.arrow_methods):
+        for key, enum in ENUM_KEYS.items():
+            allowed = spec.enums.get(enum)
+            if not allowed:
+                continue
+            for m in re.finditer(rf"""\b{key}\s*:\s*['"]([^'"]*)['"]""", args):
+                if m.group(1) not in allowed:
+                    errors.append(ValidationError(
+                        "enum", f"{key}: '{m.group(1)}' 无效，可选: {' | '.join(sorted(allowed))}",
+                        _line_of(code, start + m.start())))
+
+    return errors
+
+
+# spec 中箭头的端点写法（元素 id 与锚点拆开），对应 ArrowConfig.from / to
+SPEC_ARROW_KEYS = {"from", "to", "fromSide", "fromAt", "toSide", "toAt"}
+SPEC_ENUM_KEYS = {"head": "ArrowHead", "path": "ArrowPath", "style": "ArrowStyle",
+                  "fromSide": "Side", "toSide": "Side"}
+SPEC_LISTS = ("elements", "arrows", "fanArrows", "forks", "groups", "layouts")
+
+
+def _ids(value) -> List[str]:
+    return value if isinstance(value, list) else [value]
+
+
+def validate_spec(code: str, output_dir: Optional[str] = None,
+                  spec: Optional[ApiSpec] = None) -> List[ValidationError]:
+    """检查 JSON 图表描述：元素类型、配置键与枚举按 types.ts 校验，引用的 id 必须存在
+
+    worker 端的 zod schema 会静默丢弃未知键，这里把它们报出来（例如把 pos 写成 position）。
+    """
+    spec = spec or load_api_spec()
+    try:
+        diagram = json.loads(code)
+    except ValueError as e:
+        return [ValidationError("json", f"不是合法的 JSON: {e}")]
+    if not isinstance(diagram, dict):
+        return [ValidationError("json", "图表描述应为 JSON 对象")]
+
+    errors: List[ValidationError] = []
+    lists: Dict[str, list] = {}
+    for key in SPEC_LISTS:
+        value = diagram.get(key, [])
+        if not isinstance(value, list):
+            errors.append(ValidationError("json", f"{key} 应为数组"))
+        lists[key] = value if isinstance(value, list) else []
+
+    def unknown_keys(where: str, item: dict, allowed: Set[str]) -> None:
+        if not spec.interfaces:
+            return
+        for key in sorted(set(item) - allowed):
+            errors.append(ValidationError(
+                "config", f"{where} 没有属性 {key}，可用: {', '.join(sorted(allowed))}"))
+
+    # 1. 元素
+    ids: Set[str] = set()
+    element_keys = {"id", "type", "label", "src"} | spec.interfaces.get("ElementConfig", set())
+    for i, el in enumerate(lists["elements"]):
+        where = f"elements[{i}]"
+        if not isinstance(el, dict) or not isinstance(el.get("id"), str):
+            errors.append(ValidationError("element", f"{where} 缺少字符串 id"))
+            continue
+        if el["id"] in ids:
+            errors.append(ValidationError("element", f"元素 id '{el['id']}' 重复"))
+        ids.add(el["id"])
+        if spec.element_types and el.get("type") not in spec.element_types:
+            errors.append(ValidationError(
+                "element", f"{where}.type: '{el.get('type')}' 无效，"
+                           f"可选: {' | '.join(sorted(spec.element_types))}"))
+        unknown_keys(where, el, element_keys)
+
+    # 2. 引用的元素 id
+    refs = []
+    for key in ("arrows", "fanArrows", "forks"):
+        for i, item in enumerate(lists[key]):
+            if isinstance(item, dict):
+                refs += [(f"{key}[{i}].{end}", v)
+                         for end in ("from", "to") for v in _ids(item.get(end))]
+    for i, item in enumerate(lists["groups"]):
+        if isinstance(item, dict):
+            refs += [(f"groups[{i}].members", v) for v in item.get("members") or []]
+    for i, item in enumerate(lists["layouts"]):
+        if isinstance(item, dict):
+            refs += [(f"layouts[{i}].elements", v) for v in item.get("elements") or []]
+    for where, ref in refs:
+        if ref not in ids:
+            errors.append(ValidationError("ref", f"{where} 引用了不存在的元素 '{ref}'"))
+
+    # 3. 箭头配置与枚举
+    arrow_keys = SPEC_ARROW_KEYS | spec.interfaces.get("ArrowConfig", set())
+    for key in ("arrows", "fanArrows", "forks"):
+        for i, item in enumerate(lists[key]):
+            if not isinstance(item, dict):
+                continue
+            unknown_keys(f"{key}[{i}]", item, arrow_keys)
+            for field_name, enum in SPEC_ENUM_KEYS.items():
+                allowed = spec.enums.get(enum)
+                value = item.get(field_name)
+                if allowed and isinstance(value, str) and value not in allowed:
+                    errors.append(ValidationError(
+                        "enum", f"{key}[{i}].{field_name}: '{value}' 无效，"
+                                f"可选: {' | '.join(sorted(allowed))}"))
+
+    # 4. 导出
+    export = diagram.get("export")
+    if not isinstance(export, dict) or not export.get("path"):
+        errors.append(ValidationError("export", "缺少 export.path，不会产生输出文件"))
+    else:
+        unknown_keys("export", export, {"path"} | spec.interfaces.get("ExportOptions", set()))
+        target = str(export["path"])
+        root = os.path.abspath(output_dir) if output_dir else None
+        if root and not _export_target(target).startswith(root + os.sep):
+            errors.append(ValidationError(
+                "export_dir", f"导出路径 '{target}' 不在输出目录 {root}/ 下"))
+
+    return errors
+
+
+def format_errors(errors: List[ValidationError]) -> str:
+    lines = ["静态检查未通过（代码尚未执行）:"]
+    lines.extend(f"- {e}" for e in errors)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(json.dumps(load_api_spec().to_dict(), indent=2, ensure_ascii=False))
@@ -0,0 +1,260 @@
+"""常驻 Node 渲染 worker 池 — 避免每次执行都重新启动 npx / node / tsx / sharp"""
+
+import json
+import os
+import queue
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional, Sequence
+
+FLOWING_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_SCRIPT = os.path.join(FLOWING_ROOT, "Agent", "render_worker.ts")
+
+# 协议行前缀，与 render_worker.ts 保持一致
+MARK = "@@flowing@@"
+
+
+class WorkerError(Exception):
+    """worker 进程异常（启动失败、崩溃、超时）"""
+
+
+class CancelToken:
+    """取消正在池中执行的任务：cancel() 杀掉执行它的 worker，run() 随即抛 WorkerError 并释放名额
+
+    asyncio 取消等待线程并不会停止线程里的任务，由调用方在 CancelledError 时调用 cancel()。
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._worker: Optional["RenderWorker"] = None
+        self._lock = threading.Lock()
+
+    def attach(self, worker: Optional["RenderWorker"]) -> None:
+        with self._lock:
+            self._worker = worker
+            if worker is not None and self.cancelled:
+                worker.proc.kill()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            if self._worker is not None:
+                self._worker.proc.kill()
+
+
+class RenderWorker:
+    """单个常驻 worker 进程，串行处理任务"""
+
+    def __init__(self, root: str = FLOWING_ROOT, start_timeout: float = 60):
+        self.jobs = 0
+        self._next_id = 0
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stderr: deque = deque(maxlen=50)
+        self.proc = subprocess.Popen(
+            ["npx", "tsx", WORKER_SCRIPT],
+            cwd=root,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+        msg = self._next_message(start_timeout)
+        if not msg.get("ready"):
+            self.close()
+            raise WorkerError(f"worker 启动失败: {msg}")
+
+    def _read_stdout(self) -> None:
+        for line in self.proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _read_stderr(self) -> None:
+        for line in self.proc.stderr:
+            self._stderr.append(line)
+
+    def _next_message(self, timeout: float, stray: Optional[list] = None) -> dict:
+        """读取下一条协议消息；非协议行收集到 stray"""
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError
+            if line is None:
+                raise WorkerError("worker 进程已退出:\n" + "".join(self._stderr))
+            if line.startswith(MARK):
+                return json.loads(line[len(MARK):])
+            if stray is not None:
+                stray.append(line)
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def run(self, path: str, timeout: float, capture: bool = False,
+            formats: Sequence[str] = (), preview: bool = False) -> dict:
+        """执行一个脚本文件，返回 {"ok", "stdout", "error", "artifacts"}
+
+        capture=True 时导出内容不落盘，以 base64 放在 artifacts 中返回。
+        formats 为每次导出额外输出的格式；preview=True 时写出 SVG 预览即返回，
+        结果带 "background" 时须再调用 finish() 等待后台导出。
+        """
+        self._next_id += 1
+        job_id = self._next_id
+        job = {"id": job_id, "file": path, "capture": capture}
+        if formats:
+            job["formats"] = list(formats)
+        if preview:
+            job["preview"] = True
+        try:
+            self.proc.stdin.write(json.dumps(job) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerError(f"worker 写入失败: {e}")
+
+        stray: list = []
+        while True:
+            msg = self._next_message(timeout, stray)
+            if msg.get("id") == job_id:
+                break
+        self.jobs += 1
+        if stray:
+            msg["stdout"] = "".join(stray) + (msg.get("stdout") or "")
+        return msg
+
+    def finish(self, job_id: int, timeout: float) -> dict:
+        """等待渐进导出的后台阶段，返回 {"ok", "files", "error"}"""
+        while True:
+            msg = self._next_message(timeout)
+            if msg.get("id") == job_id and msg.get("done"):
+                return msg
+
+    def close(self) -> None:
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=2)
+            except Exception:
+                self.proc.kill()
+                self.proc.wait()
+
+
+class WorkerPool:
+    """固定上限的 worker 池
+
+    size:     最多同时存活的 worker 数（即最大并发执行数）
+    timeout:  单个任务的超时秒数，超时的 worker 会被杀掉重建
+    max_jobs: 每个 worker 执行 N 个任务后回收，防止内存泄漏 / 模块状态累积
+    """
+
+    def __init__(self, size: int = 2, timeout: float = 30, max_jobs: int = 50,
+                 root: str = FLOWING_ROOT):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.root = root
+        self._idle: list = []
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.size)
+        self._closed = False
+
+    def warm(self) -> None:
+        """后台预启动所有 worker，不阻塞调用方"""
+        def spawn():
+            try:
+                w = RenderWorker(self.root)
+            except Exception:
+                return
+            with self._lock:
+                if self._closed or len(self._idle) >= self.size:
+                    w.close()
+                else:
+                    self._idle.append(w)
+
+        for _ in range(self.size):
+            threading.Thread(target=spawn, daemon=True).start()
+
+    def _acquire(self) -> RenderWorker:
+        with self._lock:
+            while self._idle:
+                w = self._idle.pop()
+                if w.alive:
+                    return w
+                w.close()
+        return RenderWorker(self.root)
+
+    def _release(self, worker: RenderWorker) -> None:
+        if not worker.alive or worker.jobs >= self.max_jobs:
+            worker.close()
+            return
+        with self._lock:
+            if self._closed:
+                worker.close()
+            else:
+                self._idle.append(worker)
+
+    def run(self, path: str, capture: bool = False, formats: Sequence[str] = (),
+            preview: bool = False, cancel: Optional[CancelToken] = None) -> dict:
+        """在空闲 worker 上执行脚本；超时抛 TimeoutError，worker 故障或被取消抛 WorkerError
+
+        preview=True 且有后台导出时，结果的 "exports" 为 Future，完成时给出写入的文件列表；
+        在此之前 worker 与并发名额仍被占用（后台阶段不受 cancel 影响）。
+        """
+        self._slots.acquire()
+        if cancel is not None and cancel.cancelled:
+            self._slots.release()
+            raise WorkerError("任务已取消")
+        worker = None
+        try:
+            worker = self._acquire()
+            if cancel is not None:
+                cancel.attach(worker)
+            result = worker.run(path, self.timeout, capture, formats, preview)
+            if cancel is not None:
+                cancel.attach(None)
+        except BaseException:
+            # 超时或崩溃：worker 状态未知，直接丢弃
+            if worker is not None:
+                worker.proc.kill()
+                worker.close()
+            self._slots.release()
+            raise
+        if not result.get("background"):
+            self._release(worker)
+            self._slots.release()
+            return result
+
+        result["exports"] = Future()
+        threading.Thread(target=self._finish, args=(worker, result, result["exports"]),
+                         daemon=True).start()
+        return result
+
+    def _finish(self, worker: RenderWorker, result: dict, future: Future) -> None:
+        try:
+            msg = worker.finish(result["id"], self.timeout)
+        except BaseException as e:
+            worker.proc.kill()
+            worker.close()
+            error = f"后台导出超时 ({self.timeout:g}s)" if isinstance(e, TimeoutError) else str(e)
+            future.set_exception(WorkerError(error))
+        else:
+            self._release(worker)
+            if msg.get("ok"):
+                future.set_result(msg.get("files") or [])
+            else:
+                future.set_exception(WorkerError(msg.get("error") or "后台导出失败"))
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for w in idle:
+            w.close()
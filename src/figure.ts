@@ -8,7 +8,7 @@ import {
 } from './elements'
 import {
   ElementConfig, ArrowConfig, ArrowHead, Bounds, Point,
-  Side, AnchorSpec, AnchorPoint, StrokeConfig, ExportOptions,
+  Side, AnchorSpec, AnchorPoint, StrokeConfig, ExportOptions, ExportFormat,
 } from './types'
 
 // --- 内部 Arrow 类 ---
@@ -2543,91 +2543,102 @@ export class Figure {
     return parts.join('\n')
   }
 
+  /**
+   * 渲染为指定格式的二进制内容，不写文件（'svg' / 'png' / 'jpg' / 'webp' / 'pdf'，可带前导点）。
+   * 供需要在内存中传递结果的调用方使用，export() 也基于它实现。
+   */
+  async toBuffer(format: ExportFormat | string, options?: ExportOptions): Promise<Buffer> {
+    return encodeSvg(this.render(options), format, options, { width: this.width, height: this.height })
+  }
+
   /** 导出文件，格式根据扩展名自动判断（.svg / .png / .jpg / .webp / .pdf） */
   async export(filePath: string, options?: ExportOptions): Promise<void> {
-    const ext = path.extname(filePath).toLowerCase()
-
-    if (ext === '.svg') {
-      const svg = this.render(options)
-      fs.writeFileSync(filePath, svg, 'utf-8')
-      console.log(`Exported → ${filePath}`)
-      return
-    }
-
-    // 渲染 SVG 并计算实际尺寸
-    const svg = this.render(options)
-
-    // 从 SVG 中提取宽高
-    const wMatch = svg.match(/width="(\d+\.?\d*)"/)
-    const hMatch = svg.match(/height="(\d+\.?\d*)"/)
-    const svgW = wMatch ? parseFloat(wMatch[1]) : this.width
-    const svgH = hMatch ? parseFloat(hMatch[1]) : this.height
-
-    if (ext === '.pdf') {
-      // 矢量 PDF：使用 pdfkit + svg-to-pdfkit
-      let PDFDocument: any
-      let SVGtoPDF: any
-      try {
-        PDFDocument = (await import('pdfkit')).default
-        SVGtoPDF = (await import('svg-to-pdfkit')).default
-      } catch {
-        throw new Error(
-          `导出 PDF 格式需要 pdfkit 和 svg-to-pdfkit。请运行: npm install pdfkit svg-to-pdfkit`,
-        )
-      }
-
-      const doc = new PDFDocument({ size: [svgW, svgH], margin: 0 })
-      const stream = doc.pipe(fs.createWriteStream(filePath))
-      SVGtoPDF(doc, svg, 0, 0, { width: svgW, height: svgH, preserveAspectRatio: 'xMidYMid meet' })
-      doc.end()
-      await new Promise<void>((resolve, reject) => {
-        stream.on('finish', resolve)
-        stream.on('error', reject)
-      })
-
-      console.log(`Exported → ${filePath}`)
-      return
-    }
+    const buf = await this.toBuffer(path.extname(filePath), options)
+    fs.writeFileSync(filePath, buf)
+    console.log(`Exported → ${filePath}`)
+  }
+}
 
-    // 光栅格式需要 sharp
-    let sharp: typeof import('sharp')
+/**
+ * 把 render() 得到的 SVG 字符串编码为指定格式（'svg' / 'png' / 'jpg' / 'webp' / 'pdf'，可带前导点）。
+ * 同一份 SVG 可以编码为多种格式而不必重新渲染；fallback 为 SVG 中读不到宽高时使用的尺寸。
+ */
+export async function encodeSvg(
+  svg: string,
+  format: ExportFormat | string,
+  options?: ExportOptions,
+  fallback: { width: number; height: number } = { width: 0, height: 0 },
+): Promise<Buffer> {
+  const ext = '.' + format.replace(/^\./, '').toLowerCase()
+  if (ext === '.svg') return Buffer.from(svg, 'utf-8')
+
+  // 从 SVG 中提取宽高
+  const wMatch = svg.match(/width="(\d+\.?\d*)"/)
+  const hMatch = svg.match(/height="(\d+\.?\d*)"/)
+  const svgW = wMatch ? parseFloat(wMatch[1]) : fallback.width
+  const svgH = hMatch ? parseFloat(hMatch[1]) : fallback.height
+
+  if (ext === '.pdf') {
+    // 矢量 PDF：使用 pdfkit + svg-to-pdfkit
+    let PDFDocument: any
+    let SVGtoPDF: any
     try {
-      sharp = (await import('sharp')).default as any
+      PDFDocument = (await import('pdfkit')).default
+      SVGtoPDF = (await import('svg-to-pdfkit')).default
     } catch {
       throw new Error(
-        `导出 ${ext} 格式需要 sharp 包。请运行: npm install sharp`,
+        `导出 PDF 格式需要 pdfkit 和 svg-to-pdfkit。请运行: npm install pdfkit svg-to-pdfkit`,
       )
     }
 
-    const scale = options?.scale ?? 2
-    const quality = options?.quality ?? 90
-    const svgBuf = Buffer.from(svg)
-    const outW = Math.round(svgW * scale)
-    const outH = Math.round(svgH * scale)
-
-    if (ext === '.png') {
-      await sharp(svgBuf, { density: 72 * scale })
-        .resize(outW, outH)
-        .png()
-        .toFile(filePath)
-    } else if (ext === '.jpg' || ext === '.jpeg') {
-      // JPG 不支持透明，加白色背景
-      await sharp(svgBuf, { density: 72 * scale })
-        .resize(outW, outH)
-        .flatten({ background: '#ffffff' })
-        .jpeg({ quality })
-        .toFile(filePath)
-    } else if (ext === '.webp') {
-      await sharp(svgBuf, { density: 72 * scale })
-        .resize(outW, outH)
-        .webp({ quality })
-        .toFile(filePath)
-    } else {
-      throw new Error(`不支持的格式: ${ext}。支持 .svg / .png / .jpg / .webp / .pdf`)
-    }
-
-    console.log(`Exported → ${filePath}`)
+    const doc = new PDFDocument({ size: [svgW, svgH], margin: 0 })
+    const chunks: Buffer[] = []
+    doc.on('data', (chunk: Buffer) => chunks.push(chunk))
+    const done = new Promise<void>((resolve, reject) => {
+      doc.on('end', resolve)
+      doc.on('error', reject)
+    })
+    SVGtoPDF(doc, svg, 0, 0, { width: svgW, height: svgH, preserveAspectRatio: 'xMidYMid meet' })
+    doc.end()
+    await done
+    return Buffer.concat(chunks)
+  }
+
+  // 光栅格式需要 sharp
+  let sharp: typeof import('sharp')
+  try {
+    sharp = (await import('sharp')).default as any
+  } catch {
+    throw new Error(
+      `导出 ${ext} 格式需要 sharp 包。请运行: npm install sharp`,
+    )
   }
+
+  const scale = options?.scale ?? 2
+  const quality = options?.quality ?? 90
+  const svgBuf = Buffer.from(svg)
+  const outW = Math.round(svgW * scale)
+  const outH = Math.round(svgH * scale)
+
+  if (ext === '.png') {
+    return sharp(svgBuf, { density: 72 * scale })
+      .resize(outW, outH)
+      .png()
+      .toBuffer()
+  } else if (ext === '.jpg' || ext === '.jpeg') {
+    // JPG 不支持透明，加白色背景
+    return sharp(svgBuf, { density: 72 * scale })
+      .resize(outW, outH)
+      .flatten({ background: '#ffffff' })
+      .jpeg({ quality })
+      .toBuffer()
+  } else if (ext === '.webp') {
+    return sharp(svgBuf, { density: 72 * scale })
+      .resize(outW, outH)
+      .webp({ quality })
+      .toBuffer()
+  }
+  throw new Error(`不支持的格式: ${ext}。支持 .svg / .png / .jpg / .webp / .pdf`)
 }
 
 /** 四舍五入到 2 位小数，返回数字 */
@@ -1,4 +1,4 @@
-export { Figure } from './figure'
+export { Figure, encodeSvg } from './figure'
 export type { FigureOptions } from './figure'
 export { Element, Rect, Circle, Text, Image, Diamond, Trapezoid, Cylinder, Cuboid, Sphere, Stack } from './elements'
 export type {
@@ -8,5 +8,5 @@ export type {
   ElementConfig, ArrowConfig,
   ArrowHead, ArrowPath,
   Bounds, Point,
-  ExportOptions,
+  ExportOptions, ExportFormat,
 } from './types'
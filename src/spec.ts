@@ -0,0 +1,341 @@
+/**
+ * 图表 JSON 描述 — schema 与解释器
+ *
+ * 同一份 DiagramSpec 既是 MCP create_diagram 工具的参数，也是 Agent 的 spec 模式
+ * （模型输出 JSON 而不是 TypeScript 程序）交给常驻渲染 worker 的任务内容。
+ * 字段与 types.ts 中的 ElementConfig / ArrowConfig / ExportOptions 一一对应。
+ */
+
+import { z } from 'zod'
+import { Figure } from './figure'
+import { Element } from './elements'
+import type { ArrowConfig, ElementConfig, Side, StrokeConfig, ShadowConfig } from './types'
+
+// ══════════════════════════════════════════════════════════════
+//  Zod Schemas
+// ══════════════════════════════════════════════════════════════
+
+const StrokeSchema = z.union([
+  z.string(),
+  z.object({
+    color: z.string().optional(),
+    width: z.number().optional(),
+    dash: z.array(z.number()).optional(),
+  }),
+])
+
+const ShadowSchema = z.union([
+  z.boolean(),
+  z.object({
+    dx: z.number().optional(),
+    dy: z.number().optional(),
+    blur: z.number().optional(),
+    color: z.string().optional(),
+  }),
+])
+
+export const ElementSchema = z.object({
+  id: z.string(),
+  type: z.enum(['rect', 'circle', 'text', 'image', 'diamond', 'trapezoid', 'cylinder', 'cuboid', 'sphere', 'stack']),
+  label: z.string().default(''),
+  src: z.string().optional(),
+  pos: z.tuple([z.number(), z.number()]).optional(),
+  size: z.tuple([z.number(), z.number()]).optional(),
+  fill: z.string().optional(),
+  fillOpacity: z.number().optional(),
+  color: z.string().optional(),
+  stroke: StrokeSchema.optional(),
+  radius: z.number().optional(),
+  r: z.number().optional(),
+  fontSize: z.number().optional(),
+  fontFamily: z.string().optional(),
+  fontColor: z.string().optional(),
+  fontWeight: z.union([z.string(), z.number()]).optional(),
+  bold: z.boolean().optional(),
+  opacity: z.number().optional(),
+  shadow: ShadowSchema.optional(),
+  padding: z.number().optional(),
+  depth: z.number().optional(),
+  count: z.number().optional(),
+  stackOffset: z.tuple([z.number(), z.number()]).optional(),
+  topRatio: z.number().optional(),
+})
+
+const ArrowConfigFields = {
+  fromSide: z.enum(['top', 'bottom', 'left', 'right']).optional(),
+  fromAt: z.number().optional(),
+  toSide: z.enum(['top', 'bottom', 'left', 'right']).optional(),
+  toAt: z.number().optional(),
+  label: z.string().optional(),
+  style: z.enum(['solid', 'dashed', 'dotted']).optional(),
+  color: z.string().optional(),
+  width: z.number().optional(),
+  head: z.enum([
+    'triangle', 'triangle-open', 'stealth', 'vee',
+    'circle', 'circle-open', 'diamond', 'diamond-open',
+    'bar', 'dot', 'none',
+  ]).optional(),
+  headSize: z.number().optional(),
+  bidirectional: z.boolean().optional(),
+  path: z.enum(['straight', 'curve', 'polyline']).optional(),
+  curve: z.number().optional(),
+  cornerRadius: z.number().optional(),
+  labelOffset: z.number().optional(),
+}
+
+export const ArrowSchema = z.object({
+  from: z.string(),
+  to: z.string(),
+  ...ArrowConfigFields,
+})
+
+export const FanArrowSchema = z.object({
+  from: z.union([z.string(), z.array(z.string())]),
+  to: z.union([z.string(), z.array(z.string())]),
+  ...ArrowConfigFields,
+})
+
+export const ForkSchema = z.object({
+  from: z.string(),
+  to: z.array(z.string()),
+  ...ArrowConfigFields,
+})
+
+export const GroupSchema = z.object({
+  members: z.array(z.string()),
+  label: z.string().optional(),
+  fill: z.string().optional(),
+  stroke: StrokeSchema.optional(),
+  radius: z.number().optional(),
+  padding: z.number().optional(),
+  fontSize: z.number().optional(),
+  fontColor: z.string().optional(),
+  size: z.tuple([z.number(), z.number()]).optional(),
+})
+
+export const LayoutSchema = z.object({
+  type: z.enum(['row', 'col', 'grid']),
+  elements: z.array(z.string()),
+  gap: z.number().optional(),
+  cols: z.number().optional(),
+  rowGap: z.number().optional(),
+  colGap: z.number().optional(),
+})
+
+export const FontSchema = z.object({
+  name: z.string(),
+  source: z.string().optional(),
+})
+
+export const ExportSchema = z.object({
+  path: z.string(),
+  fit: z.boolean().optional(),
+  margin: z.number().optional(),
+  scale: z.number().optional(),
+  quality: z.number().optional(),
+})
+
+export const DiagramSchema = z.object({
+  width: z.number().optional(),
+  height: z.number().optional(),
+  bg: z.string().optional(),
+  fontFamily: z.string().optional(),
+  mathFont: z.string().optional(),
+  codeFont: z.string().optional(),
+  fonts: z.array(z.string()).optional(),
+  fontRegistrations: z.array(FontSchema).optional(),
+  autoAlign: z.boolean().optional(),
+  antiOverlap: z.boolean().optional(),
+  alignTolerance: z.number().optional(),
+  elements: z.array(ElementSchema).default([]),
+  arrows: z.array(ArrowSchema).default([]),
+  fanArrows: z.array(FanArrowSchema).default([]),
+  forks: z.array(ForkSchema).default([]),
+  groups: z.array(GroupSchema).default([]),
+  layouts: z.array(LayoutSchema).default([]),
+  export: ExportSchema.optional(),
+})
+
+export type DiagramSpec = z.infer<typeof DiagramSchema>
+
+/** 校验任意 JSON 并补全默认值；不合法时抛出逐条列出字段路径的错误 */
+export function parseSpec(input: unknown): DiagramSpec {
+  const result = DiagramSchema.safeParse(input)
+  if (result.success) return result.data
+  const lines = result.error.issues.map(issue => {
+    const where = issue.path.length ? issue.path.map(String).join('.') : '(root)'
+    return `  ${where}: ${issue.message}`
+  })
+  throw new Error(`图表描述不符合 schema:\n${lines.join('\n')}`)
+}
+
+// ══════════════════════════════════════════════════════════════
+//  Build Diagram
+// ══════════════════════════════════════════════════════════════
+
+function buildElementConfig(el: z.infer<typeof ElementSchema>): ElementConfig {
+  const cfg: ElementConfig = {}
+  if (el.pos) cfg.pos = el.pos
+  if (el.size) cfg.size = el.size
+  if (el.fill) cfg.fill = el.fill
+  if (el.fillOpacity != null) cfg.fillOpacity = el.fillOpacity
+  if (el.color) cfg.color = el.color
+  if (el.stroke) cfg.stroke = el.stroke as string | StrokeConfig
+  if (el.radius != null) cfg.radius = el.radius
+  if (el.r != null) cfg.r = el.r
+  if (el.fontSize != null) cfg.fontSize = el.fontSize
+  if (el.fontFamily) cfg.fontFamily = el.fontFamily
+  if (el.fontColor) cfg.fontColor = el.fontColor
+  if (el.fontWeight != null) cfg.fontWeight = el.fontWeight
+  if (el.bold != null) cfg.bold = el.bold
+  if (el.opacity != null) cfg.opacity = el.opacity
+  if (el.shadow != null) cfg.shadow = el.shadow as boolean | ShadowConfig
+  if (el.padding != null) cfg.padding = el.padding
+  if (el.depth != null) cfg.depth = el.depth
+  if (el.count != null) cfg.count = el.count
+  if (el.stackOffset) cfg.stackOffset = el.stackOffset
+  if (el.topRatio != null) cfg.topRatio = el.topRatio
+  return cfg
+}
+
+function buildArrowCfg(arr: { fromSide?: string; fromAt?: number; toSide?: string; toAt?: number; label?: string; style?: string; color?: string; width?: number; head?: string; headSize?: number; bidirectional?: boolean; path?: string; curve?: number; cornerRadius?: number; labelOffset?: number }): ArrowConfig {
+  const cfg: ArrowConfig = {}
+  if (arr.fromSide) {
+    cfg.from = arr.fromAt != null
+      ? { side: arr.fromSide as Side, at: arr.fromAt }
+      : arr.fromSide as Side
+  }
+  if (arr.toSide) {
+    cfg.to = arr.toAt != null
+      ? { side: arr.toSide as Side, at: arr.toAt }
+      : arr.toSide as Side
+  }
+  if (arr.label) cfg.label = arr.label
+  if (arr.style) cfg.style = arr.style as any
+  if (arr.color) cfg.color = arr.color
+  if (arr.width != null) cfg.width = arr.width
+  if (arr.head) cfg.head = arr.head as any
+  if (arr.headSize != null) cfg.headSize = arr.headSize
+  if (arr.bidirectional != null) cfg.bidirectional = arr.bidirectional
+  if (arr.path) cfg.path = arr.path as any
+  if (arr.curve != null) cfg.curve = arr.curve
+  if (arr.cornerRadius != null) cfg.cornerRadius = arr.cornerRadius
+  if (arr.labelOffset != null) cfg.labelOffset = arr.labelOffset
+  return cfg
+}
+
+function resolveElement(map: Map<string, Element>, id: string): Element {
+  const el = map.get(id)
+  if (!el) throw new Error(`Unknown element id: "${id}"`)
+  return el
+}
+
+function resolveElements(map: Map<string, Element>, ids: string | string[]): Element | Element[] {
+  if (Array.isArray(ids)) return ids.map(id => resolveElement(map, id))
+  return resolveElement(map, ids)
+}
+
+export async function buildDiagram(spec: DiagramSpec): Promise<{ svg: string; path?: string }> {
+  const fig = new Figure(spec.width ?? 800, spec.height ?? 400, {
+    bg: spec.bg,
+    fontFamily: spec.fontFamily,
+    mathFont: spec.mathFont,
+    codeFont: spec.codeFont,
+    fonts: spec.fonts,
+    autoAlign: spec.autoAlign,
+    antiOverlap: spec.antiOverlap,
+    alignTolerance: spec.alignTolerance,
+  })
+
+  // 0. Register fonts
+  if (spec.fontRegistrations) {
+    for (const f of spec.fontRegistrations) {
+      fig.font(f.name, f.source)
+    }
+  }
+
+  const map = new Map<string, Element>()
+
+  // 1. Create elements
+  for (const el of spec.elements) {
+    const cfg = buildElementConfig(el)
+    let element: Element
+    switch (el.type) {
+      case 'rect':      element = fig.rect(el.label, cfg); break
+      case 'circle':    element = fig.circle(el.label, cfg); break
+      case 'text':      element = fig.text(el.label, cfg); break
+      case 'image':     element = fig.image(el.src || el.label, cfg); break
+      case 'diamond':   element = fig.diamond(el.label, cfg); break
+      case 'trapezoid': element = fig.trapezoid(el.label, cfg); break
+      case 'cylinder':  element = fig.cylinder(el.label, cfg); break
+      case 'cuboid':    element = fig.cuboid(el.label, cfg); break
+      case 'sphere':    element = fig.sphere(el.label, cfg); break
+      case 'stack':     element = fig.stack(el.label, cfg); break
+      default: throw new Error(`Unknown element type: ${el.type}`)
+    }
+    map.set(el.id, element)
+  }
+
+  // 2. Apply layouts
+  for (const layout of spec.layouts) {
+    const els = layout.elements.map(id => resolveElement(map, id))
+    switch (layout.type) {
+      case 'row': fig.row(els, { gap: layout.gap }); break
+      case 'col': fig.col(els, { gap: layout.gap }); break
+      case 'grid': fig.grid(els, { cols: layout.cols, gap: layout.gap, rowGap: layout.rowGap, colGap: layout.colGap }); break
+    }
+  }
+
+  // 3. Create arrows
+  for (const arr of spec.arrows) {
+    const from = resolveElement(map, arr.from)
+    const to = resolveElement(map, arr.to)
+    fig.arrow(from, to, buildArrowCfg(arr))
+  }
+
+  // 4. Create fan arrows (1→N, N→1, N→N)
+  for (const fan of spec.fanArrows) {
+    const from = resolveElements(map, fan.from)
+    const to = resolveElements(map, fan.to)
+    fig.arrows(from as any, to as any, buildArrowCfg(fan))
+  }
+
+  // 5. Create forks (shared trunk)
+  for (const fk of spec.forks) {
+    const from = resolveElement(map, fk.from)
+    const targets = (fk.to as string[]).map(id => resolveElement(map, id))
+    fig.fork(from, targets, buildArrowCfg(fk))
+  }
+
+  // 6. Create groups
+  for (const grp of spec.groups) {
+    const members = grp.members.map(id => resolveElement(map, id))
+    fig.group(members, {
+      label: grp.label,
+      fill: grp.fill,
+      stroke: grp.stroke as any,
+      radius: grp.radius,
+      padding: grp.padding,
+      fontSize: grp.fontSize,
+      fontColor: grp.fontColor,
+      size: grp.size,
+    })
+  }
+
+  // 7. Export
+  const svg = fig.render(spec.export ? { fit: spec.export.fit, margin: spec.export.margin } : undefined)
+
+  let exportPath: string | undefined
+  if (spec.export?.path) {
+    await fig.export(spec.export.path, {
+      fit: spec.export.fit,
+      margin: spec.export.margin,
+      scale: spec.export.scale,
+      quality: spec.export.quality,
+    })
+    exportPath = spec.export.path
+  }
+
+  return { svg, path: exportPath }
+}
+
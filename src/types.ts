@@ -144,6 +144,9 @@ export interface Point {
   y: number
 }
 
+/** 导出格式 */
+export type ExportFormat = 'svg' | 'png' | 'jpg' | 'jpeg' | 'webp' | 'pdf'
+
 /** 导出选项 */
 export interface ExportOptions {
   /** 分辨率倍数，仅光栅格式有效（默认 2） */